@@ -1,5 +1,42 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import User, Book, Loan
+from django.urls import reverse
+from django.utils.html import format_html
+from . import bulk, changes
+from .models import User, Book, Loan, Hold, BulkJob, Task
+from .pagination import CountingPaginator
+
+
+def bulk_admin_action(name):
+    """
+    Admin action running ``api.bulk`` action ``name``: inline for small
+    selections, as a background ``BulkJob`` above ``BULK_ACTION_THRESHOLD``.
+    """
+    @admin.action(description=bulk.ACTIONS[name].description)
+    def run(modeladmin, request, queryset):
+        total = queryset.count()
+        if total > settings.BULK_ACTION_THRESHOLD:
+            job = bulk.start(name, queryset, total, request.user)
+            url = reverse('admin:api_bulkjob_change', args=[job.pk])
+            modeladmin.message_user(request, format_html(
+                'Queued <a href="{}">bulk job #{}</a> for {} rows; its progress is listed under Bulk jobs.',
+                url, job.pk, total,
+            ))
+        else:
+            changed = bulk.apply(name, queryset)
+            modeladmin.message_user(request, f'Changed {changed} of {total} selected rows.')
+    run.__name__ = name
+    return run
+
+
+class SoftDeleteAdminMixin:
+    """Deletes leave tombstones for the change feed (see ``api.changes``)."""
+
+    def delete_model(self, request, obj):
+        obj.soft_delete()
+
+    def delete_queryset(self, request, queryset):
+        changes.soft_delete(queryset)
 
 
 @admin.register(User)
@@ -17,25 +54,102 @@ class UserAdmin(admin.ModelAdmin):
 
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'author', 'isbn', 'page_count', 'availability')
     list_filter = ('availability',)
-    search_fields = ('title', 'author', 'isbn')
+    # ISBNs are matched exactly so they use the unique index
+    search_fields = ('title', 'author', '=isbn')
+    paginator = CountingPaginator
+    show_full_result_count = False
+    actions = [bulk_admin_action('mark_available'), bulk_admin_action('mark_unavailable')]
     readonly_fields = ()
     fieldsets = (
         (None, {'fields': ('title', 'author', 'isbn')}),
         ('Details', {'fields': ('page_count', 'availability')}),
     )
 
+    def get_deleted_objects(self, objs, request):
+        # Books out on loan can't be deleted; list their loans as protected
+        deleted, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        loans = Loan.objects.filter(book__in=objs, is_returned=False).select_related('user', 'book')
+        protected = [*protected, *(f'Active loan: {loan}' for loan in loans)]
+        return deleted, model_count, perms_needed, protected
+
+    def delete_model(self, request, obj):
+        changes.delete_books(Book.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        changes.delete_books(queryset)
+
 
 @admin.register(Loan)
-class LoanAdmin(admin.ModelAdmin):
+class LoanAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'book', 'loan_date', 'due_date', 'return_date', 'is_returned')
-    list_filter = ('loan_date', 'due_date', 'is_returned', 'return_date')
-    search_fields = ('user__username', 'book__title', 'book__author')
+    list_filter = ('loan_date', 'due_date', 'is_returned', 'return_date', 'archived')
+    # Exact matches on indexed columns, plus book titles by prefix (see
+    # get_search_results); a substring search across both joins scans every loan.
+    search_fields = ('=user__username', '=book__isbn')
+    search_help_text = 'Username, ISBN, or the beginning of a book title (case-sensitive).'
+    list_select_related = ('user', 'book')
+    raw_id_fields = ('user', 'book')
+    paginator = CountingPaginator
+    show_full_result_count = False
+    actions = [bulk_admin_action('force_return'), bulk_admin_action('archive')]
     readonly_fields = ('loan_date',)
     fieldsets = (
         (None, {'fields': ('user', 'book')}),
         ('Dates', {'fields': ('loan_date', 'due_date', 'return_date')}),
-        ('Status', {'fields': ('is_returned',)}),
+        ('Status', {'fields': ('is_returned', 'archived')}),
     )
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # The whole term as a title prefix: book_title_prefix_idx finds the
+            # books, then the book foreign key index their loans
+            titled = Book.objects.filter(title__startswith=search_term.strip()).values('pk')
+            results |= queryset.filter(book__in=titled)
+        return results, may_have_duplicates
+
+
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('user', 'book', 'status', 'created_at', 'loan')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username', 'book__title', 'book__isbn')
+    raw_id_fields = ('user', 'book', 'loan')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'action', 'status', 'progress', 'changed', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'action')
+    exclude = ('selection',)
+    readonly_fields = ('progress',)
+
+    @admin.display(description='Progress')
+    def progress(self, job):
+        percent = 100 * job.done // job.total if job.total else 100
+        return f'{job.done} / {job.total} ({percent}%)'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('=name',)
+    paginator = CountingPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = "api"
+
+    def ready(self):
+        from . import counts, loancache
+        from .models import Book, Hold, Loan, User
+
+        counts.connect_signals([Book, Hold, Loan, User])
+        loancache.connect_signals()
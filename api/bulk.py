@@ -0,0 +1,145 @@
+"""
+Set-based bulk actions for the admin.
+
+Each action applies to a whole selection with a few ``UPDATE`` statements
+instead of one ``save()`` per row. Selections of up to
+``BULK_ACTION_THRESHOLD`` rows are processed inside the admin request.
+Larger ones become a ``BulkJob`` run by the task queue (``manage.py
+run_worker``): it works through the selection in primary-key order,
+``BULK_ACTION_CHUNK_SIZE`` rows per transaction, and records its progress on
+the job for the admin to show. The job stores the primary keys selected, so
+rows added later are left alone and deleted ones are skipped. Every action skips rows it has already
+changed, so a job re-run after its worker died just finishes the rest.
+"""
+
+import logging
+from collections import namedtuple
+from datetime import date
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import circulation, events, loancache, stats
+from .counts import invalidate_counts
+from .models import Book, BulkJob, Hold, Loan
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+BulkAction = namedtuple('BulkAction', 'model description apply')
+
+ACTIONS = {}
+
+
+def bulk_action(name, model, description):
+    def register(func):
+        ACTIONS[name] = BulkAction(model, description, func)
+        return func
+    return register
+
+
+def _set_availability(queryset, availability):
+    changed = list(queryset.exclude(availability=availability).values_list('pk', flat=True))
+    Book.objects.filter(pk__in=changed).update(
+        availability=availability, version=F('version') + 1, updated_at=timezone.now(),
+    )
+    for book_id in changed:
+        transaction.on_commit(partial(events.publish_availability, book_id, availability))
+    invalidate_counts(Book)
+    return len(changed)
+
+
+@bulk_action('mark_available', Book, 'Mark selected books available')
+def mark_available(queryset):
+    return _set_availability(queryset, True)
+
+
+@bulk_action('mark_unavailable', Book, 'Mark selected books unavailable')
+def mark_unavailable(queryset):
+    return _set_availability(queryset, False)
+
+
+@bulk_action('force_return', Loan, 'Force-return selected loans')
+def force_return(queryset):
+    """
+    Return every active loan in ``queryset`` as of today. Books without
+    waiting holds go back on the shelf in one ``UPDATE``; the rest are handed
+    to their next hold, as ``return_book`` does. Deleted books are included:
+    a sync can delete a book that is out on loan here.
+    """
+    loans = list(queryset.filter(is_returned=False).only('id', 'book_id', 'user_id', 'loan_date'))
+    if not loans:
+        return 0
+    today = date.today()
+    book_ids = {loan.book_id for loan in loans}
+    # Lock the books first, in a fixed order, so holds placed meanwhile see
+    # either the loan or the returned book
+    list(Book.all_objects.select_for_update().filter(pk__in=book_ids).order_by('pk').values_list('pk'))
+    Loan.objects.filter(pk__in=[loan.pk for loan in loans]).update(
+        is_returned=True, return_date=today, version=F('version') + 1, updated_at=timezone.now(),
+    )
+    for loan in loans:
+        loan.return_date = today
+    stats.record_returns(loans)
+    loancache.refresh_on_commit(loan.user_id for loan in loans)
+
+    waiting = set(
+        Hold.objects.filter(book_id__in=book_ids, status=Hold.WAITING).values_list('book_id', flat=True)
+    )
+    shelved = book_ids - waiting
+    Book.all_objects.filter(pk__in=shelved).update(availability=True, version=F('version') + 1, updated_at=timezone.now())
+    for book_id in shelved:
+        transaction.on_commit(partial(events.publish_availability, book_id, True))
+    for book in Book.all_objects.filter(pk__in=waiting).order_by('pk'):
+        circulation.release(book)
+    invalidate_counts(Book)
+    invalidate_counts(Loan)
+    return len(loans)
+
+
+@bulk_action('archive', Loan, 'Archive selected returned loans')
+def archive(queryset):
+    archived = queryset.filter(is_returned=True, archived=False).update(
+        archived=True, version=F('version') + 1, updated_at=timezone.now(),
+    )
+    invalidate_counts(Loan)
+    return archived
+
+
+def apply(name, queryset):
+    """Run action ``name`` on ``queryset`` now; returns the number of rows changed."""
+    with transaction.atomic():
+        return ACTIONS[name].apply(queryset)
+
+
+def start(name, queryset, total, user=None):
+    """Queue action ``name`` on the rows of ``queryset`` as a background ``BulkJob``."""
+    with transaction.atomic():
+        job = BulkJob.objects.create(
+            action=name, selection=list(queryset.order_by('pk').values_list('pk', flat=True)),
+            total=total, created_by=user,
+        )
+        run.enqueue(job_id=job.pk)
+    return job
+
+
+@task(priority=-10)
+def run(job_id):
+    """Work through a ``BulkJob`` chunk by chunk, recording progress."""
+    job = BulkJob.objects.get(pk=job_id)
+    action = ACTIONS[job.action]
+    BulkJob.objects.filter(pk=job.pk).update(status=BulkJob.RUNNING, done=0, changed=0)
+    size = settings.BULK_ACTION_CHUNK_SIZE
+    try:
+        for offset in range(0, len(job.selection), size):
+            ids = job.selection[offset:offset + size]
+            changed = apply(job.action, action.model.objects.filter(pk__in=ids))
+            BulkJob.objects.filter(pk=job.pk).update(done=F('done') + len(ids), changed=F('changed') + changed)
+    except Exception as exc:
+        logger.exception('Bulk job %s failed', job.pk)
+        BulkJob.objects.filter(pk=job.pk).update(status=BulkJob.FAILED, error=str(exc), finished_at=timezone.now())
+    else:
+        BulkJob.objects.filter(pk=job.pk).update(status=BulkJob.DONE, finished_at=timezone.now())
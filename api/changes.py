@@ -0,0 +1,178 @@
+"""
+Change feed of books and loans, for mirrors that sync incrementally.
+
+``GET /api/changes/?since=<token>`` returns the rows created, updated or
+deleted since ``token`` (from the previous response's ``next``; omit it to
+start from scratch). Each model is read in ``(updated_at, id)`` order with a
+keyset cursor on ``TrackedModel``'s index, so a page costs one index range
+scan per model however far back the token is, and the token only moves
+forward. Deleted rows are soft-deleted tombstones and are reported by id.
+
+Rows stamped within the last ``CHANGE_FEED_LAG`` seconds are held back
+until the next request: ``updated_at`` is taken before a transaction
+commits, so a row could otherwise become visible with a timestamp older than
+a token already handed out and be skipped. Transactions that take longer
+than the lag to commit can still be missed.
+
+Tombstones are kept for ``CHANGE_TOMBSTONE_DAYS`` and then purged. A
+deleted book stays for as long as loans refer to it, so its loans are never
+removed without tombstones of their own. Each token carries a watermark per
+model, the horizon up to which the client has seen every change; once that
+is older than the retention, the token gets ``410 Gone`` and the client must
+start again without one. Watermarks advance on every request that reaches the end of
+the feed, so a client polling an unchanged catalog never expires. Loans
+deleted along with their user are not reported.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import loancache
+from .counts import invalidate_counts
+from .models import Book, Hold, Loan
+from .serializers import BookSerializer, LoanSerializer
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# Response key, model and serializer of each kind of row, in token order
+FEEDS = {'books': (Book, BookSerializer), 'loans': (Loan, LoanSerializer)}
+
+
+class TokenError(ValueError):
+    pass
+
+
+class OnLoanError(Exception):
+    """Some of the books to delete are out on loan."""
+
+
+def _micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def parse_token(token):
+    """
+    ``{'books': (micros, id, watermark), 'loans': ...}`` from a feed token;
+    empty means the start. ``(micros, id)`` is the last row returned and
+    ``watermark`` the time up to which the client has every change.
+    """
+    if not token:
+        return {name: (0, 0, 0) for name in FEEDS}
+    try:
+        numbers = [int(part) for part in token.split('.')]
+    except ValueError:
+        raise TokenError('Malformed change token.') from None
+    if len(numbers) == 2 * len(FEEDS) and min(numbers) >= 0:
+        # Tokens from before watermarks: the cursor is the best bound known
+        return {name: (*numbers[2 * i:2 * i + 2], numbers[2 * i]) for i, name in enumerate(FEEDS)}
+    if len(numbers) != 3 * len(FEEDS) or min(numbers) < 0:
+        raise TokenError('Malformed change token.')
+    return {name: tuple(numbers[3 * i:3 * i + 3]) for i, name in enumerate(FEEDS)}
+
+
+def format_token(cursors):
+    return '.'.join(str(number) for name in FEEDS for number in cursors[name])
+
+
+def is_expired(cursors, names=FEEDS):
+    """
+    Whether tombstones the client still needs from the feeds in ``names``
+    may already have been purged. It has every change up to its cursor and
+    its watermark, so only older tombstones can be gone; a client starting
+    from scratch needs none.
+    """
+    horizon = _micros(timezone.now() - timedelta(days=settings.CHANGE_TOMBSTONE_DAYS))
+    return any(0 < max(micros, watermark) < horizon for micros, _, watermark in (cursors[name] for name in names))
+
+
+def changed_since(model, cursor, limit, until):
+    """Up to ``limit`` rows of ``model``, live or deleted, after ``cursor`` and up to ``until``, in feed order."""
+    micros, last_id = cursor[:2]
+    after = EPOCH + timedelta(microseconds=micros)
+    rows = model.all_objects.filter(
+        Q(updated_at__gt=after) | Q(updated_at=after, id__gt=last_id), updated_at__lte=until,
+    ).order_by('updated_at', 'id')
+    if model is Loan:
+        rows = rows.select_related('book')
+    return list(rows[:limit])
+
+
+def page(cursors, names, limit):
+    """
+    One page of the feed for the kinds of row in ``names``: the changed rows
+    of each, serialized, and the ids of the deleted ones. Advances
+    ``cursors`` past them.
+
+    A feed whose page is not full is complete up to the lagged horizon,
+    which becomes its watermark, even if nothing changed. A client starting
+    from scratch holds no rows that could have been deleted before its first
+    page, so that page's horizon is its watermark until it catches up.
+    """
+    until = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_LAG)
+    data = {}
+    has_more = False
+    for name in names:
+        model, serializer = FEEDS[name]
+        rows = changed_since(model, cursors[name], limit, until)
+        full = len(rows) == limit
+        has_more = has_more or full
+        micros, last_id, watermark = cursors[name]
+        if rows:
+            micros, last_id = _micros(rows[-1].updated_at), rows[-1].id
+        if not full or not watermark:
+            watermark = _micros(until)
+        cursors[name] = (micros, last_id, watermark)
+        data[name] = {
+            'changed': serializer([row for row in rows if row.deleted_at is None], many=True).data,
+            'deleted': [row.id for row in rows if row.deleted_at is not None],
+        }
+    data['next'] = format_token(cursors)
+    data['has_more'] = has_more
+    data['lag'] = settings.CHANGE_FEED_LAG
+    return data
+
+
+def soft_delete(queryset):
+    """Turn the live rows of ``queryset`` into tombstones with one ``UPDATE``; returns how many."""
+    model = queryset.model
+    now = timezone.now()
+    live = queryset.filter(deleted_at__isnull=True)
+    user_ids = list(live.values_list('user_id', flat=True).distinct()) if model is Loan else []
+    deleted = live.update(deleted_at=now, updated_at=now, version=F('version') + 1)
+    loancache.refresh_on_commit(user_ids)
+    invalidate_counts(model)
+    return deleted
+
+
+def delete_books(queryset, allow_loaned=False):
+    """
+    Soft-delete the books in ``queryset`` and cancel their waiting holds;
+    returns how many were deleted. Raises ``OnLoanError``, deleting nothing,
+    if any of them is out on loan, unless ``allow_loaned``: a sync follows
+    the source regardless, and such loans can still be returned.
+
+    The books are locked first, as borrowing does, so a loan cannot start
+    between the check and the delete.
+    """
+    with transaction.atomic():
+        ids = list(queryset.select_for_update().order_by('pk').values_list('pk', flat=True))
+        if not allow_loaned and Loan.objects.filter(book_id__in=ids, is_returned=False).exists():
+            raise OnLoanError('This book is out on loan; delete it once it has been returned.')
+        Hold.objects.filter(book_id__in=ids, status=Hold.WAITING).update(status=Hold.CANCELLED)
+        return soft_delete(Book.objects.filter(pk__in=ids))
+
+
+def purge_tombstones(days=None):
+    """
+    Delete rows that were soft-deleted more than ``days`` ago; returns how
+    many rows went. A deleted book that loans still refer to is kept, so
+    purging never takes loans (and their history) with it.
+    """
+    days = settings.CHANGE_TOMBSTONE_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    purged = Loan.all_objects.filter(deleted_at__lt=cutoff).delete()[0]
+    unreferenced = ~Exists(Loan.all_objects.filter(book=OuterRef('pk')))
+    return purged + Book.all_objects.filter(unreferenced, deleted_at__lt=cutoff).delete()[0]
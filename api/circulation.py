@@ -0,0 +1,38 @@
+"""Shared steps of lending and returning books."""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+
+from . import events, stats
+from .models import Hold, Loan
+
+
+def release(book):
+    """
+    Hand a returned ``book`` to its oldest waiting hold, or put it back on
+    the shelf. Call inside a transaction holding the book's row lock, so a
+    hold placed concurrently is either handed the book or sees it available.
+
+    Returns the fulfilled hold, or None.
+    """
+    hold = (
+        Hold.objects.select_for_update()
+        .filter(book=book, status=Hold.WAITING)
+        .order_by('id')
+        .first()
+    )
+    if hold is None:
+        book.availability = True
+        book.save(update_fields=['availability'])
+        events.publish_availability_on_commit(book)
+        return None
+    hold.loan = Loan.objects.create(
+        user_id=hold.user_id,
+        book=book,
+        due_date=date.today() + timedelta(days=settings.HOLD_LOAN_DAYS),
+    )
+    hold.status = Hold.FULFILLED
+    hold.save(update_fields=['status', 'loan'])
+    stats.record_borrow(hold.loan)
+    return hold
@@ -0,0 +1,123 @@
+"""
+Count strategies for paginated lists.
+
+An exact ``COUNT(*)`` on a large table can cost more than fetching the page,
+so ``count_queryset`` picks the cheapest answer that is good enough:
+
+* small tables (PostgreSQL's row estimate under ``COUNT_EXACT_THRESHOLD``)
+  are counted exactly;
+* an unfiltered list of a large PostgreSQL table uses the planner's
+  estimate from ``pg_class.reltuples`` (no table scan);
+* anything else is counted exactly, and counts of at least
+  ``COUNT_EXACT_THRESHOLD`` rows are cached for ``COUNT_CACHE_TTL`` seconds
+  per query signature.
+
+The estimate itself is cached the same way, so a list request costs no
+``pg_class`` lookup until the next write.
+
+Cached counts are keyed by a per-model generation number that is bumped on
+every save/delete of the model (signals), so a write invalidates all of the
+model's cached counts at once. The bump waits for the write to commit: a
+reader that counted the old rows in the meantime can only cache them under
+the old generation. Set-based writes (``QuerySet.update()``,
+``bulk_create()``, raw SQL) skip signals and must call
+``invalidate_counts(Model)`` themselves.
+"""
+
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+
+
+def _generation_key(model):
+    return f'count-generation:{model._meta.label_lower}'
+
+
+def generation(model):
+    key = _generation_key(model)
+    value = cache.get(key)
+    if value is None:
+        # Seeded from the clock so an evicted generation never reuses old keys
+        cache.add(key, time.time_ns())
+        value = cache.get(key)
+    return value
+
+
+def _bump(model):
+    try:
+        cache.incr(_generation_key(model))
+    except ValueError:
+        cache.add(_generation_key(model), time.time_ns())
+
+
+def invalidate_counts(model):
+    """Drop every cached count for ``model`` once the current transaction commits."""
+    transaction.on_commit(partial(_bump, model))
+
+
+def table_estimate(model, using='default'):
+    """Planner row estimate for ``model``'s table, or None where unavailable."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [connection.ops.quote_name(model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    # -1 means the table has never been vacuumed or analyzed
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def _signature(queryset):
+    sql, params = queryset.query.sql_with_params()
+    raw = f'{queryset.db}:{sql}:{params!r}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def count_queryset(queryset):
+    """Return ``(count, exact)`` for ``queryset`` using the cheapest suitable strategy."""
+    model = queryset.model
+    threshold = settings.COUNT_EXACT_THRESHOLD
+    # The table estimate is cached next to the counts, under the same
+    # generation, and both are fetched in one cache round trip
+    prefix = f'count:{model._meta.label_lower}:{generation(model)}'
+    estimate_key = f'{prefix}:estimate:{queryset.db}'
+    key = f'{prefix}:{_signature(queryset)}'
+    cached = cache.get_many([estimate_key, key])
+    if estimate_key in cached:
+        estimate = cached[estimate_key]
+    else:
+        estimate = table_estimate(model, queryset.db)
+        cache.set(estimate_key, estimate, settings.COUNT_CACHE_TTL)
+    if estimate is not None and estimate < threshold:
+        return queryset.count(), True
+    # Unfiltered apart from the default manager's own filter (soft-deleted
+    # rows are few, and purged after a while)
+    if estimate is not None and queryset.query.where == model._default_manager.all().query.where:
+        return estimate, False
+
+    count = cached.get(key)
+    if count is None:
+        count = queryset.count()
+        if count >= threshold:
+            cache.set(key, count, settings.COUNT_CACHE_TTL)
+    return count, True
+
+
+def _invalidate_sender(sender, **kwargs):
+    invalidate_counts(sender)
+
+
+def connect_signals(models):
+    for model in models:
+        post_save.connect(_invalidate_sender, sender=model, dispatch_uid=f'counts-save-{model._meta.label_lower}')
+        post_delete.connect(_invalidate_sender, sender=model, dispatch_uid=f'counts-delete-{model._meta.label_lower}')
@@ -0,0 +1,198 @@
+"""
+In-process pub/sub for pushing book availability changes to clients.
+
+``LoanViewSet`` publishes an event after each borrow/return commits; every
+open ``/api/events/`` stream holds a ``Subscription`` that receives it.
+
+Each subscription buffers at most ``max_pending`` events, coalesced per
+book (only the latest availability of a book matters), so a slow client
+costs bounded memory and never slows the publisher. If the buffer still
+overflows, the pending events are dropped and the client is sent a single
+``resync`` event telling it to reload the list instead.
+
+A stream holds its connection open for minutes. Under ASGI that costs a
+coroutine; under WSGI it costs a whole worker, so ``/api/events/`` only
+streams there when ``EVENTS_STREAMING`` says the workers are asynchronous
+(gevent/eventlet). Otherwise it answers ``204 No Content``, which stops
+EventSource from reconnecting, and the page refreshes only after the user's
+own actions, as it does without events. Each process
+serves at most ``EVENTS_MAX_SUBSCRIBERS`` streams; beyond that the endpoint
+answers ``503``.
+
+The broker lives in one process: with several workers, a stream only sees
+changes made through its own worker. Run the stream on a single ASGI
+process, or swap ``broker`` for a cross-process one, when that matters.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.db import transaction
+
+RESYNC = ('resync', {})
+
+
+class BrokerFull(Exception):
+    pass
+
+
+class Subscription:
+    """Bounded, coalescing event buffer for one client connection."""
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = OrderedDict()
+        self._overflowed = False
+        self._cond = threading.Condition()
+        self._waker = None  # (loop, asyncio.Event) while an async reader waits
+
+    def put(self, key, event):
+        with self._cond:
+            if self._overflowed:
+                self.dropped += 1
+            elif key in self._pending or len(self._pending) < self.max_pending:
+                self._pending[key] = event
+            else:
+                self.dropped += len(self._pending) + 1
+                self._pending.clear()
+                self._overflowed = True
+            self._cond.notify()
+            waker = self._waker
+        if waker is not None:
+            loop, ready = waker
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass  # the reader's event loop is already closed
+
+    def _has_events(self):
+        return self._overflowed or bool(self._pending)
+
+    def _drain(self):
+        if self._overflowed:
+            self._overflowed = False
+            return [RESYNC]
+        events = list(self._pending.values())
+        self._pending.clear()
+        return events
+
+    def get(self, timeout):
+        """Block up to ``timeout`` seconds; return pending events (possibly none)."""
+        with self._cond:
+            self._cond.wait_for(self._has_events, timeout)
+            return self._drain()
+
+    async def aget(self, timeout):
+        """Async version of :meth:`get`."""
+        ready = asyncio.Event()
+        with self._cond:
+            if self._has_events():
+                return self._drain()
+            self._waker = (asyncio.get_running_loop(), ready)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            self._waker = None
+            return self._drain()
+
+
+class Broker:
+    """Fans published events out to every live subscription."""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, max_pending=256, max_subscriptions=None):
+        """A new subscription; raises ``BrokerFull`` if ``max_subscriptions`` are already open."""
+        subscription = Subscription(max_pending)
+        with self._lock:
+            if max_subscriptions is not None and len(self._subscriptions) >= max_subscriptions:
+                raise BrokerFull()
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, key, name, data):
+        """Deliver ``(name, data)``; events with the same ``key`` coalesce."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(key, (name, data))
+
+
+broker = Broker()
+
+
+def publish_availability(book_id, availability):
+    broker.publish(('book', book_id), 'availability', {'book': book_id, 'availability': availability})
+
+
+def publish_availability_on_commit(book):
+    """Publish ``book``'s availability once the surrounding transaction commits."""
+    transaction.on_commit(partial(publish_availability, book.pk, book.availability))
+
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+class _Stream:
+    """
+    Server-sent event stream over one subscription. It ends after
+    ``max_duration`` seconds, and EventSource reconnects after ``retry_ms``.
+    ``close()``, which ``StreamingHttpResponse`` calls when the response is
+    done, unsubscribes even if the stream was never read.
+    """
+
+    def __init__(self, subscription, heartbeat, max_duration, retry_ms=3000):
+        self.subscription = subscription
+        self.heartbeat = heartbeat
+        self.max_duration = max_duration
+        self.retry_ms = retry_ms
+
+    def close(self):
+        broker.unsubscribe(self.subscription)
+
+    @staticmethod
+    def _chunk(events):
+        return ''.join(format_event(*event) for event in events) or ': keepalive\n\n'
+
+
+class Stream(_Stream):
+    """Stream for WSGI servers; each read blocks the worker thread."""
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.max_duration
+        try:
+            yield f'retry: {self.retry_ms}\n\n'
+            while (remaining := deadline - time.monotonic()) > 0:
+                yield self._chunk(self.subscription.get(min(self.heartbeat, remaining)))
+        finally:
+            self.close()
+
+
+class AsyncStream(_Stream):
+    """Stream for ASGI servers."""
+
+    async def __aiter__(self):
+        deadline = time.monotonic() + self.max_duration
+        try:
+            yield f'retry: {self.retry_ms}\n\n'
+            while (remaining := deadline - time.monotonic()) > 0:
+                yield self._chunk(await self.subscription.aget(min(self.heartbeat, remaining)))
+        finally:
+            self.close()
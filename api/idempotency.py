@@ -0,0 +1,117 @@
+"""
+``Idempotency-Key`` support for unsafe API calls.
+
+A client that may retry a POST sends a unique ``Idempotency-Key`` header
+(a UUID, say). The first successful response is stored for
+``IDEMPOTENCY_TTL`` seconds; retries with the same key get that response
+back, marked ``Idempotent-Replayed: true``, without running the view again.
+Keys live in the ``IdempotencyKey`` table rather than the cache: a retry
+usually reaches another worker, which a per-process cache would not tell
+that the request already ran. The key's primary key decides which of two
+concurrent requests claims it.
+
+Keys are scoped to the user (or to anonymous callers) and the URL. Reusing
+a key with a different body is a client bug and gets 422; a retry that
+arrives while the first request is still running gets 409. Error responses
+are not stored, so a client can correct the request and retry with the
+same key.
+"""
+
+import functools
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# How long an in-flight request holds its key before a retry may run it again
+LOCK_TIMEOUT = 60
+REPLAYED_RESPONSE_HEADERS = ('Location',)
+
+
+def _stored_key(request, key):
+    scope = request.user.pk if request.user.is_authenticated else 'anonymous'
+    raw = f'{scope}:{request.method}:{request.path}:{key}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _claim(stored_key, fingerprint):
+    """Claim ``stored_key`` for this request; returns the existing row if it is taken, else None."""
+    now = timezone.now()
+    IdempotencyKey.objects.filter(key=stored_key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                key=stored_key, fingerprint=fingerprint, expires_at=now + timedelta(seconds=LOCK_TIMEOUT),
+            )
+    except IntegrityError:
+        # Seen before. If it expired in the meantime, answer 409 and let the
+        # client's next retry claim the key.
+        return IdempotencyKey.objects.filter(key=stored_key).first() or IdempotencyKey(fingerprint=fingerprint)
+    return None
+
+
+def idempotent(view_method):
+    """Decorate a viewset method or action to honour ``Idempotency-Key``."""
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: f'Must be at most {MAX_KEY_LENGTH} characters.'})
+
+        stored_key = _stored_key(request, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        stored = _claim(stored_key, fingerprint)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(key=stored_key).delete()
+            raise
+
+        if status.is_success(response.status_code):
+            IdempotencyKey.objects.filter(key=stored_key).update(
+                status=response.status_code,
+                data=response.data,
+                headers={name: response[name] for name in REPLAYED_RESPONSE_HEADERS if response.has_header(name)},
+                expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL),
+            )
+        else:
+            IdempotencyKey.objects.filter(key=stored_key).delete()
+        return response
+
+    return wrapper
+
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        return Response(
+            {'detail': f'This {HEADER} was already used with a different request body.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if stored.status is None:
+        return Response(
+            {'detail': f'A request with this {HEADER} is still being processed.'},
+            status=status.HTTP_409_CONFLICT,
+        )
+    headers = dict(stored.headers, **{REPLAYED_HEADER: 'true'})
+    return Response(stored.data, status=stored.status, headers=headers)
+
+
+def purge():
+    """Delete keys whose replay window (or in-flight claim) has run out; returns how many."""
+    return IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()[0]
@@ -0,0 +1,49 @@
+"""ISBN checksum and normalization helpers."""
+
+
+def isbn13_check_digit(first12):
+    """Return the check digit for the first 12 digits of an ISBN-13."""
+    total = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def make_isbn13(first12):
+    """Append the check digit to a 12-digit ISBN-13 prefix."""
+    return first12 + isbn13_check_digit(first12)
+
+
+def isbn10_check_digit(first9):
+    """Return the check character (``0``-``9`` or ``X``) for the first 9 digits of an ISBN-10."""
+    remainder = (11 - sum(int(digit) * (10 - index) for index, digit in enumerate(first9)) % 11) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+
+def has_valid_checksum(value):
+    """Whether an ISBN-10 or ISBN-13 (hyphens and spaces allowed) has the right check digit."""
+    isbn = clean(value)
+    if len(isbn) == 13 and isbn.isdigit():
+        return isbn[12] == isbn13_check_digit(isbn[:12])
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        return isbn[9] == isbn10_check_digit(isbn[:9])
+    return False
+
+
+def clean(value):
+    """Strip hyphens and spaces; an ISBN-10 check character ``x`` becomes ``X``."""
+    return value.replace('-', '').replace(' ', '').upper()
+
+
+def normalize(value):
+    """
+    Return ``value`` as a 13-digit ISBN, converting ISBN-10s by prefixing
+    ``978`` and recomputing the check digit. Raises ``ValueError`` if it is
+    neither form.
+    """
+    isbn = clean(value)
+    if len(isbn) == 13 and isbn.isdigit():
+        return isbn
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        return make_isbn13('978' + isbn[:9])
+    if not isbn[:-1].isdigit() or not (isbn[-1:].isdigit() or isbn[-1:] == 'X'):
+        raise ValueError('ISBN must contain only digits (and hyphens/spaces).')
+    raise ValueError('ISBN must be 10 or 13 digits long.')
@@ -0,0 +1,76 @@
+"""
+Per-user cache of active loans.
+
+Borrowers poll their loans far more often than the loans change, and hold
+only a handful, so each user's active loans are cached as serialized
+``LoanSerializer`` rows. The cache is written through on every change: a
+``post_save``/``post_delete`` signal on ``Loan`` fires inside the borrow or
+return's ``transaction.atomic`` block and schedules a refresh with
+``transaction.on_commit``, so the new list is stored only once the change
+has committed (and never for a rolled-back one). Set-based writes
+(``QuerySet.update()``) skip signals and call ``refresh_on_commit()``
+themselves. Book titles are read at request time, so renaming a book (which
+writes no loan) never leaves its old title in the cache.
+
+The refresh happens in the process that made the change, so the lists are
+only cached with ``CACHE_SHARED``; with a per-process cache the other
+workers would keep serving the old list. ``ACTIVE_LOANS_CACHE_TTL`` bounds
+how stale a list can get when a refresh loses a race with a concurrent one.
+"""
+
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import Book, Loan
+from .serializers import LoanSerializer
+
+
+def _key(user_id):
+    return f'active-loans:{user_id}'
+
+
+def _load(user_id):
+    loans = Loan.objects.filter(user_id=user_id, is_returned=False).select_related('book')
+    return [dict(row) for row in LoanSerializer(loans, many=True).data]
+
+
+def _with_current_titles(data):
+    titles = dict(Book.all_objects.filter(pk__in={row['book'] for row in data}).values_list('pk', 'title'))
+    return [{**row, 'book_title': titles.get(row['book'], row['book_title'])} for row in data]
+
+
+def refresh(user_id):
+    """Reload ``user_id``'s active loans from the database into the cache."""
+    data = _load(user_id)
+    cache.set(_key(user_id), data, settings.ACTIVE_LOANS_CACHE_TTL)
+    return data
+
+
+def active_loans(user_id):
+    """Serialized active loans of ``user_id``; when cached, only their titles are queried."""
+    if not settings.CACHE_SHARED:
+        return _load(user_id)
+    data = cache.get(_key(user_id))
+    if data is None:
+        return refresh(user_id)
+    return _with_current_titles(data) if data else data
+
+
+def refresh_on_commit(user_ids):
+    if not settings.CACHE_SHARED:
+        return
+    for user_id in set(user_ids):
+        transaction.on_commit(partial(refresh, user_id))
+
+
+def _loan_changed(sender, instance, **kwargs):
+    refresh_on_commit([instance.user_id])
+
+
+def connect_signals():
+    post_save.connect(_loan_changed, sender=Loan, dispatch_uid='loancache-save')
+    post_delete.connect(_loan_changed, sender=Loan, dispatch_uid='loancache-delete')
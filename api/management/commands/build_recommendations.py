@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the "readers also borrowed" recommendations (/api/books/{id}/related/) '
+        'from the loan history. Only loans added since the last run are read unless --full is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild from every loan instead of refreshing.')
+        parser.add_argument('--top-k', type=int, default=10, help='Neighbours stored per book.')
+        parser.add_argument('--min-support', type=int, default=2,
+                            help='Readers two books must share to be recommended together.')
+        parser.add_argument('--max-basket', type=int, default=200,
+                            help="Most recent books per reader that count.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = recommendations.build(
+            full=options['full'],
+            top_k=options['top_k'],
+            min_support=options['min_support'],
+            max_basket=options['max_basket'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated recommendations for {updated} books in {time.perf_counter() - started:.1f}s.'
+        ))
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from library.schema import generate_schema, read_fingerprint, source_fingerprint
+
+
+class Command(BaseCommand):
+    help = 'Writes the OpenAPI schema to a static file so it is not rebuilt per request.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='File to write (default: OPENAPI_SCHEMA_PATH setting, with a .yaml suffix for YAML)'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['json', 'yaml'],
+            default='json',
+            help='Output format (default: json; the /swagger.json endpoint serves the JSON file)'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only check that the existing JSON file is up to date; exit non-zero if not'
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['output'] or settings.OPENAPI_SCHEMA_PATH)
+        if options['format'] == 'yaml' and not options['output']:
+            # Never overwrite the JSON file the server reads
+            path = path.with_suffix('.yaml')
+
+        if options['check']:
+            if options['format'] != 'json':
+                raise CommandError('--check only reads the JSON schema.')
+            if not path.exists():
+                raise CommandError(f'{path} does not exist.')
+            if read_fingerprint(path.read_bytes()) != source_fingerprint():
+                raise CommandError(f'{path} is stale; run `manage.py generate_schema`.')
+            self.stdout.write(self.style.SUCCESS(f'{path} is up to date.'))
+            return
+
+        body = generate_schema(options['format'])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(body)} bytes to {path}'))
@@ -1,4 +1,3 @@
-import requests
 from django.core.management.base import BaseCommand
 from api.models import Book
 
@@ -20,6 +19,10 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
+        # Imported here so other management commands and the web workers
+        # never load requests.
+        import requests
+
         query = options['query']
         target_count = options['count']
         
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the loan statistics rollups (/api/stats/) from the loan history.'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt loan statistics in {time.perf_counter() - started:.1f}s.'
+        ))
@@ -0,0 +1,63 @@
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import changes, idempotency, stats, tasks
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background tasks (api.tasks) until stopped with SIGINT or SIGTERM.'
+
+    maintenance_interval = 60
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=settings.TASK_BATCH_SIZE,
+                            help='Tasks claimed per database round trip.')
+        parser.add_argument('--poll', type=float, default=settings.TASK_POLL_INTERVAL,
+                            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+        parser.add_argument('--max-tasks', type=int, help='Exit after running this many tasks.')
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = False
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+        started = time.perf_counter()
+        ran = succeeded = 0
+        next_maintenance = 0
+        while not self.stopping:
+            if time.monotonic() >= next_maintenance:
+                tasks.requeue_stale()
+                tasks.purge()
+                changes.purge_tombstones()
+                idempotency.purge()
+                stats.roll_recent()
+                next_maintenance = time.monotonic() + self.maintenance_interval
+            batch = options['batch']
+            if options['max_tasks']:
+                batch = min(batch, options['max_tasks'] - ran)
+            claimed = tasks.claim(worker, batch)
+            if not claimed:
+                if options['burst']:
+                    break
+                time.sleep(options['poll'])
+                continue
+            succeeded += tasks.execute(claimed)
+            ran += len(claimed)
+            if options['max_tasks'] and ran >= options['max_tasks']:
+                break
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Worker {worker} ran {ran} tasks ({ran - succeeded} failed) in {elapsed:.1f}s.'
+        ))
+
+    def stop(self, signum, frame):
+        # Finish the current batch, then exit
+        self.stopping = True
@@ -0,0 +1,236 @@
+import io
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api import stats
+from api.counts import invalidate_counts
+from api.isbn import make_isbn13
+from api.models import User, Book, Loan
+
+FIRST_NAMES = (
+    'Ada', 'Alan', 'Amara', 'Ben', 'Chen', 'Diego', 'Elena', 'Farah', 'Grace', 'Hiro',
+    'Ines', 'Jonas', 'Kavya', 'Liam', 'Maya', 'Nia', 'Omar', 'Priya', 'Quinn', 'Rosa',
+    'Sam', 'Tariq', 'Uma', 'Victor', 'Wen', 'Ximena', 'Yusuf', 'Zoe',
+)
+LAST_NAMES = (
+    'Adams', 'Bauer', 'Costa', 'Dubois', 'Eze', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen',
+    'Kowalski', 'Lopez', 'Moreau', 'Nakamura', 'Okafor', 'Patel', 'Quispe', 'Rossi', 'Silva',
+    'Tanaka', 'Usman', 'Varga', 'Wright', 'Xu', 'Yilmaz', 'Zhang',
+)
+TITLE_ADJECTIVES = (
+    'Silent', 'Hidden', 'Last', 'Broken', 'Golden', 'Midnight', 'Forgotten', 'Crimson',
+    'Distant', 'Secret', 'Wild', 'Quiet', 'Burning', 'Endless', 'Northern', 'Paper',
+)
+TITLE_NOUNS = (
+    'River', 'Garden', 'Kingdom', 'Letters', 'Harbor', 'Orchard', 'Empire', 'Lighthouse',
+    'Journey', 'Winter', 'Archive', 'Promise', 'Voyage', 'Island', 'Library', 'Storm',
+)
+
+
+def zipf_cum_weights(size, skew):
+    """Cumulative weights where rank ``r`` has weight ``1 / (r + 1) ** skew``."""
+    return list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(size)))
+
+
+class Command(BaseCommand):
+    help = 'Generates deterministic synthetic users, books and loan histories without network access.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users (default: 1000)')
+        parser.add_argument('--books', type=int, default=10000, help='Number of books (default: 10000)')
+        parser.add_argument('--loans', type=int, default=50000, help='Number of loans (default: 50000)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; same seed, same data (default: 42)')
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help='Zipf exponent for book popularity and user activity; 0 is uniform (default: 1.0)'
+        )
+        parser.add_argument(
+            '--active-ratio', type=float, default=0.05,
+            help='Fraction of loans still out; each marks its book unavailable (default: 0.05)'
+        )
+        parser.add_argument('--days', type=int, default=730, help='Days of loan history (default: 730)')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per insert batch (default: 10000)')
+        parser.add_argument(
+            '--username-prefix', default='reader',
+            help='Usernames are <prefix><n> (default: reader)'
+        )
+        parser.add_argument(
+            '--password', default='synthetic-password',
+            help='Password shared by all generated users (default: synthetic-password)'
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Use batched INSERTs even on PostgreSQL instead of COPY'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 42:
+            raise CommandError('--days must be at least 42.')
+        if not 0 <= options['active_ratio'] <= 1:
+            raise CommandError('--active-ratio must be between 0 and 1.')
+        if options['loans'] and not (options['users'] and options['books']):
+            raise CommandError('Loans need at least one user and one book.')
+        prefix = options['username_prefix']
+        if User.objects.filter(username=f'{prefix}0').exists():
+            raise CommandError(
+                f'User "{prefix}0" already exists; use a different --username-prefix or an empty database.'
+            )
+
+        self.batch_size = options['batch_size']
+        self.use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.total_rows = 0
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            user_ids = self.create_users(options['users'], prefix, options['password'])
+            active_count = min(int(options['loans'] * options['active_ratio']), options['books'])
+            active_books = set(self.rng.sample(range(options['books']), active_count))
+            book_ids = self.create_books(options['books'], active_books)
+            if options['loans']:
+                self.create_loans(
+                    options['loans'], user_ids, book_ids, active_books,
+                    options['skew'], options['days'],
+                )
+
+        # Raw inserts skip the signals that normally drop cached list counts
+        for model in (User, Book, Loan):
+            invalidate_counts(model)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {self.total_rows} rows in {elapsed:.1f}s '
+            f'({self.total_rows / elapsed:,.0f} rows/sec{", COPY" if self.use_copy else ""}).'
+        ))
+
+        # Rollups are maintained per request; raw inserts need a full rebuild
+        started = time.perf_counter()
+        stats.rebuild()
+        self.stdout.write(f'  statistics rebuilt in {time.perf_counter() - started:.1f}s')
+
+    def create_users(self, count, prefix, password):
+        hashed = make_password(password)
+        joined = connection.ops.adapt_datetimefield_value(self.now)
+        rng = self.rng
+
+        def rows():
+            for i in range(count):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                yield (
+                    hashed, False, f'{prefix}{i}', first, last,
+                    f'{prefix}{i}@example.com', False, True, joined, 'user',
+                )
+
+        fields = ('password', 'is_superuser', 'username', 'first_name', 'last_name',
+                  'email', 'is_staff', 'is_active', 'date_joined', 'role')
+        return self.insert(User, fields, rows(), count)
+
+    def create_books(self, count, active_books):
+        rng = self.rng
+        # Consecutive 978- prefixes from a seeded start keep ISBNs unique.
+        first = 978_000_000_000 + rng.randrange(0, 10 ** 9 - count)
+        updated = connection.ops.adapt_datetimefield_value(self.now)
+
+        def rows():
+            for i in range(count):
+                title = f'The {rng.choice(TITLE_ADJECTIVES)} {rng.choice(TITLE_NOUNS)}'
+                if rng.random() < 0.3:
+                    title = f'{title}, Volume {rng.randint(2, 9)}'
+                author = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+                yield (
+                    title, author, make_isbn13(str(first + i)),
+                    rng.randint(60, 1200), i not in active_books, 1, updated,
+                )
+
+        fields = ('title', 'author', 'isbn', 'page_count', 'availability', 'version', 'updated_at')
+        return self.insert(Book, fields, rows(), count)
+
+    def create_loans(self, count, user_ids, book_ids, active_books, skew, days):
+        rng = self.rng
+        today = timezone.localdate()
+        updated = connection.ops.adapt_datetimefield_value(self.now)
+        # Popularity ranks are shuffled so popular rows are spread across ids.
+        book_rank = book_ids[:]
+        user_rank = user_ids[:]
+        rng.shuffle(book_rank)
+        rng.shuffle(user_rank)
+        book_weights = zipf_cum_weights(len(book_rank), skew)
+        user_weights = zipf_cum_weights(len(user_rank), skew)
+        history = count - len(active_books)
+        # Dates are pre-adapted once; there are only a few hundred distinct ones.
+        adapt = connection.ops.adapt_datefield_value
+        dates = [adapt(today - timedelta(days=offset)) for offset in range(days + 1)]
+        due = [adapt(today - timedelta(days=offset) + timedelta(days=14)) for offset in range(days + 1)]
+        span = days - 41
+        random_ = rng.random
+
+        def rows():
+            for start in range(0, history, self.batch_size):
+                size = min(self.batch_size, history - start)
+                books = rng.choices(book_rank, cum_weights=book_weights, k=size)
+                users = rng.choices(user_rank, cum_weights=user_weights, k=size)
+                for user_id, book_id in zip(users, books):
+                    # History ends two weeks ago so it never overlaps active loans.
+                    offset = 42 + int(random_() * span)
+                    returned = offset - 1 - int(random_() * 28)
+                    yield user_id, book_id, dates[offset], due[offset], dates[returned], True, False, 1, updated
+            for index in sorted(active_books):
+                offset = int(random_() * 14)
+                user_id = rng.choices(user_rank, cum_weights=user_weights)[0]
+                yield user_id, book_ids[index], dates[offset], due[offset], None, False, False, 1, updated
+
+        fields = ('user_id', 'book_id', 'loan_date', 'due_date', 'return_date', 'is_returned', 'archived', 'version', 'updated_at')
+        self.insert(Loan, fields, rows(), count)
+
+    def insert(self, model, fields, rows, count):
+        """Write ``rows`` in batches and return the new primary keys in insertion order."""
+        started = time.perf_counter()
+        last_id = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.write_batch(model, fields, batch)
+                batch = []
+        if batch:
+            self.write_batch(model, fields, batch)
+        elapsed = time.perf_counter() - started
+        self.total_rows += count
+        self.stdout.write(
+            f'  {model._meta.verbose_name_plural}: {count} rows in {elapsed:.1f}s '
+            f'({count / elapsed if elapsed else 0:,.0f} rows/sec)'
+        )
+        return list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True))
+
+    def write_batch(self, model, fields, batch):
+        # Rows arrive already adapted for the database and go straight to the
+        # cursor: building model instances for bulk_create costs more than the
+        # INSERT itself at this volume, and would overwrite the historical
+        # loan_date because of auto_now_add.
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+        with connection.cursor() as cursor:
+            if self.use_copy and hasattr(cursor.cursor, 'copy_expert'):
+                buffer = io.StringIO(''.join(
+                    '\t'.join(self.copy_value(value) for value in row) + '\n' for row in batch
+                ))
+                cursor.cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN', buffer)
+                return
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', batch)
+
+    @staticmethod
+    def copy_value(value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import sync
+
+
+class Command(BaseCommand):
+    help = (
+        "Mirrors another deployment's books into this database through its change feed (/api/changes/). "
+        'Only changes since the last run are read unless --full is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=settings.SYNC_SOURCE_URL,
+                            help='API root of the source, e.g. https://library.example.org/api/ (SYNC_SOURCE_URL).')
+        parser.add_argument('--full', action='store_true', help='Read the whole catalog instead of the changes.')
+        parser.add_argument('--limit', type=int, help='Books per page of the feed.')
+
+    def handle(self, *args, **options):
+        if not options['source']:
+            raise CommandError('Set SYNC_SOURCE_URL or pass --source.')
+        if not settings.SYNC_USERNAME or not settings.SYNC_PASSWORD:
+            raise CommandError('Set SYNC_USERNAME and SYNC_PASSWORD to a staff account at the source.')
+        source = options['source'].rstrip('/') + '/'
+        started = time.perf_counter()
+        try:
+            totals = sync.run(
+                source, settings.SYNC_USERNAME, settings.SYNC_PASSWORD,
+                full=options['full'], limit=options['limit'],
+            )
+        except sync.SyncError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f"Applied {totals['changed']} changed and {totals['deleted']} deleted books "
+            f"from {totals['pages']} pages in {time.perf_counter() - started:.1f}s."
+        ))
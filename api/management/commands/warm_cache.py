@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import pagecache
+
+
+class Command(BaseCommand):
+    help = (
+        'Pre-renders the first pages of /api/books/ and the most frequent logged searches '
+        'into the cache. Run it after migrations when the cache is shared between workers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=settings.CACHE_WARM_PAGES)
+        parser.add_argument('--queries', type=int, default=settings.CACHE_WARM_QUERIES,
+                            help='How many of the most frequent logged query strings to warm.')
+        parser.add_argument('--host', help='Host the pages are rendered for (default: CACHE_WARM_HOST).')
+        parser.add_argument('--scheme', choices=['http', 'https'],
+                            help='Scheme the pages are rendered for (default: https unless CACHE_WARM_SECURE=False).')
+        parser.add_argument('--log', nargs='+', dest='log_paths',
+                            help='JSON log files to learn queries from (default: the configured log).')
+
+    def handle(self, *args, **options):
+        if not settings.CACHE_SHARED:
+            raise CommandError('Book list pages are only cached with a shared cache (CACHE_SHARED).')
+        report = pagecache.warm(
+            pages=options['pages'], queries=options['queries'], host=options['host'], log_paths=options['log_paths'],
+            secure=None if options['scheme'] is None else options['scheme'] == 'https',
+        )
+        if report is None:
+            self.stdout.write('Another process is already warming the cache.')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {report['warmed']} of {report['urls']} book list URLs in {report['seconds']:.2f}s."
+        ))
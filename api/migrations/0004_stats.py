@@ -0,0 +1,108 @@
+# Generated by Django 6.0 on 2026-10-19 11:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_hold"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LibraryStat",
+            fields=[
+                (
+                    "shard",
+                    models.PositiveSmallIntegerField(primary_key=True, serialize=False),
+                ),
+                ("total_loans", models.PositiveBigIntegerField(default=0)),
+                ("active_loans", models.BigIntegerField(default=0)),
+                ("returned_loans", models.PositiveBigIntegerField(default=0)),
+                ("total_loan_days", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="BookStat",
+            fields=[
+                (
+                    "book",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stat",
+                        serialize=False,
+                        to="api.book",
+                    ),
+                ),
+                ("total_borrows", models.PositiveIntegerField(default=0)),
+                ("total_returns", models.PositiveIntegerField(default=0)),
+                ("total_loan_days", models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["-total_borrows"], name="bookstat_borrows_idx")
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="UserStat",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stat",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("total_borrows", models.PositiveIntegerField(default=0)),
+                ("active_loans", models.IntegerField(default=0)),
+                ("total_loan_days", models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["-total_borrows"], name="userstat_borrows_idx")
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="BookDailyStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("borrows", models.PositiveIntegerField(default=0)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="api.book",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["date"], name="bookdailystat_date_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("book", "date"), name="unique_book_day"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 6.0 on 2026-10-19 11:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_stats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecommendationState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_loan_id", models.BigIntegerField(default=0)),
+                ("built_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="BookRecommendation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("score", models.PositiveIntegerField()),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recommendations",
+                        to="api.book",
+                    ),
+                ),
+                (
+                    "recommended",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="api.book",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["book", "rank"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("book", "rank"), name="unique_recommendation_rank"
+                    )
+                ],
+            },
+        ),
+    ]
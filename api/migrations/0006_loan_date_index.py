@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_recommendations"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(fields=["-loan_date", "-id"], name="loan_date_idx"),
+        ),
+    ]
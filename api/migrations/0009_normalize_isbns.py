@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-19 13:10
+
+from django.db import migrations
+
+from api.isbn import normalize
+
+
+def normalize_isbns(apps, schema_editor):
+    """
+    Rewrite stored ISBN-10s and hyphenated ISBNs as plain ISBN-13s. A book
+    whose normalized ISBN is already taken, or that does not parse, is left
+    unchanged.
+    """
+    Book = apps.get_model("api", "Book")
+    taken = set()
+    changed = []
+    for book in (
+        Book.objects.exclude(isbn__regex=r"^[0-9]{13}$").only("id", "isbn").iterator()
+    ):
+        try:
+            isbn = normalize(book.isbn)
+        except ValueError:
+            continue
+        if isbn in taken or Book.objects.filter(isbn=isbn).exists():
+            continue
+        taken.add(isbn)
+        book.isbn = isbn
+        changed.append(book)
+    Book.objects.bulk_update(changed, ["isbn"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_task_queue"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_isbns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_normalize_isbns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 6.0 on 2026-10-19 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_versions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("source", models.URLField(unique=True)),
+                ("token", models.CharField(blank=True, max_length=100)),
+                ("synced_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name="book",
+            name="isbn",
+            field=models.CharField(max_length=13),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["updated_at", "id"], name="book_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                condition=models.Q(("deleted_at__isnull", False)),
+                fields=["deleted_at"],
+                name="book_deleted_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(fields=["updated_at", "id"], name="loan_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                condition=models.Q(("deleted_at__isnull", False)),
+                fields=["deleted_at"],
+                name="loan_deleted_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="book",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("deleted_at__isnull", True)),
+                fields=("isbn",),
+                name="unique_live_isbn",
+            ),
+        ),
+    ]
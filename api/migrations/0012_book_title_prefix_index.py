@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-19 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_change_tracking"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["title"],
+                name="book_title_prefix_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-19 12:25
+
+from django.db import migrations, models
+
+
+def fail_unfinished_jobs(apps, schema_editor):
+    # Their pickled selections are dropped with the old column
+    BulkJob = apps.get_model("api", "BulkJob")
+    BulkJob.objects.filter(status__in=["pending", "running"]).update(
+        status="failed",
+        error="The selection was lost in an upgrade; run the action again.",
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_book_title_prefix_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_unfinished_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="bulkjob",
+            name="selection",
+        ),
+        migrations.AddField(
+            model_name="bulkjob",
+            name="selection",
+            field=models.JSONField(default=list),
+        ),
+    ]
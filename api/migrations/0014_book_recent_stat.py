@@ -0,0 +1,61 @@
+# Generated by Django 6.0 on 2026-10-19 12:40
+
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_recent(apps, schema_editor):
+    BookDailyStat = apps.get_model("api", "BookDailyStat")
+    BookRecentStat = apps.get_model("api", "BookRecentStat")
+    since = api.models.recent_window_start()
+    rows = (
+        BookDailyStat.objects.filter(date__gte=since)
+        .values("book_id")
+        .annotate(borrows=Sum("borrows"))
+        .order_by()
+    )
+    BookRecentStat.objects.bulk_create(
+        (
+            BookRecentStat(book_id=row["book_id"], borrows=row["borrows"], since=since)
+            for row in rows.iterator()
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_bulkjob_selection_pks"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookRecentStat",
+            fields=[
+                (
+                    "book",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="recent_stat",
+                        serialize=False,
+                        to="api.book",
+                    ),
+                ),
+                ("borrows", models.PositiveIntegerField(default=0)),
+                ("since", models.DateField(default=api.models.recent_window_start)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["since", "-borrows", "book"],
+                        name="bookrecentstat_borrows_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_recent, migrations.RunPython.noop),
+    ]
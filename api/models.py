@@ -1,5 +1,14 @@
+from datetime import date, timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
+
+from . import isbn as isbns
+from .versioning import VersionedModel
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -8,29 +17,371 @@ class User(AbstractUser):
     )
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
 
-class Book(models.Model):
+class LiveManager(models.Manager):
+    """Rows that have not been soft-deleted."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class TrackedModel(VersionedModel):
+    """
+    A row whose changes the change feed (``api.changes``) can report.
+
+    Every save stamps ``updated_at``, including saves with ``update_fields``.
+    Deleting through ``soft_delete()`` leaves the row as a tombstone, with
+    ``deleted_at`` set, that ``objects`` hides; ``all_objects`` still sees
+    it. Tombstones are removed by ``changes.purge_tombstones()``.
+    """
+    updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        abstract = True
+        indexes = [
+            # Keyset order of the change feed
+            models.Index(fields=['updated_at', 'id'], name='%(class)s_updated_idx'),
+            # Only tombstones, for purging them
+            models.Index(
+                fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='%(class)s_deleted_idx',
+            ),
+        ]
+
+    def save(self, **kwargs):
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        super().save(**kwargs)
+
+    def soft_delete(self):
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['deleted_at'])
+
+
+class Book(TrackedModel):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=200)
-    isbn = models.CharField(max_length=13, unique=True)
+    # Always stored as ISBN-13 (see api.isbn.normalize), so the unique index
+    # answers lookups by either form. Only live books must be unique; a
+    # deleted book's ISBN can be added again.
+    isbn = models.CharField(max_length=13)
     page_count = models.IntegerField()
     availability = models.BooleanField(default=True)
 
+    class Meta(TrackedModel.Meta):
+        indexes = TrackedModel.Meta.indexes + [
+            # Title prefix search in the loan admin; varchar_pattern_ops lets
+            # PostgreSQL use it for LIKE 'prefix%' (other backends ignore it)
+            models.Index(fields=['title'], name='book_title_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['isbn'],
+                condition=models.Q(deleted_at__isnull=True),
+                name='unique_live_isbn',
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
-class Loan(models.Model):
+    def clean(self):
+        try:
+            normalized = isbns.normalize(self.isbn)
+        except ValueError as exc:
+            raise ValidationError({'isbn': str(exc)})
+        # Only a changed ISBN must have a valid check digit, as in BookSerializer
+        if not self._state.adding and not isbns.has_valid_checksum(self.isbn):
+            stored = Book.all_objects.filter(pk=self.pk).values_list('isbn', flat=True).first()
+            if normalized != stored:
+                raise ValidationError({'isbn': 'ISBN check digit is invalid.'})
+        self.isbn = normalized
+
+class Loan(TrackedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     loan_date = models.DateField(auto_now_add=True)
     due_date = models.DateField()
     return_date = models.DateField(null=True, blank=True)
     is_returned = models.BooleanField(default=False)
+    # Archived loans are kept for history and statistics but hidden from the
+    # staff loan list (see api.bulk)
+    archived = models.BooleanField(default=False)
 
-    class Meta:
+    class Meta(TrackedModel.Meta):
         verbose_name = 'Loan'
         verbose_name_plural = 'Loans'
         ordering = ['-loan_date']
+        indexes = TrackedModel.Meta.indexes + [
+            # Default ordering, used by the admin changelist (which adds -pk)
+            models.Index(fields=['-loan_date', '-id'], name='loan_date_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.book.title}'
 
+
+
+class Hold(models.Model):
+    """
+    A user's place in the queue for a book that is out on loan.
+
+    Holds are served first come, first served by id. When the book is
+    returned, the oldest waiting hold is turned into a loan in the same
+    transaction (see ``LoanViewSet.return_book``). The ``(book, status, id)``
+    index makes finding the next holder a single index seek and a queue
+    position an index-only range count.
+    """
+    WAITING = 'waiting'
+    FULFILLED = 'fulfilled'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = (
+        (WAITING, 'Waiting'),
+        (FULFILLED, 'Fulfilled'),
+        (CANCELLED, 'Cancelled'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    loan = models.OneToOneField(Loan, on_delete=models.SET_NULL, null=True, blank=True, related_name='hold')
+
+    class Meta:
+        verbose_name = 'Hold'
+        verbose_name_plural = 'Holds'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['book', 'status', 'id'], name='hold_queue_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'book'],
+                condition=models.Q(status='waiting'),
+                name='unique_waiting_hold',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} - {self.book.title} ({self.status})'
+
+    def queue_position(self):
+        """1-based position among the book's waiting holds, or None once served/cancelled."""
+        if self.status != self.WAITING:
+            return None
+        return Hold.objects.filter(book_id=self.book_id, status=self.WAITING, id__lte=self.id).count()
+
+
+class BookStat(models.Model):
+    """All-time borrow totals for one book, kept up to date by ``api.stats``."""
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='stat')
+    total_borrows = models.PositiveIntegerField(default=0)
+    total_returns = models.PositiveIntegerField(default=0)
+    total_loan_days = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_borrows'], name='bookstat_borrows_idx'),
+        ]
+
+
+class BookDailyStat(models.Model):
+    """Borrows of one book on one day, for "most borrowed lately" windows."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    borrows = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'date'], name='unique_book_day'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='bookdailystat_date_idx'),
+        ]
+
+
+def recent_window_start():
+    """First day of the ``STATS_RECENT_DAYS`` window that ends today."""
+    return date.today() - timedelta(days=settings.STATS_RECENT_DAYS - 1)
+
+
+class BookRecentStat(models.Model):
+    """
+    Borrows of one book in the ``STATS_RECENT_DAYS`` days from ``since`` to
+    today. Borrows add to it as they happen; ``api.stats.roll_recent``
+    recomputes it from ``BookDailyStat`` when the window moves on.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='recent_stat')
+    borrows = models.PositiveIntegerField(default=0)
+    since = models.DateField(default=recent_window_start)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['since', '-borrows', 'book'], name='bookrecentstat_borrows_idx'),
+        ]
+
+
+class UserStat(models.Model):
+    """All-time borrow totals for one user, kept up to date by ``api.stats``."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stat')
+    total_borrows = models.PositiveIntegerField(default=0)
+    active_loans = models.IntegerField(default=0)
+    total_loan_days = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_borrows'], name='userstat_borrows_idx'),
+        ]
+
+
+class LibraryStat(models.Model):
+    """
+    Library-wide loan totals, split over a few shard rows.
+
+    Every borrow and return updates one randomly chosen shard, so concurrent
+    requests rarely wait on the same row lock; the totals are the sum of
+    the shards.
+    """
+    shard = models.PositiveSmallIntegerField(primary_key=True)
+    total_loans = models.PositiveBigIntegerField(default=0)
+    active_loans = models.BigIntegerField(default=0)
+    returned_loans = models.PositiveBigIntegerField(default=0)
+    total_loan_days = models.PositiveBigIntegerField(default=0)
+
+
+class BookRecommendation(models.Model):
+    """
+    One precomputed "readers also borrowed" neighbour of a book.
+
+    Built offline by ``manage.py build_recommendations``; ``score`` is the
+    number of readers who borrowed both books and ``rank`` orders a book's
+    neighbours (1 is best).
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['book', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+
+class RecommendationState(models.Model):
+    """Single row recording how far ``build_recommendations`` has read ``Loan``."""
+    last_loan_id = models.BigIntegerField(default=0)
+    built_at = models.DateTimeField(null=True, blank=True)
+
+
+class SyncState(models.Model):
+    """How far ``manage.py sync_catalog`` has applied a source's change feed (see api.sync)."""
+    source = models.URLField(unique=True)
+    token = models.CharField(max_length=100, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.source
+
+
+class BulkJob(models.Model):
+    """
+    An admin bulk action too large to run inside the request (see api.bulk).
+
+    ``selection`` lists the primary keys the action applies to, in order;
+    ``done`` counts rows processed so far, for the progress shown in the admin.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    action = models.CharField(max_length=50)
+    selection = models.JSONField(default=list)
+    total = models.PositiveIntegerField()
+    done = models.PositiveIntegerField(default=0)
+    changed = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):
+        return f'{self.action} #{self.pk} ({self.status})'
+
+
+class Task(models.Model):
+    """
+    A unit of deferred work for ``manage.py run_worker`` (see api.tasks).
+
+    Ready tasks are claimed highest ``priority`` first, then oldest
+    ``run_at``; the partial index covers exactly that scan. A failed task is
+    re-queued with a later ``run_at`` until it has used ``max_attempts``.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(
+                fields=['-priority', 'run_at', 'id'],
+                condition=models.Q(status='queued'),
+                name='task_ready_idx',
+            ),
+            models.Index(fields=['status', 'locked_at'], name='task_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+
+class IdempotencyKey(models.Model):
+    """
+    A claimed ``Idempotency-Key`` and, once the request succeeded, its
+    response (see api.idempotency). Kept in the database so that every
+    worker sees it; rows past ``expires_at`` are purged by ``run_worker``.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    headers = models.JSONField(default=dict, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
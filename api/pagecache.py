@@ -0,0 +1,153 @@
+"""
+Cached book list pages and cache warm-up.
+
+``GET /api/books/`` responses are cached for ``BOOK_LIST_CACHE_TTL``
+seconds, keyed by the site, the normalized query string and the ``Book``
+count generation (``api.counts``), so any write to a book makes every cached
+page stale at once. The generation is bumped in the cache of the process
+that made the write, so pages are only cached with ``CACHE_SHARED``; with a
+per-process cache the other workers would keep serving the old
+availability for up to the TTL. A sample of list requests (``CACHE_WARM_LOG_SAMPLE_RATE``)
+is also logged (logger ``api.pagecache``, field ``query``) so that
+``warm()`` can learn which searches and filters are popular from the JSON
+request log; popular queries still stand out in a small sample.
+
+``warm()`` renders the first ``CACHE_WARM_PAGES`` pages and the
+``CACHE_WARM_QUERIES`` most frequent logged query strings into the cache.
+It runs from ``manage.py warm_cache`` after migrations, or from gunicorn's
+``post_worker_init`` hook (``CACHE_WARM_ON_BOOT``).
+A cache lock makes concurrent warm-ups on a shared cache run only once.
+"""
+
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import QueryDict
+from django.test import RequestFactory
+from django.urls import reverse
+
+from .counts import generation
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'pagecache:warm-lock'
+LOCK_TIMEOUT = 300
+
+
+def normalize_query(query_params):
+    """Query string with parameters sorted, so equivalent URLs share an entry."""
+    return urlencode(sorted((key, value) for key in query_params for value in query_params.getlist(key)))
+
+
+def book_list_key(request):
+    raw = f'{request.build_absolute_uri("/")}?{normalize_query(request.query_params)}'
+    return f'books:{generation(Book)}:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+
+def get_book_list(request):
+    if not settings.CACHE_SHARED:
+        return None
+    return cache.get(book_list_key(request))
+
+
+def set_book_list(request, data):
+    if not settings.CACHE_SHARED:
+        return
+    cache.set(book_list_key(request), data, settings.BOOK_LIST_CACHE_TTL)
+
+
+_logged = itertools.count(1)
+
+
+def _sample_every():
+    rate = settings.CACHE_WARM_LOG_SAMPLE_RATE
+    return 0 if rate <= 0 else max(1, round(1 / min(rate, 1.0)))
+
+
+def log_query(request):
+    """Log one in every ``1 / CACHE_WARM_LOG_SAMPLE_RATE`` list queries for ``learned_queries()``."""
+    every = _sample_every()
+    if getattr(request, 'cache_warmup', False) or not every or next(_logged) % every:
+        return
+    logger.info('book list', extra={'query': normalize_query(request.query_params)})
+
+
+def log_files():
+    """The JSON request log and its rotated copies, newest first."""
+    path = str(settings.LOGGING['handlers']['file']['filename'])
+    return sorted(glob.glob(glob.escape(path) + '*'), key=os.path.getmtime, reverse=True)
+
+
+def learned_queries(limit, paths=None, max_records=100000):
+    """The ``limit`` most frequent book list query strings in the most recent log records."""
+    counter = Counter()
+    seen = 0
+    for path in log_files() if paths is None else paths:
+        try:
+            with open(path, encoding='utf-8', errors='replace') as fh:
+                for line in fh:
+                    if '"api.pagecache"' not in line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('logger') == __name__ and 'query' in record:
+                        counter[record['query']] += 1
+                        seen += 1
+        except OSError:
+            continue
+        if seen >= max_records:
+            break
+    return [query for query, _ in counter.most_common(limit)]
+
+
+def warm_host():
+    if settings.CACHE_WARM_HOST:
+        return settings.CACHE_WARM_HOST
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+    return hosts[0] if hosts else 'localhost'
+
+
+def warm(pages=None, queries=None, host=None, secure=None, log_paths=None):
+    """
+    Render the hottest book list pages into the cache.
+
+    Returns ``{'urls', 'warmed', 'seconds'}``, or None when another process
+    holds the warm-up lock.
+    """
+    from .views import BookViewSet
+
+    pages = settings.CACHE_WARM_PAGES if pages is None else pages
+    queries = settings.CACHE_WARM_QUERIES if queries is None else queries
+    secure = settings.CACHE_WARM_SECURE if secure is None else secure
+    if not cache.add(LOCK_KEY, os.getpid(), LOCK_TIMEOUT):
+        return None
+    try:
+        started = time.perf_counter()
+        targets = [''] + [f'page={page}' for page in range(2, pages + 1)]
+        targets += learned_queries(queries, log_paths) if queries else []
+        targets = list(dict.fromkeys(targets))
+
+        view = BookViewSet.as_view({'get': 'list'})
+        factory = RequestFactory()
+        path = reverse('api:book-list')
+        warmed = 0
+        for query in targets:
+            request = factory.get(path, QueryDict(query), HTTP_HOST=host or warm_host(), secure=secure)
+            request.cache_warmup = True
+            if view(request).status_code == 200:
+                warmed += 1
+        return {'urls': len(targets), 'warmed': warmed, 'seconds': round(time.perf_counter() - started, 3)}
+    finally:
+        cache.delete(LOCK_KEY)
@@ -0,0 +1,141 @@
+"""
+Page-number pagination with client-selectable, bounded page sizes.
+
+Clients pick a size with ``?page_size=`` (clamped to the class's
+``max_page_size``) and can pass ``?count=false`` to skip the ``COUNT(*)``
+query: the response then has ``"count": null`` and ``next`` is decided by
+fetching one extra row.
+
+When a count is wanted it comes from ``api.counts``, which may use a cached
+or, for large unfiltered PostgreSQL tables, an estimated count. Pages are
+then fetched with one extra row too, so ``next`` stays right even when the
+estimate is off.
+"""
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .counts import count_queryset
+
+FALSE_VALUES = ('false', '0', 'no', 'off')
+
+
+class EstimatedPage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountingPaginator(Paginator):
+    """Paginator whose count comes from ``api.counts`` and may be an estimate."""
+
+    count_is_exact = True
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return len(self.object_list)  # e.g. a cached list
+        count, self.count_is_exact = count_queryset(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        self.count  # decides count_is_exact
+        if self.count_is_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_is_exact:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return EstimatedPage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page)
+
+
+class StandardPagination(PageNumberPagination):
+    django_paginator_class = CountingPaginator
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.include_count = (
+            request.query_params.get(self.count_query_param, '').lower() not in FALSE_VALUES
+        )
+        if self.include_count:
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            self.page_number = 0
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=self.page_number, message='Invalid page.'))
+
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        if not rows and self.page_number > 1:
+            raise NotFound(self.invalid_page_message.format(page_number=self.page_number, message='Invalid page.'))
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if self.include_count:
+            return super().get_paginated_response(data)
+        return Response({
+            'count': None,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if self.include_count:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.include_count:
+            return super().get_previous_link()
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response_schema(self, schema):
+        response = super().get_paginated_response_schema(schema)
+        response['properties']['count']['nullable'] = True
+        return response
+
+
+class BookPagination(StandardPagination):
+    """The catalog allows larger pages for bulk consumers."""
+    max_page_size = settings.BOOK_MAX_PAGE_SIZE
@@ -0,0 +1,134 @@
+"""
+Offline "readers also borrowed" recommendations.
+
+Two books co-occur once for every reader who has borrowed both. The
+co-occurrence matrix is sparse and is held as dicts of counters in memory
+while building; only each book's ``top_k`` neighbours with at least
+``min_support`` shared readers are stored in ``BookRecommendation``.
+
+A full build reads every reader's basket (distinct books borrowed). An
+incremental refresh reads only loans created since the last run
+(``RecommendationState.last_loan_id``): a new loan can only change the rows
+of books in its reader's basket, so just those books are recomputed, from
+the baskets of the readers who borrowed them. Deleted loans are only
+reflected by a full build.
+"""
+
+import heapq
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BookRecommendation, Loan, RecommendationState
+
+
+def _chunks(ids, size=500):
+    ids = iter(ids)
+    while chunk := list(islice(ids, size)):
+        yield chunk
+
+
+def load_baskets(user_ids=None, max_basket=None, up_to=None):
+    """
+    ``{user_id: [book_id, ...]}``, most recent borrows first, at most
+    ``max_basket`` each, from loans with ids up to ``up_to`` if given.
+    """
+    loans = Loan.objects.order_by('user_id', '-id').values_list('user_id', 'book_id')
+    if up_to is not None:
+        loans = loans.filter(id__lte=up_to)
+    if user_ids is None:
+        querysets = [loans]
+    else:
+        querysets = (loans.filter(user_id__in=chunk) for chunk in _chunks(sorted(user_ids)))
+    baskets = defaultdict(list)
+    seen = defaultdict(set)
+    for queryset in querysets:
+        for user_id, book_id in queryset.iterator(chunk_size=10000):
+            if book_id in seen[user_id] or (max_basket and len(baskets[user_id]) >= max_basket):
+                continue
+            seen[user_id].add(book_id)
+            baskets[user_id].append(book_id)
+    return baskets
+
+
+def cooccurrences(baskets, books=None):
+    """
+    Sparse co-occurrence rows ``{book_id: Counter({other_id: readers})}``.
+
+    With ``books``, only those rows are built.
+    """
+    rows = defaultdict(Counter)
+    for basket in baskets.values():
+        for book_id in basket:
+            if books is not None and book_id not in books:
+                continue
+            row = rows[book_id]
+            for other in basket:
+                if other != book_id:
+                    row[other] += 1
+    return rows
+
+
+def top_neighbours(row, top_k, min_support):
+    """Best ``top_k`` ``(other_id, score)`` pairs; ties go to the lower id."""
+    candidates = ((score, -other) for other, score in row.items() if score >= min_support)
+    return [(-negated, score) for score, negated in heapq.nlargest(top_k, candidates)]
+
+
+def store(rows, book_ids, top_k, min_support):
+    """Replace the stored neighbours of ``book_ids`` with those in ``rows``."""
+    for chunk in _chunks(book_ids):
+        BookRecommendation.objects.filter(book_id__in=chunk).delete()
+    BookRecommendation.objects.bulk_create(
+        (
+            BookRecommendation(book_id=book_id, recommended_id=other, rank=rank, score=score)
+            for book_id in book_ids
+            for rank, (other, score) in enumerate(top_neighbours(rows.get(book_id, {}), top_k, min_support), 1)
+        ),
+        batch_size=5000,
+    )
+
+
+@transaction.atomic
+def build(full=False, top_k=10, min_support=2, max_basket=200):
+    """
+    Build or refresh recommendations; returns the number of books updated.
+
+    ``max_basket`` caps how many of a reader's most recent books count,
+    which bounds the quadratic cost of very heavy readers.
+    """
+    state, _ = RecommendationState.objects.select_for_update().get_or_create(pk=1)
+    last_loan_id = Loan.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    if full or not state.last_loan_id:
+        baskets = load_baskets(max_basket=max_basket, up_to=last_loan_id)
+        rows = cooccurrences(baskets)
+        BookRecommendation.objects.all().delete()
+        affected = list(rows)
+    else:
+        new_loans = Loan.objects.filter(id__gt=state.last_loan_id, id__lte=last_loan_id)
+        new_readers = set(new_loans.values_list('user_id', flat=True).distinct())
+        # Books in a new reader's basket before or after the new loans (a
+        # capped basket can also lose its oldest books) are the only rows
+        # that can change.
+        affected = set()
+        for up_to in (state.last_loan_id, last_loan_id):
+            for basket in load_baskets(new_readers, max_basket, up_to).values():
+                affected.update(basket)
+        # Everyone who borrowed a book a new reader has borrowed: a superset
+        # of the affected books' readers, found without sending ids back.
+        their_books = Loan.objects.filter(user_id__in=new_loans.values('user_id')).values('book_id')
+        readers = set(
+            Loan.objects.filter(id__lte=last_loan_id, book_id__in=their_books)
+            .values_list('user_id', flat=True).distinct()
+        )
+        rows = cooccurrences(load_baskets(readers, max_basket, last_loan_id), books=affected)
+        affected = sorted(affected)
+
+    store(rows, affected, top_k, min_support)
+    state.last_loan_id = last_loan_id
+    state.built_at = timezone.now()
+    state.save()
+    return len(affected)
@@ -1,10 +1,39 @@
 from rest_framework import serializers
 from django.core.validators import EmailValidator
+from django.db import IntegrityError, transaction
 from datetime import date
-from .models import User, Book, Loan
+from .counts import invalidate_counts
+from .models import User, Book, Loan, Hold
+from . import isbn, versioning
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Drops every field not listed in the ``fields`` serializer context.
+
+    Views set it from ``?fields=`` (see ``SparseFieldsViewMixin``); without
+    it the serializer is unchanged.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.context.get('fields')
+        if requested is not None:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+
+class VersionedUpdateMixin:
+    """Updates write only the fields that changed, guarded by the row version (see ``api.versioning``)."""
+
+    def update(self, instance, validated_data):
+        changed = versioning.changed_fields(instance, validated_data)
+        if changed:
+            instance.save(update_fields=changed)
+        return instance
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     email = serializers.EmailField(validators=[EmailValidator()])
     password = serializers.CharField(write_only=True, required=True, min_length=8)
     
@@ -32,18 +61,66 @@ class UserSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookListSerializer(serializers.ListSerializer):
+    """
+    Creates many books at once: rows are validated in one pass, ISBN
+    uniqueness is checked with a single ``isbn__in`` query for the whole
+    payload, and the books are inserted with ``bulk_create``.
+    """
+
+    def to_internal_value(self, data):
+        rows = super().to_internal_value(data)
+        values = [row['isbn'] for row in rows]
+        taken = set(Book.objects.filter(isbn__in=values).values_list('isbn', flat=True))
+        errors, seen = [], set()
+        for value in values:
+            if value in taken:
+                errors.append({'isbn': ["book with this isbn already exists."]})
+            elif value in seen:
+                errors.append({'isbn': ["ISBN appears more than once in this request."]})
+            else:
+                errors.append({})
+            seen.add(value)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return rows
+
+    def create(self, validated_data):
+        books = [Book(**attrs) for attrs in validated_data]
+        try:
+            with transaction.atomic():
+                Book.objects.bulk_create(books, batch_size=1000)
+        except IntegrityError:
+            # Another request added one of these ISBNs after the check above
+            raise serializers.ValidationError("book with this isbn already exists.")
+        invalidate_counts(Book)
+        return books
+
+
+class BookSerializer(SparseFieldsMixin, VersionedUpdateMixin, serializers.ModelSerializer):
     def validate_isbn(self, value):
-        """Validate ISBN format - should be 10 or 13 digits"""
+        """Validate an ISBN-10 or ISBN-13 and store it as ISBN-13"""
         if not value:
             raise serializers.ValidationError("ISBN is required.")
-        # Remove hyphens and spaces
-        isbn_clean = value.replace('-', '').replace(' ', '')
-        if not isbn_clean.isdigit():
-            raise serializers.ValidationError("ISBN must contain only digits (and hyphens/spaces).")
-        if len(isbn_clean) not in [10, 13]:
-            raise serializers.ValidationError("ISBN must be 10 or 13 digits long.")
-        return isbn_clean
+        try:
+            normalized = isbn.normalize(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        # Check digits are verified for ISBNs being stored anew: bulk loads
+        # and changed ISBNs. Books already stored keep validating as before.
+        bulk = isinstance(self.parent, BookListSerializer)
+        changed = self.instance is not None and normalized != self.instance.isbn
+        if (bulk or changed) and not isbn.has_valid_checksum(value):
+            raise serializers.ValidationError("ISBN check digit is invalid.")
+        if bulk:
+            return normalized  # checked for the whole list at once
+        # Checked here, on the normalized value, so both forms of one ISBN clash
+        existing = Book.objects.filter(isbn=normalized)
+        if self.instance is not None:
+            existing = existing.exclude(pk=self.instance.pk)
+        if existing.exists():
+            raise serializers.ValidationError("book with this isbn already exists.")
+        return normalized
     
     def validate_page_count(self, value):
         """Validate page_count is positive"""
@@ -53,10 +130,13 @@ class BookSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Book
-        fields = ('id', 'title', 'author', 'isbn', 'page_count', 'availability')
+        fields = ('id', 'title', 'author', 'isbn', 'page_count', 'availability', 'version')
+        list_serializer_class = BookListSerializer
+        # Room for hyphens and spaces; uniqueness is checked after normalizing
+        extra_kwargs = {'isbn': {'max_length': 20, 'validators': []}}
 
 
-class LoanSerializer(serializers.ModelSerializer):
+class LoanSerializer(SparseFieldsMixin, VersionedUpdateMixin, serializers.ModelSerializer):
     book_title = serializers.ReadOnlyField(source='book.title')
     user = serializers.PrimaryKeyRelatedField(read_only=True)
     
@@ -68,5 +148,16 @@ class LoanSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Loan
-        fields = ('id', 'user', 'book', 'book_title', 'loan_date', 'due_date', 'return_date', 'is_returned')
+        fields = ('id', 'user', 'book', 'book_title', 'loan_date', 'due_date', 'return_date', 'is_returned', 'version')
         read_only_fields = ('loan_date', 'return_date', 'is_returned')
+
+
+class HoldSerializer(serializers.ModelSerializer):
+    book_title = serializers.ReadOnlyField(source='book.title')
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+    position = serializers.IntegerField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Hold
+        fields = ('id', 'user', 'book', 'book_title', 'status', 'position', 'created_at', 'loan')
+        read_only_fields = ('status', 'created_at', 'loan')
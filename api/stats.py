@@ -0,0 +1,228 @@
+"""
+Incrementally maintained loan statistics.
+
+Borrows and returns update small rollup rows (``BookStat``,
+``BookDailyStat``, ``UserStat``, ``LibraryStat``) with ``F()`` increments
+inside the same transaction as the loan, so ``/api/stats/`` reads a handful
+of indexed rows instead of scanning ``Loan``. The default "most borrowed
+lately" window has a rollup of its own (``BookRecentStat``), rolled forward
+to each new day by ``roll_recent()``; other windows sum ``BookDailyStat``. ``rebuild()`` (run by
+``manage.py rebuild_stats``) recomputes everything from ``Loan`` with a few
+``GROUP BY`` queries; use it after bulk loads or as a periodic repair job.
+"""
+
+import random
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import BookDailyStat, BookRecentStat, BookStat, LibraryStat, Loan, UserStat, recent_window_start
+
+
+def _increment(model, key, **deltas):
+    """Add ``deltas`` to the row matching ``key``, creating it if needed."""
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**key).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Another request created the row first
+        model.objects.filter(**key).update(**changes)
+
+
+def _library_shard():
+    return {'shard': random.randrange(settings.LIBRARY_STAT_SHARDS)}
+
+
+def loan_days(loan):
+    return max((loan.return_date - loan.loan_date).days, 0)
+
+
+def record_borrow(loan):
+    """Count a new loan; call inside the transaction that created it."""
+    _increment(BookStat, {'book_id': loan.book_id}, total_borrows=1)
+    _increment(BookDailyStat, {'book_id': loan.book_id, 'date': loan.loan_date}, borrows=1)
+    _increment(BookRecentStat, {'book_id': loan.book_id}, borrows=1)
+    _increment(UserStat, {'user_id': loan.user_id}, total_borrows=1, active_loans=1)
+    _increment(LibraryStat, _library_shard(), total_loans=1, active_loans=1)
+
+
+def record_return(loan):
+    """Count a returned loan; call inside the transaction that returned it."""
+    days = loan_days(loan)
+    _increment(BookStat, {'book_id': loan.book_id}, total_returns=1, total_loan_days=days)
+    _increment(UserStat, {'user_id': loan.user_id}, active_loans=-1, total_loan_days=days)
+    _increment(LibraryStat, _library_shard(), active_loans=-1, returned_loans=1, total_loan_days=days)
+
+
+def record_returns(loans):
+    """
+    Count many returned loans at once, with one increment per book and per
+    user instead of per loan; call inside the transaction that returned them.
+    """
+    book_deltas, user_deltas, total_days = {}, {}, 0
+    for loan in loans:
+        days = loan_days(loan)
+        returns, book_days = book_deltas.get(loan.book_id, (0, 0))
+        book_deltas[loan.book_id] = (returns + 1, book_days + days)
+        returned, user_days = user_deltas.get(loan.user_id, (0, 0))
+        user_deltas[loan.user_id] = (returned + 1, user_days + days)
+        total_days += days
+    for book_id, (returns, days) in book_deltas.items():
+        _increment(BookStat, {'book_id': book_id}, total_returns=returns, total_loan_days=days)
+    for user_id, (returned, days) in user_deltas.items():
+        _increment(UserStat, {'user_id': user_id}, active_loans=-returned, total_loan_days=days)
+    count = sum(returns for returns, _ in book_deltas.values())
+    if count:
+        _increment(LibraryStat, _library_shard(), active_loans=-count, returned_loans=count, total_loan_days=total_days)
+
+
+def summary(limit=10, days=30):
+    """Everything ``/api/stats/`` returns, read from the rollups."""
+    totals = LibraryStat.objects.aggregate(
+        total_loans=Sum('total_loans', default=0),
+        active_loans=Sum('active_loans', default=0),
+        returned_loans=Sum('returned_loans', default=0),
+        total_loan_days=Sum('total_loan_days', default=0),
+    )
+    returned = totals.pop('returned_loans')
+    total_days = totals.pop('total_loan_days')
+    totals['returned_loans'] = returned
+    totals['average_loan_days'] = round(total_days / returned, 2) if returned else None
+
+    most_borrowed = (
+        BookStat.objects.filter(total_borrows__gt=0)
+        .select_related('book')
+        .order_by('-total_borrows')[:limit]
+    )
+    if days == settings.STATS_RECENT_DAYS:
+        # Rows not yet rolled into the current window are left out
+        recent = (
+            BookRecentStat.objects.filter(since=recent_window_start(), borrows__gt=0)
+            .values('book_id', 'book__title', 'borrows')
+            .order_by('-borrows', 'book_id')[:limit]
+        )
+    else:
+        recent = (
+            BookDailyStat.objects.filter(date__gt=date.today() - timedelta(days=days))
+            .values('book_id', 'book__title')
+            .annotate(borrows=Sum('borrows'))
+            .order_by('-borrows', 'book_id')[:limit]
+        )
+    borrowers = (
+        UserStat.objects.filter(total_borrows__gt=0)
+        .select_related('user')
+        .order_by('-total_borrows')[:limit]
+    )
+    return {
+        'totals': totals,
+        'most_borrowed': [
+            {'book': stat.book_id, 'title': stat.book.title, 'borrows': stat.total_borrows,
+             'average_loan_days': round(stat.total_loan_days / stat.total_returns, 2) if stat.total_returns else None}
+            for stat in most_borrowed
+        ],
+        'most_borrowed_recent': {
+            'days': days,
+            'books': [
+                {'book': row['book_id'], 'title': row['book__title'], 'borrows': row['borrows']}
+                for row in recent
+            ],
+        },
+        'top_borrowers': [
+            {'user': stat.user_id, 'username': stat.user.username,
+             'borrows': stat.total_borrows, 'active_loans': stat.active_loans}
+            for stat in borrowers
+        ],
+    }
+
+
+def roll_recent():
+    """
+    Recompute ``BookRecentStat`` from the daily rollups once the window has
+    moved on to a new day; returns whether it did. ``run_worker`` calls this
+    every minute.
+    """
+    since = recent_window_start()
+    if (BookRecentStat.objects.filter(since=since).exists()
+            and not BookRecentStat.objects.filter(since__lt=since).exists()):
+        return False
+    _rebuild_recent(since)
+    return True
+
+
+@transaction.atomic
+def _rebuild_recent(since):
+    BookRecentStat.objects.all().delete()
+    rows = (
+        BookDailyStat.objects.filter(date__gte=since)
+        .values('book_id')
+        .annotate(borrows=Sum('borrows'))
+        .order_by()
+    )
+    BookRecentStat.objects.bulk_create(
+        (BookRecentStat(book_id=row['book_id'], borrows=row['borrows'], since=since) for row in rows.iterator()),
+        batch_size=5000,
+    )
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute every rollup from ``Loan``."""
+    for model in (BookStat, BookDailyStat, UserStat, LibraryStat):
+        model.objects.all().delete()
+
+    book_days, user_days, total_days = _loan_days()
+    returned = Q(is_returned=True)
+
+    book_rows = Loan.objects.values('book_id').annotate(
+        borrows=Count('id'), returns=Count('id', filter=returned),
+    ).order_by()
+    BookStat.objects.bulk_create(
+        (BookStat(book_id=row['book_id'], total_borrows=row['borrows'], total_returns=row['returns'],
+                  total_loan_days=book_days.get(row['book_id'], 0))
+         for row in book_rows.iterator()),
+        batch_size=5000,
+    )
+    daily_rows = Loan.objects.values('book_id', 'loan_date').annotate(borrows=Count('id')).order_by()
+    BookDailyStat.objects.bulk_create(
+        (BookDailyStat(book_id=row['book_id'], date=row['loan_date'], borrows=row['borrows'])
+         for row in daily_rows.iterator()),
+        batch_size=5000,
+    )
+    _rebuild_recent(recent_window_start())
+    user_rows = Loan.objects.values('user_id').annotate(
+        borrows=Count('id'), active=Count('id', filter=~returned),
+    ).order_by()
+    UserStat.objects.bulk_create(
+        (UserStat(user_id=row['user_id'], total_borrows=row['borrows'], active_loans=row['active'],
+                  total_loan_days=user_days.get(row['user_id'], 0))
+         for row in user_rows.iterator()),
+        batch_size=5000,
+    )
+    library = Loan.objects.aggregate(
+        total=Count('id'), active=Count('id', filter=~returned), returned=Count('id', filter=returned),
+    )
+    LibraryStat.objects.create(
+        shard=0, total_loans=library['total'], active_loans=library['active'],
+        returned_loans=library['returned'], total_loan_days=total_days,
+    )
+
+
+def _loan_days():
+    """Loan days per book, per user and in total, over all returned loans."""
+    # Date arithmetic differs per database, so this is summed in Python from
+    # a streamed (book, user, loan_date, return_date) scan.
+    book_days, user_days, total = {}, {}, 0
+    returned = Loan.objects.filter(is_returned=True, return_date__isnull=False).values_list(
+        'book_id', 'user_id', 'loan_date', 'return_date',
+    ).order_by()
+    for book_id, user_id, loan_date, return_date in returned.iterator(chunk_size=10000):
+        days = max((return_date - loan_date).days, 0)
+        book_days[book_id] = book_days.get(book_id, 0) + days
+        user_days[user_id] = user_days.get(user_id, 0) + days
+        total += days
+    return book_days, user_days, total
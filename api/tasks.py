@@ -0,0 +1,156 @@
+"""
+A small database-backed task queue.
+
+Work that need not finish inside a request is registered with ``@task`` and
+queued with ``func.enqueue(**kwargs)``; ``manage.py run_worker`` runs it.
+The queue is the ``Task`` table, so there is no broker to operate, and a
+task is inserted in the caller's transaction: workers only see it once that
+transaction commits, and it disappears if it rolls back.
+
+Workers claim ready tasks in batches, with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` where the database supports it (PostgreSQL) and otherwise with a
+single ``UPDATE ... WHERE status = 'queued' AND id IN (<next batch>)`` that
+only one worker can win per row (SQLite serializes such writers, so more
+than one worker there adds no throughput). Successful tasks are marked done
+with one ``UPDATE`` per batch. A task that raises is retried after
+``TASK_RETRY_DELAY * 2 ** (attempts - 1)`` seconds until it has used
+``max_attempts``, and one left ``running`` for longer than ``TASK_TIMEOUT``
+seconds (its worker died) is queued again, so tasks must be safe to run more
+than once.
+"""
+
+import logging
+import traceback
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+def task(func=None, *, priority=0, max_attempts=3):
+    """
+    Register ``func`` as a task and give it ``enqueue(**kwargs)`` and
+    ``enqueue_many(kwargs_list)``. Arguments must be JSON-serializable.
+    """
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        REGISTRY[name] = func
+        func.task_name = name
+        func.enqueue = lambda **kwargs: enqueue(name, kwargs, priority=priority, max_attempts=max_attempts)
+        func.enqueue_many = lambda kwargs_list: enqueue_many(
+            name, kwargs_list, priority=priority, max_attempts=max_attempts,
+        )
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(name, kwargs=None, priority=0, max_attempts=3, delay=0):
+    """Queue task ``name``; workers see it when the current transaction commits."""
+    return Task.objects.create(
+        name=name, kwargs=kwargs or {}, priority=priority, max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def enqueue_many(name, kwargs_list, priority=0, max_attempts=3):
+    """Queue one task ``name`` per item of ``kwargs_list`` with batched inserts."""
+    now = timezone.now()
+    return Task.objects.bulk_create(
+        (Task(name=name, kwargs=kwargs, priority=priority, max_attempts=max_attempts, run_at=now)
+         for kwargs in kwargs_list),
+        batch_size=1000,
+    )
+
+
+def resolve(name):
+    if name not in REGISTRY:
+        # Importing the defining module registers its tasks
+        import_module(name.rsplit('.', 1)[0])
+    try:
+        return REGISTRY[name]
+    except KeyError:
+        raise LookupError(f'No task named {name!r} is registered.') from None
+
+
+def claim(worker, batch=100):
+    """Mark up to ``batch`` ready tasks as running for ``worker`` and return them."""
+    now = timezone.now()
+    ready = Task.objects.filter(status=Task.QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(ready.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch])
+        else:
+            # Writing first takes the write lock straight away, instead of
+            # upgrading a read lock, which SQLite cannot wait for
+            ids = ready.values('id')[:batch]
+        claimed = Task.objects.filter(id__in=ids, status=Task.QUEUED).update(
+            status=Task.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            return []
+        return list(
+            Task.objects.filter(status=Task.RUNNING, locked_by=worker, locked_at=now)
+            .order_by('-priority', 'run_at', 'id')
+        )
+
+
+def _fail(task, error):
+    now = timezone.now()
+    if task.attempts >= task.max_attempts:
+        Task.objects.filter(pk=task.pk).update(status=Task.FAILED, last_error=error, finished_at=now)
+    else:
+        delay = settings.TASK_RETRY_DELAY * 2 ** (task.attempts - 1)
+        Task.objects.filter(pk=task.pk).update(
+            status=Task.QUEUED, last_error=error, locked_by='', run_at=now + timedelta(seconds=delay),
+        )
+
+
+def execute(tasks):
+    """Run claimed ``tasks`` in order; returns how many succeeded."""
+    done = []
+    for task in tasks:
+        try:
+            resolve(task.name)(**task.kwargs)
+        except Exception:
+            logger.exception('Task %s (%s) failed', task.pk, task.name)
+            _fail(task, traceback.format_exc())
+        else:
+            done.append(task.pk)
+    Task.objects.filter(pk__in=done).update(status=Task.DONE, finished_at=timezone.now())
+    return len(done)
+
+
+def requeue_stale(timeout=None):
+    """Queue again, or fail, tasks whose worker has held them longer than ``timeout`` seconds."""
+    timeout = settings.TASK_TIMEOUT if timeout is None else timeout
+    now = timezone.now()
+    stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=now - timedelta(seconds=timeout))
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.FAILED, last_error='Worker timed out.', finished_at=now,
+    )
+    return stale.update(status=Task.QUEUED, locked_by='', run_at=now)
+
+
+def purge(retention=None):
+    """Delete tasks that finished successfully more than ``retention`` seconds ago."""
+    retention = settings.TASK_RETENTION if retention is None else retention
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    return Task.objects.filter(status=Task.DONE, finished_at__lt=cutoff).delete()[0]
+
+
+def run_pending(worker='inline', batch=100):
+    """Claim and run ready tasks until none are left; returns the number run."""
+    count = 0
+    while tasks := claim(worker, batch):
+        execute(tasks)
+        count += len(tasks)
+    return count
@@ -1,23 +1,57 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from unittest import mock
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
-from django.test import TestCase
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from datetime import date, timedelta
 from rest_framework import status
 from rest_framework.test import APITestCase
-from .models import User, Book, Loan
+from . import bulk, changes, events, idempotency, pagecache, recommendations, stats, sync, tasks
+from .admin import BookAdmin
+from .counts import invalidate_counts
+from .isbn import has_valid_checksum, isbn13_check_digit, make_isbn13, normalize
+from .pagination import BookPagination
+from .models import (
+    User, Book, BookRecommendation, BulkJob, Loan, Hold, Task, BookDailyStat, BookRecentStat, BookStat, LibraryStat,
+    UserStat, SyncState, IdempotencyKey,
+)
 from .serializers import UserSerializer, BookSerializer, LoanSerializer
+from .versioning import StaleVersionError
+from .views import LoanViewSet
 from rest_framework_simplejwt.tokens import RefreshToken
+from library.log import AsyncFileHandler, JsonFormatter, SamplingFilter
+from library.middleware import CompressionMiddleware, negotiate
+from library.schema import load_schema, schema_sources
 
 class UserViewSetTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpassword')
-        self.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
         
-        refresh = RefreshToken.for_user(self.user)
-        self.user_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.user)
+        cls.user_token = str(refresh.access_token)
         
-        refresh = RefreshToken.for_user(self.admin)
-        self.admin_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.admin)
+        cls.admin_token = str(refresh.access_token)
 
     def test_registration(self):
         url = reverse('api:user-list')
@@ -76,24 +110,25 @@ class UserViewSetTest(APITestCase):
 
 
 class BookViewSetTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpassword')
-        self.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
         
-        refresh = RefreshToken.for_user(self.user)
-        self.user_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.user)
+        cls.user_token = str(refresh.access_token)
         
-        refresh = RefreshToken.for_user(self.admin)
-        self.admin_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.admin)
+        cls.admin_token = str(refresh.access_token)
         
-        self.book1 = Book.objects.create(
+        cls.book1 = Book.objects.create(
             title='Test Book 1',
             author='Author 1',
             isbn='1234567890123',
             page_count=100,
             availability=True
         )
-        self.book2 = Book.objects.create(
+        cls.book2 = Book.objects.create(
             title='Test Book 2',
             author='Author 2',
             isbn='9876543210987',
@@ -182,13 +217,15 @@ class BookViewSetTest(APITestCase):
 
     def test_pagination(self):
         # Create more books to test pagination
-        for i in range(15):
-            Book.objects.create(
+        Book.objects.bulk_create(
+            Book(
                 title=f'Book {i}',
                 author=f'Author {i}',
                 isbn=f'111111111111{i}',
                 page_count=100
             )
+            for i in range(15)
+        )
         url = reverse('api:book-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -210,28 +247,29 @@ class BookViewSetTest(APITestCase):
 
 
 class LoanViewSetTest(APITestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpassword')
-        self.user2 = User.objects.create_user(username='testuser2', password='testpassword2')
-        self.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.user2 = User.objects.create_user(username='testuser2', password='testpassword2')
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
         
-        refresh = RefreshToken.for_user(self.user)
-        self.user_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.user)
+        cls.user_token = str(refresh.access_token)
         
-        refresh = RefreshToken.for_user(self.user2)
-        self.user2_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.user2)
+        cls.user2_token = str(refresh.access_token)
         
-        refresh = RefreshToken.for_user(self.admin)
-        self.admin_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.admin)
+        cls.admin_token = str(refresh.access_token)
         
-        self.book1 = Book.objects.create(
+        cls.book1 = Book.objects.create(
             title='Available Book',
             author='Author 1',
             isbn='1234567890123',
             page_count=100,
             availability=True
         )
-        self.book2 = Book.objects.create(
+        cls.book2 = Book.objects.create(
             title='Unavailable Book',
             author='Author 2',
             isbn='9876543210987',
@@ -426,9 +464,10 @@ class BookModelTest(TestCase):
 
 
 class LoanModelTest(TestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.book = Book.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpass')
+        cls.book = Book.objects.create(
             title='Test Book',
             author='Test Author',
             isbn='1234567890123',
@@ -522,9 +561,10 @@ class BookSerializerTest(TestCase):
 
 
 class LoanSerializerTest(TestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username='testuser', password='testpass')
-        self.book = Book.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpass')
+        cls.book = Book.objects.create(
             title='Test Book',
             author='Test Author',
             isbn='1234567890123',
@@ -559,24 +599,25 @@ class LoanSerializerTest(TestCase):
 
 
 class LoanWorkflowTest(APITestCase):
-    def setUp(self):
-        self.user1 = User.objects.create_user(username='user1', password='pass1')
-        self.user2 = User.objects.create_user(username='user2', password='pass2')
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='user1', password='pass1')
+        cls.user2 = User.objects.create_user(username='user2', password='pass2')
         
-        refresh = RefreshToken.for_user(self.user1)
-        self.user1_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.user1)
+        cls.user1_token = str(refresh.access_token)
         
-        refresh = RefreshToken.for_user(self.user2)
-        self.user2_token = str(refresh.access_token)
+        refresh = RefreshToken.for_user(cls.user2)
+        cls.user2_token = str(refresh.access_token)
         
-        self.book1 = Book.objects.create(
+        cls.book1 = Book.objects.create(
             title='Book 1',
             author='Author 1',
             isbn='1111111111111',
             page_count=100,
             availability=True
         )
-        self.book2 = Book.objects.create(
+        cls.book2 = Book.objects.create(
             title='Book 2',
             author='Author 2',
             isbn='2222222222222',
@@ -667,16 +708,16 @@ class LoanWorkflowTest(APITestCase):
 
     def test_pagination_in_book_list_after_borrowing(self):
         # Create multiple books
-        books = []
-        for i in range(12):
-            book = Book.objects.create(
+        books = Book.objects.bulk_create(
+            Book(
                 title=f'Book {i}',
                 author=f'Author {i}',
                 isbn=f'999999999900{i}',
                 page_count=100,
                 availability=True
             )
-            books.append(book)
+            for i in range(12)
+        )
         
         # Borrow one book
         url = reverse('api:loan-list')
@@ -694,3 +735,1551 @@ class LoanWorkflowTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 10)  # PAGE_SIZE is 10
         self.assertIn('next', response.data)
+
+
+class LoggingPipelineTest(SimpleTestCase):
+    def make_record(self, level=logging.INFO, msg='hello %s', args=('world',), **extra):
+        record = logging.LogRecord('api', level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter_outputs_structured_line(self):
+        line = JsonFormatter().format(self.make_record(request_id='abc'))
+        payload = json.loads(line)
+        self.assertEqual(payload['message'], 'hello world')
+        self.assertEqual(payload['level'], 'INFO')
+        self.assertEqual(payload['logger'], 'api')
+        self.assertEqual(payload['request_id'], 'abc')
+
+    def test_sampling_filter_keeps_fraction_of_info(self):
+        sampler = SamplingFilter(rate=0.25)
+        kept = sum(sampler.filter(self.make_record()) for _ in range(100))
+        self.assertEqual(kept, 25)
+
+    def test_sampling_filter_never_drops_warnings(self):
+        sampler = SamplingFilter(rate=0)
+        self.assertFalse(sampler.filter(self.make_record()))
+        self.assertTrue(sampler.filter(self.make_record(level=logging.WARNING)))
+        self.assertTrue(sampler.filter(self.make_record(level=logging.ERROR)))
+
+    def test_async_file_handler_writes_from_background_thread(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'app.log')
+            handler = AsyncFileHandler(path, max_bytes=1024, backup_count=1)
+            handler.setFormatter(JsonFormatter())
+            logger = logging.getLogger('api.tests.async')
+            logger.addHandler(handler)
+            logger.propagate = False
+            try:
+                logger.warning('queued %d', 1)
+            finally:
+                logger.removeHandler(handler)
+                handler.close()
+            with open(path) as fh:
+                payload = json.loads(fh.readline())
+            self.assertEqual(payload['message'], 'queued 1')
+
+    def test_async_file_handler_drops_when_queue_full(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            handler = AsyncFileHandler(os.path.join(tmp, 'app.log'), queue_size=1)
+            # Without a listener nothing drains the queue.
+            with mock.patch.object(handler, '_ensure_listener'):
+                handler.handle(self.make_record())
+                handler.handle(self.make_record())
+            self.assertEqual(handler.dropped, 1)
+            handler.close()
+
+
+class GunicornConfigTest(SimpleTestCase):
+    def test_config_file_loads(self):
+        from gunicorn.app.base import Application
+        from gunicorn.config import Config
+
+        # What gunicorn does with gunicorn.conf.py when it starts
+        app = Application.__new__(Application)
+        app.cfg = Config()
+        app.load_config_from_file(str(settings.BASE_DIR / 'gunicorn.conf.py'))
+        self.assertGreater(app.cfg.workers, 1)
+        self.assertEqual(app.cfg.worker_class_str, 'sync')
+
+
+class SeedSyntheticCommandTest(TestCase):
+    def seed(self, **options):
+        options = {'users': 5, 'books': 40, 'loans': 200, 'stdout': io.StringIO(), **options}
+        call_command('seed_synthetic', **options)
+
+    def test_creates_requested_rows(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Book.objects.count(), 40)
+        self.assertEqual(Loan.objects.count(), 200)
+
+    def test_isbns_have_valid_checksums(self):
+        self.seed()
+        for isbn in Book.objects.values_list('isbn', flat=True):
+            self.assertEqual(len(isbn), 13)
+            self.assertEqual(isbn[-1], isbn13_check_digit(isbn[:12]))
+
+    def test_active_loans_match_unavailable_books(self):
+        self.seed(active_ratio=0.1)
+        active = Loan.objects.filter(is_returned=False)
+        self.assertEqual(active.count(), 20)
+        self.assertEqual(
+            set(active.values_list('book_id', flat=True)),
+            set(Book.objects.filter(availability=False).values_list('id', flat=True)),
+        )
+        self.assertFalse(Loan.objects.filter(is_returned=True, return_date__isnull=True).exists())
+
+    def test_same_seed_gives_same_data(self):
+        self.seed(seed=7)
+        first = list(Book.objects.order_by('id').values_list('title', 'isbn', 'availability'))
+        Loan.objects.all().delete()
+        Book.objects.all().delete()
+        User.objects.all().delete()
+        self.seed(seed=7)
+        self.assertEqual(list(Book.objects.order_by('id').values_list('title', 'isbn', 'availability')), first)
+
+    def test_refuses_to_reuse_usernames(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class SwaggerTest(APITestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.schema_path = os.path.join(tmp.name, 'openapi.json')
+        settings_override = override_settings(OPENAPI_SCHEMA_PATH=self.schema_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        load_schema.cache_clear()
+        self.addCleanup(load_schema.cache_clear)
+
+    def test_swagger_schema_is_served(self):
+        response = self.client.get(reverse('schema-json'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('/books/', json.loads(response.content)['paths'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_legacy_format_parameter_serves_schema(self):
+        response = self.client.get('/swagger/', {'format': 'openapi'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('/books/', json.loads(response.content)['paths'])
+
+    def test_swagger_ui_is_served(self):
+        response = self.client.get('/swagger/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, reverse('schema-json'))
+
+    def test_conditional_request_returns_not_modified(self):
+        etag = self.client.get(reverse('schema-json'))['ETag']
+        response = self.client.get(reverse('schema-json'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_schema_is_generated_once_and_written_to_disk(self):
+        self.client.get(reverse('schema-json'))
+        self.assertTrue(os.path.exists(self.schema_path))
+        with mock.patch('library.schema.generate_schema') as generate:
+            self.client.get(reverse('schema-json'))
+        generate.assert_not_called()
+
+    def test_stale_file_is_regenerated(self):
+        with open(self.schema_path, 'w') as fh:
+            json.dump({'x-source-fingerprint': 'old', 'paths': {}}, fh)
+        response = self.client.get(reverse('schema-json'))
+        self.assertIn('/books/', json.loads(response.content)['paths'])
+
+    def test_generate_schema_command_and_check(self):
+        call_command('generate_schema', stdout=io.StringIO())
+        call_command('generate_schema', check=True, stdout=io.StringIO())
+        with open(self.schema_path) as fh:
+            schema = json.load(fh)
+        schema['x-source-fingerprint'] = 'old'
+        with open(self.schema_path, 'w') as fh:
+            json.dump(schema, fh)
+        with self.assertRaises(CommandError):
+            call_command('generate_schema', check=True, stdout=io.StringIO())
+
+    def test_yaml_export_does_not_replace_the_json_schema(self):
+        call_command('generate_schema', stdout=io.StringIO())
+        call_command('generate_schema', format='yaml', stdout=io.StringIO())
+        call_command('generate_schema', check=True, stdout=io.StringIO())
+        self.assertTrue(os.path.exists(os.path.splitext(self.schema_path)[0] + '.yaml'))
+
+    def test_fingerprint_covers_the_whole_api_package(self):
+        sources = schema_sources()
+        self.assertIn('api/changes.py', sources)
+        self.assertIn('api/pagination.py', sources)
+        self.assertNotIn('api/tests.py', sources)
+
+
+class DashboardViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.other = User.objects.create_user(username='otheruser', password='testpassword')
+        cls.user_token = str(RefreshToken.for_user(cls.user).access_token)
+        cls.books = Book.objects.bulk_create(
+            Book(
+                title=f'Dashboard Book {i}',
+                author=f'Author {i}',
+                isbn=f'97800000000{i:02d}',
+                page_count=100,
+                availability=i >= 3
+            )
+            for i in range(12)
+        )
+        due = date.today() + timedelta(days=14)
+        Loan.objects.create(user=cls.user, book=cls.books[0], due_date=due)
+        Loan.objects.create(user=cls.user, book=cls.books[1], due_date=due)
+        Loan.objects.create(user=cls.other, book=cls.books[2], due_date=due)
+        Loan.objects.create(user=cls.user, book=cls.books[3], due_date=due, is_returned=True)
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.user_token)
+
+    def test_requires_authentication(self):
+        self.client.credentials()
+        response = self.client.get(reverse('api:dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_returns_loans_books_and_counters(self):
+        response = self.client.get(reverse('api:dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(loan['book_title'] for loan in response.data['loans']),
+            ['Dashboard Book 0', 'Dashboard Book 1'],
+        )
+        self.assertEqual(response.data['books']['count'], 12)
+        self.assertEqual(len(response.data['books']['results']), 10)
+        self.assertEqual(
+            response.data['counters'],
+            {'total_books': 12, 'available_books': 9, 'active_loans': 2},
+        )
+
+    def test_book_page_accepts_list_filters(self):
+        response = self.client.get(reverse('api:dashboard'), {'availability': 'false', 'page': 1})
+        self.assertEqual(response.data['books']['count'], 3)
+        self.assertEqual(response.data['counters']['total_books'], 12)
+        response = self.client.get(reverse('api:dashboard'), {'search': 'Book 11'})
+        self.assertEqual([b['title'] for b in response.data['books']['results']], ['Dashboard Book 11'])
+
+    def test_query_count_is_constant(self):
+        # Auth user lookup, loans with their books, book count, book page, available count.
+        with self.assertNumQueries(5):
+            self.client.get(reverse('api:dashboard'))
+        # The loans are then served from the per-user cache, with only their titles read
+        with self.assertNumQueries(5):
+            self.client.get(reverse('api:dashboard'))
+
+    @override_settings(COUNT_EXACT_THRESHOLD=1)
+    def test_counters_are_cached_like_list_counts(self):
+        self.client.get(reverse('api:dashboard'))
+        # Auth user lookup, loan titles and the book page; both counts are cached
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api:dashboard'))
+        self.assertEqual(response.data['counters']['available_books'], 9)
+
+
+class BookEventsTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.user_token = str(RefreshToken.for_user(cls.user).access_token)
+        cls.book = Book.objects.create(
+            title='Event Book', author='Author', isbn='9780000000001', page_count=100, availability=True
+        )
+
+    def test_broker_fans_out_to_every_subscription(self):
+        broker = events.Broker()
+        first, second = broker.subscribe(), broker.subscribe()
+        broker.publish('a', 'availability', {'book': 1})
+        self.assertEqual(first.get(0), [('availability', {'book': 1})])
+        self.assertEqual(second.get(0), [('availability', {'book': 1})])
+        broker.unsubscribe(first)
+        self.assertEqual(len(broker), 1)
+
+    def test_slow_subscription_coalesces_then_resyncs(self):
+        broker = events.Broker()
+        subscription = broker.subscribe(max_pending=2)
+        broker.publish(1, 'availability', {'book': 1, 'availability': False})
+        broker.publish(1, 'availability', {'book': 1, 'availability': True})
+        self.assertEqual(subscription.get(0), [('availability', {'book': 1, 'availability': True})])
+
+        for key in range(3):
+            broker.publish(key, 'availability', {'book': key})
+        self.assertEqual(subscription.dropped, 3)
+        self.assertEqual(subscription.get(0), [events.RESYNC])
+        self.assertEqual(subscription.get(0), [])
+
+    def test_async_reader_is_woken_from_another_thread(self):
+        broker = events.Broker()
+        subscription = broker.subscribe()
+
+        async def read():
+            threading.Timer(0.01, broker.publish, (1, 'availability', {'book': 1})).start()
+            return await subscription.aget(5)
+
+        self.assertEqual(asyncio.run(read()), [('availability', {'book': 1})])
+
+    def test_borrow_and_return_publish_after_commit(self):
+        subscription = events.broker.subscribe()
+        self.addCleanup(events.broker.unsubscribe, subscription)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.user_token)
+        due = (date.today() + timedelta(days=14)).isoformat()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api:loan-list'), {'book': self.book.id, 'due_date': due})
+        self.assertEqual(
+            subscription.get(0), [('availability', {'book': self.book.id, 'availability': False})]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api:loan-return-book', args=[response.data['id']]))
+        self.assertEqual(
+            subscription.get(0), [('availability', {'book': self.book.id, 'availability': True})]
+        )
+
+    def test_sync_workers_are_told_to_poll(self):
+        response = self.client.get(reverse('api:events'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len(events.broker), 0)
+
+    @override_settings(EVENTS_STREAMING=True, EVENTS_MAX_SUBSCRIBERS=1)
+    def test_subscribers_are_capped_per_process(self):
+        subscription = events.broker.subscribe()
+        self.addCleanup(events.broker.unsubscribe, subscription)
+        with self.assertLogs('django.request', 'INFO') as logs:
+            response = self.client.get(reverse('api:events'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual([record.levelname for record in logs.records], ['INFO'])
+
+    @override_settings(EVENTS_STREAMING=True)
+    def test_unread_stream_unsubscribes_on_close(self):
+        response = self.client.get(reverse('api:events'))
+        self.assertEqual(len(events.broker), 1)
+        response.close()
+        self.assertEqual(len(events.broker), 0)
+
+    @override_settings(EVENTS_STREAMING=True, EVENTS_HEARTBEAT=0.01, EVENTS_MAX_DURATION=5)
+    def test_event_stream(self):
+        response = self.client.get(reverse('api:events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = iter(response.streaming_content)
+        self.assertEqual(next(content), b'retry: 3000\n\n')
+        self.assertEqual(next(content), b': keepalive\n\n')
+
+        events.publish_availability(self.book.id, False)
+        self.assertEqual(
+            next(content),
+            b'event: availability\ndata: {"book": %d, "availability": false}\n\n' % self.book.id,
+        )
+        response.close()
+        self.assertEqual(len(events.broker), 0)
+
+
+class HoldViewSetTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.borrower = User.objects.create_user(username='borrower', password='testpassword')
+        cls.first = User.objects.create_user(username='first', password='testpassword')
+        cls.second = User.objects.create_user(username='second', password='testpassword')
+        cls.book = Book.objects.create(
+            title='Popular Book', author='Author', isbn='9780000000001', page_count=100, availability=False
+        )
+        cls.loan = Loan.objects.create(
+            user=cls.borrower, book=cls.book, due_date=date.today() + timedelta(days=14)
+        )
+
+    def authenticate(self, user):
+        token = str(RefreshToken.for_user(user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def place_hold(self, user, book=None):
+        self.authenticate(user)
+        return self.client.post(reverse('api:hold-list'), {'book': (book or self.book).id})
+
+    def test_holds_are_queued_in_order(self):
+        self.assertEqual(self.place_hold(self.first).data['position'], 1)
+        response = self.place_hold(self.second)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['position'], 2)
+
+        response = self.client.get(reverse('api:hold-list'))
+        self.assertEqual([(h['book'], h['position']) for h in response.data['results']], [(self.book.id, 2)])
+
+    def test_cannot_hold_available_or_already_held_book(self):
+        available = Book.objects.create(
+            title='Shelf Book', author='Author', isbn='9780000000002', page_count=100, availability=True
+        )
+        self.assertEqual(self.place_hold(self.first, available).status_code, status.HTTP_400_BAD_REQUEST)
+        self.place_hold(self.first)
+        self.assertEqual(self.place_hold(self.first).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.place_hold(self.borrower).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_return_hands_book_to_next_holder(self):
+        first_hold = self.place_hold(self.first).data['id']
+        second_hold = self.place_hold(self.second).data['id']
+
+        self.authenticate(self.borrower)
+        response = self.client.post(reverse('api:loan-return-book', args=[self.loan.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.book.refresh_from_db()
+        self.assertFalse(self.book.availability)
+        hold = Hold.objects.get(pk=first_hold)
+        self.assertEqual(hold.status, Hold.FULFILLED)
+        self.assertEqual(hold.loan.user, self.first)
+        self.assertFalse(hold.loan.is_returned)
+        self.assertEqual(Hold.objects.get(pk=second_hold).queue_position(), 1)
+
+    def test_cancelled_hold_leaves_queue(self):
+        first_hold = self.place_hold(self.first).data['id']
+        self.place_hold(self.second)
+
+        self.authenticate(self.first)
+        response = self.client.delete(reverse('api:hold-detail', args=[first_hold]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Hold.objects.get(pk=first_hold).status, Hold.CANCELLED)
+
+        self.authenticate(self.borrower)
+        self.client.post(reverse('api:loan-return-book', args=[self.loan.id]))
+        self.assertEqual(Loan.objects.get(book=self.book, is_returned=False).user, self.second)
+
+    def test_list_query_count_is_constant(self):
+        books = Book.objects.bulk_create(
+            Book(title=f'Held {i}', author='Author', isbn=f'97800000001{i:02d}', page_count=100, availability=False)
+            for i in range(5)
+        )
+        Hold.objects.bulk_create(Hold(user=self.first, book=book) for book in books)
+        self.authenticate(self.first)
+        # Auth user lookup, page count, holds with their positions and books.
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api:hold-list'))
+        self.assertEqual([h['position'] for h in response.data['results']], [1] * 5)
+
+
+class IdempotencyKeyTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.other = User.objects.create_user(username='otheruser', password='testpassword')
+        cls.book = Book.objects.create(
+            title='Retry Book', author='Author', isbn='9780000000001', page_count=100, availability=True
+        )
+
+    def setUp(self):
+        self.authenticate(self.user)
+        self.payload = {'book': self.book.id, 'due_date': (date.today() + timedelta(days=14)).isoformat()}
+
+    def authenticate(self, user):
+        token = str(RefreshToken.for_user(user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def borrow(self, key, payload=None):
+        return self.client.post(
+            reverse('api:loan-list'), payload or self.payload, format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retried_borrow_replays_first_response(self):
+        first = self.borrow('key-1')
+        retry = self.borrow('key-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(Loan.objects.count(), 1)
+
+    def test_retried_return_replays_success(self):
+        loan_id = self.borrow('borrow').data['id']
+        url = reverse('api:loan-return-book', args=[loan_id])
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='return').status_code, status.HTTP_200_OK)
+        retry = self.client.post(url, HTTP_IDEMPOTENCY_KEY='return')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self.borrow('key-1')
+        other = dict(self.payload, due_date=(date.today() + timedelta(days=7)).isoformat())
+        self.assertEqual(self.borrow('key-1', other).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_errors_are_not_stored(self):
+        Book.objects.filter(pk=self.book.pk).update(availability=False)
+        self.assertEqual(self.borrow('key-1').status_code, status.HTTP_400_BAD_REQUEST)
+        Book.objects.filter(pk=self.book.pk).update(availability=True)
+        self.assertEqual(self.borrow('key-1').status_code, status.HTTP_201_CREATED)
+
+    def test_keys_are_scoped_per_user(self):
+        self.borrow('shared')
+        self.authenticate(self.other)
+        response = self.borrow('shared')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+
+    def test_in_flight_key_conflicts(self):
+        # Claimed by a request still running in another worker
+        request = RequestFactory().post(reverse('api:loan-list'))
+        request.user = self.user
+        IdempotencyKey.objects.create(
+            key=idempotency._stored_key(request, 'key-1'),
+            fingerprint=hashlib.sha256(json.dumps(self.payload, separators=(',', ':')).encode()).hexdigest(),
+            expires_at=timezone.now() + timedelta(seconds=60),
+        )
+        self.assertEqual(self.borrow('key-1').status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Loan.objects.count(), 0)
+
+    def test_expired_keys_are_reclaimed_and_purged(self):
+        self.borrow('key-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(idempotency.purge(), 1)
+        # The retry runs again instead of being replayed
+        self.assertEqual(self.borrow('key-1').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_registration_is_idempotent(self):
+        self.client.credentials()
+        data = {'username': 'newuser', 'email': 'new@example.com', 'password': 'newpassword123'}
+        first = self.client.post(reverse('api:user-list'), data, HTTP_IDEMPOTENCY_KEY='signup')
+        retry = self.client.post(reverse('api:user-list'), data, HTTP_IDEMPOTENCY_KEY='signup')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data['id'], first.data['id'])
+
+
+class SparseFieldsTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword', email='t@example.com')
+        cls.user_token = str(RefreshToken.for_user(cls.user).access_token)
+        cls.books = Book.objects.bulk_create(
+            Book(title=f'Sparse {i}', author='Author', isbn=f'97800000000{i:02d}', page_count=100)
+            for i in range(3)
+        )
+        for book in cls.books:
+            Loan.objects.create(user=cls.user, book=book, due_date=date.today() + timedelta(days=14))
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.user_token)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, [query['sql'] for query in queries]
+
+    def test_book_fields_narrow_output_and_select(self):
+        response, queries = self.get(reverse('api:book-list'), fields='id,title')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+        self.assertNotIn('"author"', queries[-1])
+        self.assertIn('"title"', queries[-1])
+
+        response, _ = self.get(reverse('api:book-detail', args=[self.books[0].id]), fields='isbn')
+        self.assertEqual(response.data, {'isbn': '9780000000000'})
+
+    def test_loan_join_only_when_book_title_requested(self):
+        response, queries = self.get(reverse('api:loan-list'), fields='id,book')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'book'})
+        self.assertNotIn('JOIN', queries[-1])
+
+        response, queries = self.get(reverse('api:loan-list'), fields='id,book_title')
+        self.assertEqual(response.data['results'][0]['book_title'][:7], 'Sparse ')
+        self.assertIn('JOIN', queries[-1])
+        self.assertNotIn('"author"', queries[-1])
+
+    def test_full_loan_list_joins_books_once(self):
+        response, queries = self.get(reverse('api:loan-list'))
+        self.assertEqual(len(response.data['results']), 3)
+        # Auth user lookup, loans joined with their books (counted in memory).
+        self.assertEqual(len(queries), 2)
+
+    def test_user_fields(self):
+        response, _ = self.get(reverse('api:user-detail', args=[self.user.id]), fields='username,email')
+        self.assertEqual(response.data, {'username': 'testuser', 'email': 't@example.com'})
+
+    def test_unknown_or_write_only_field_is_rejected(self):
+        response, _ = self.get(reverse('api:book-list'), fields='id,nope')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('nope', response.data['fields'])
+        response, _ = self.get(reverse('api:user-list'), fields='password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(COMPRESSION_ENCODINGS=['gzip'], COMPRESSION_MIN_SIZE=200)
+class CompressionMiddlewareTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.bulk_create(
+            Book(title=f'Compressed Book {i}', author='Author', isbn=f'97800000000{i:02d}', page_count=100)
+            for i in range(10)
+        )
+
+    def test_large_json_is_gzipped(self):
+        plain = self.client.get(reverse('api:book-list'))
+        response = self.client.get(reverse('api:book-list'), HTTP_ACCEPT_ENCODING='br;q=1, gzip;q=0.8')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertLess(int(response['Content-Length']), len(plain.content))
+        self.assertEqual(zlib.decompress(response.content, 16 + zlib.MAX_WBITS), plain.content)
+
+    def test_small_or_unaccepted_responses_are_left_alone(self):
+        response = self.client.get(reverse('api:book-list'), {'search': 'nothing'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get(reverse('api:book-list'), HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(EVENTS_STREAMING=True, EVENTS_HEARTBEAT=0.01, EVENTS_MAX_DURATION=5)
+    def test_streams_are_compressed_incrementally(self):
+        response = self.client.get(reverse('api:events'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        content = iter(response.streaming_content)
+        self.assertEqual(decompressor.decompress(next(content)), b'retry: 3000\n\n')
+        self.assertEqual(decompressor.decompress(next(content)), b': keepalive\n\n')
+        response.close()
+
+    def test_strong_etag_is_weakened(self):
+        middleware = CompressionMiddleware(lambda request: HttpResponse(b'x' * 1000, headers={'ETag': '"abc"'}))
+        response = middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_pages_with_a_csrf_token_only_get_padded_gzip(self):
+        body = b'<input name="csrfmiddlewaretoken">' * 100
+
+        def view(request):
+            get_token(request)
+            return HttpResponse(body, content_type='text/html')
+
+        middleware = CompressionMiddleware(view)
+        middleware.encoders = {'br': mock.Mock(), **middleware.encoders}
+        sizes = set()
+        for _ in range(5):
+            response = middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='br, gzip'))
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(zlib.decompress(response.content, 16 + zlib.MAX_WBITS), body)
+            sizes.add(len(response.content))
+        # Random bytes in the gzip header vary the length (BREACH)
+        self.assertGreater(len(sizes), 1)
+
+    def test_negotiation(self):
+        preferred = ['br', 'zstd', 'gzip']
+        self.assertEqual(negotiate('gzip, br', preferred), 'br')
+        self.assertEqual(negotiate('gzip;q=1.0, br;q=0.5', preferred), 'gzip')
+        self.assertEqual(negotiate('*', preferred), 'br')
+        self.assertEqual(negotiate('br;q=0, *;q=0.1', preferred), 'zstd')
+        self.assertIsNone(negotiate('identity', preferred))
+        self.assertIsNone(negotiate('', preferred))
+
+
+class PaginationTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.bulk_create(
+            Book(title=f'Paged Book {i}', author='Author', isbn=f'97800000000{i:02d}', page_count=100)
+            for i in range(25)
+        )
+
+    def test_client_selects_page_size(self):
+        response = self.client.get(reverse('api:book-list'), {'page_size': 20})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertIn('page_size=20', response.data['next'])
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(BookPagination, 'max_page_size', 5):
+            response = self.client.get(reverse('api:book-list'), {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_count_can_be_skipped(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:book-list'), {'count': 'false', 'page': 2})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('COUNT', queries[0]['sql'])
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(response.data['results'][0]['title'], 'Paged Book 10')
+        self.assertIn('page=3', response.data['next'])
+        self.assertNotIn('page=', response.data['previous'])
+
+        response = self.client.get(reverse('api:book-list'), {'count': 'false', 'page': 3})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(reverse('api:book-list'), {'count': 'false', 'page': 4})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(COUNT_EXACT_THRESHOLD=5)
+@override_settings(BOOK_LIST_CACHE_TTL=0)
+class CountStrategyTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.bulk_create(
+            Book(title=f'Counted Book {i}', author='Author', isbn=f'97800000000{i:02d}', page_count=100)
+            for i in range(10)
+        )
+
+    def list_books(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:book-list'), params)
+        return response, sum('COUNT(' in query['sql'] for query in queries)
+
+    def test_large_counts_are_cached_until_a_write(self):
+        self.assertEqual(self.list_books(), (mock.ANY, 1))
+        response, counts = self.list_books()
+        self.assertEqual((response.data['count'], counts), (10, 0))
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Book.objects.create(title='New', author='Author', isbn='9780000000999', page_count=100)
+        self.assertEqual(len(callbacks), 1)  # the generation moves only on commit
+        response, counts = self.list_books()
+        self.assertEqual((response.data['count'], counts), (11, 1))
+
+        # Set-based writes bypass signals and invalidate explicitly
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(title='New').delete()
+            Book.objects.bulk_create([Book(title='Bulk', author='Author', isbn='9780000000998', page_count=100)])
+            invalidate_counts(Book)
+        self.assertEqual(self.list_books()[0].data['count'], 11)
+
+    def test_small_counts_are_not_cached(self):
+        self.list_books(search='Book 1')
+        self.assertEqual(self.list_books(search='Book 1')[1], 1)
+
+    @mock.patch('api.counts.table_estimate', return_value=100000)
+    def test_unfiltered_large_table_uses_estimate(self, estimate):
+        response, counts = self.list_books(page_size=5)
+        self.assertEqual((response.data['count'], counts), (100000, 0))
+        self.assertIn('page=2', response.data['next'])
+        # Pages are bounded by the rows actually there, not by the estimate
+        self.assertIsNone(self.list_books(page_size=5, page=2)[0].data['next'])
+        self.assertEqual(self.list_books(page_size=5, page=3)[0].status_code, status.HTTP_404_NOT_FOUND)
+
+        response, counts = self.list_books(search='Counted')
+        self.assertEqual((response.data['count'], counts), (10, 1))
+        # One pg_class lookup per generation
+        self.assertEqual(estimate.call_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_counts(Book)
+        self.list_books(page_size=5)
+        self.assertEqual(estimate.call_count, 2)
+
+
+class StatsTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        cls.reader = User.objects.create_user(username='reader', password='testpassword')
+        cls.books = Book.objects.bulk_create(
+            Book(title=f'Stat Book {i}', author='Author', isbn=f'97800000000{i:02d}', page_count=100)
+            for i in range(3)
+        )
+
+    def authenticate(self, user):
+        token = str(RefreshToken.for_user(user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def borrow_and_return(self, book, days_ago):
+        self.authenticate(self.reader)
+        due = (date.today() + timedelta(days=14)).isoformat()
+        loan_id = self.client.post(reverse('api:loan-list'), {'book': book.id, 'due_date': due}).data['id']
+        self.client.post(reverse('api:loan-return-book', args=[loan_id]))
+        Loan.objects.filter(pk=loan_id).update(loan_date=date.today() - timedelta(days=days_ago))
+        return loan_id
+
+    def test_rollups_follow_borrows_and_returns(self):
+        self.borrow_and_return(self.books[0], 0)
+        self.borrow_and_return(self.books[0], 0)
+        self.authenticate(self.reader)
+        due = (date.today() + timedelta(days=14)).isoformat()
+        self.client.post(reverse('api:loan-list'), {'book': self.books[1].id, 'due_date': due})
+
+        self.authenticate(self.admin)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('api:stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals'], {
+            'total_loans': 3, 'active_loans': 1, 'returned_loans': 2, 'average_loan_days': 0.0,
+        })
+        self.assertEqual(
+            [(row['book'], row['borrows']) for row in response.data['most_borrowed']],
+            [(self.books[0].id, 2), (self.books[1].id, 1)],
+        )
+        self.assertEqual(response.data['most_borrowed_recent']['books'][0]['borrows'], 2)
+        self.assertEqual(response.data['top_borrowers'][0]['username'], 'reader')
+        self.assertEqual(response.data['top_borrowers'][0]['active_loans'], 1)
+
+    def test_rebuild_matches_history(self):
+        self.borrow_and_return(self.books[0], 10)
+        self.borrow_and_return(self.books[2], 4)
+        call_command('rebuild_stats', stdout=io.StringIO())
+
+        self.assertEqual(BookStat.objects.get(book=self.books[0]).total_loan_days, 10)
+        self.assertEqual(UserStat.objects.get(user=self.reader).total_borrows, 2)
+        self.assertEqual(LibraryStat.objects.get().total_loan_days, 14)
+        self.authenticate(self.admin)
+        response = self.client.get(reverse('api:stats'), {'days': 7})
+        self.assertEqual(response.data['totals']['average_loan_days'], 7.0)
+        self.assertEqual([row['book'] for row in response.data['most_borrowed_recent']['books']], [self.books[2].id])
+
+    def test_recent_window_rolls_forward_each_day(self):
+        self.borrow_and_return(self.books[0], 0)
+        since = BookRecentStat.objects.get().since
+        # A day later: the window no longer starts on the rows' since
+        BookRecentStat.objects.update(since=since - timedelta(days=1))
+        BookDailyStat.objects.create(book=self.books[1], date=since - timedelta(days=1), borrows=5)
+        self.authenticate(self.admin)
+        self.assertEqual(self.client.get(reverse('api:stats')).data['most_borrowed_recent']['books'], [])
+
+        self.assertTrue(stats.roll_recent())
+        self.assertFalse(stats.roll_recent())
+        books = self.client.get(reverse('api:stats')).data['most_borrowed_recent']['books']
+        self.assertEqual([(row['book'], row['borrows']) for row in books], [(self.books[0].id, 1)])
+
+    def test_staff_only_and_validated(self):
+        self.authenticate(self.reader)
+        self.assertEqual(self.client.get(reverse('api:stats')).status_code, status.HTTP_403_FORBIDDEN)
+        self.authenticate(self.admin)
+        self.assertEqual(self.client.get(reverse('api:stats'), {'limit': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecommendationTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.readers = [User.objects.create_user(username=f'reader{i}', password='testpassword') for i in range(3)]
+        cls.books = Book.objects.bulk_create(
+            Book(title=f'Related Book {i}', author='Author', isbn=f'97800000001{i:02d}', page_count=100)
+            for i in range(4)
+        )
+
+    def borrow(self, reader, *books):
+        Loan.objects.bulk_create(
+            Loan(user=reader, book=book, due_date=date.today() + timedelta(days=14)) for book in books
+        )
+
+    def test_full_build_and_related_endpoint(self):
+        a, b, c, d = self.books
+        self.borrow(self.readers[0], a, b, c)
+        self.borrow(self.readers[1], a, b)
+        self.borrow(self.readers[2], a, c, d)
+        call_command('build_recommendations', '--full', stdout=io.StringIO())
+
+        with self.assertNumQueries(2):  # the book, then its recommendations
+            response = self.client.get(reverse('api:book-related', args=[a.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['id'], row['score']) for row in response.data], [(b.id, 2), (c.id, 2)])
+        # d shares only one reader with a, below the default min_support
+        self.assertEqual(self.client.get(reverse('api:book-related', args=[d.id])).data, [])
+
+        recommendations.build(full=True, min_support=1, top_k=1)
+        self.assertEqual(list(BookRecommendation.objects.filter(book=d).values_list('recommended', 'rank')), [(a.id, 1)])
+
+    def test_incremental_refresh_reads_new_loans(self):
+        a, b, c, d = self.books
+        self.borrow(self.readers[0], a, b)
+        self.borrow(self.readers[1], c, d)
+        self.assertEqual(recommendations.build(min_support=1), 4)
+
+        self.borrow(self.readers[2], a, c)
+        # Only the books the new reader borrowed are recomputed
+        self.assertEqual(recommendations.build(min_support=1), 2)
+        incremental = list(BookRecommendation.objects.values_list('book', 'recommended', 'rank', 'score'))
+        recommendations.build(full=True, min_support=1)
+        full = list(BookRecommendation.objects.values_list('book', 'recommended', 'rank', 'score'))
+        self.assertEqual(incremental, full)
+        self.assertIn((a.id, c.id, 2, 1), full)
+
+    def test_unknown_book(self):
+        response = self.client.get(reverse('api:book-related', args=[999999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/books/abc/related/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deleted_book_has_no_recommendations(self):
+        a, b = self.books[:2]
+        BookRecommendation.objects.create(book=a, recommended=b, rank=1, score=2)
+        changes.delete_books(Book.objects.filter(pk=a.pk))
+        response = self.client.get(reverse('api:book-related', args=[a.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        cls.books = Book.objects.bulk_create(
+            Book(title=f'Admin Book {i}', author='Author', isbn=f'97800000002{i:02d}', page_count=100)
+            for i in range(5)
+        )
+        Loan.objects.bulk_create(
+            Loan(user=cls.admin, book=book, due_date=date.today() + timedelta(days=14)) for book in cls.books
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_loan_changelist_joins_instead_of_querying_per_row(self):
+        url = reverse('admin:api_loan_changelist')
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        Loan.objects.bulk_create(
+            Loan(user=self.admin, book=book, due_date=date.today()) for book in self.books
+        )
+        with CaptureQueriesContext(connection) as more:
+            response = self.client.get(url)
+        self.assertEqual(len(more), len(few))
+        # No second, unfiltered COUNT(*)
+        self.assertIsNone(response.context['cl'].full_result_count)
+
+    def test_isbn_search_is_exact(self):
+        url = reverse('admin:api_book_changelist')
+        response = self.client.get(url, {'q': self.books[1].isbn})
+        self.assertEqual(list(response.context['cl'].result_list), [self.books[1]])
+        response = self.client.get(url, {'q': self.books[1].isbn[:6]})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_loans_are_found_by_title_prefix(self):
+        url = reverse('admin:api_loan_changelist')
+        response = self.client.get(url, {'q': 'Admin Book 3'})
+        self.assertEqual([loan.book for loan in response.context['cl'].result_list], [self.books[3]])
+        response = self.client.get(url, {'q': 'admin'})
+        self.assertEqual(len(response.context['cl'].result_list), 5)
+        response = self.client.get(url, {'q': 'Book 3'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+
+class BulkActionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        cls.reader = User.objects.create_user(username='reader', password='testpassword')
+        cls.books = Book.objects.bulk_create(
+            Book(title=f'Bulk Book {i}', author='Author', isbn=f'97800000003{i:02d}', page_count=100)
+            for i in range(5)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def run_action(self, model, action, objects):
+        url = reverse(f'admin:api_{model}_changelist')
+        return self.client.post(url, {'action': action, '_selected_action': [obj.pk for obj in objects]}, follow=True)
+
+    def test_small_selection_is_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_action('book', 'mark_unavailable', self.books[:3])
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "api_book"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Book.objects.filter(availability=False).count(), 3)
+        self.assertFalse(BulkJob.objects.exists())
+
+    def test_force_return_shelves_books_or_serves_holds(self):
+        due = date.today() + timedelta(days=14)
+        loans = Loan.objects.bulk_create(Loan(user=self.reader, book=book, due_date=due) for book in self.books[:2])
+        Book.objects.filter(pk__in=[self.books[0].pk, self.books[1].pk]).update(availability=False)
+        call_command('rebuild_stats', stdout=io.StringIO())
+        hold = Hold.objects.create(user=self.admin, book=self.books[1])
+
+        self.run_action('loan', 'force_return', loans)
+
+        self.assertFalse(Loan.objects.filter(pk__in=[loan.pk for loan in loans], is_returned=False).exists())
+        self.assertTrue(Book.objects.get(pk=self.books[0].pk).availability)
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, Hold.FULFILLED)
+        self.assertEqual(hold.loan.user, self.admin)
+        self.assertFalse(Book.objects.get(pk=self.books[1].pk).availability)
+        self.assertEqual(UserStat.objects.get(user=self.reader).active_loans, 0)
+        self.assertEqual(BookStat.objects.get(book=self.books[1]).total_returns, 1)
+
+    def test_archived_loans_leave_the_staff_list(self):
+        due = date.today() + timedelta(days=14)
+        returned, active = Loan.objects.bulk_create(
+            [Loan(user=self.reader, book=self.books[0], due_date=due, is_returned=True),
+             Loan(user=self.reader, book=self.books[1], due_date=due)]
+        )
+        self.run_action('loan', 'archive', [returned, active])
+        self.assertEqual(list(Loan.objects.filter(archived=True)), [returned])
+
+        token = str(RefreshToken.for_user(self.admin).access_token)
+        response = self.client.get(reverse('api:loan-list'), HTTP_AUTHORIZATION='Bearer ' + token)
+        self.assertEqual([row['id'] for row in response.data['results']], [active.id])
+
+    @override_settings(BULK_ACTION_THRESHOLD=2, BULK_ACTION_CHUNK_SIZE=2)
+    def test_large_selection_runs_as_background_job(self):
+        response = self.run_action('book', 'mark_unavailable', self.books)
+        self.assertContains(response, 'bulk job')
+        self.assertTrue(Book.objects.filter(availability=True).exists())
+        job = BulkJob.objects.get()
+        self.assertEqual(Task.objects.get().kwargs, {'job_id': job.pk})
+        self.assertEqual(job.selection, [book.pk for book in self.books])
+        later = Book.objects.create(title='Later', author='Author', isbn='9780000000399', page_count=100)
+
+        self.assertEqual(tasks.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done, job.changed, job.total), (BulkJob.DONE, 5, 5, 5))
+        self.assertEqual(list(Book.objects.filter(availability=True)), [later])
+        self.assertContains(self.client.get(reverse('admin:api_bulkjob_changelist')), '5 / 5 (100%)')
+
+        # A re-run starts its counts over; the rows are already changed
+        bulk.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.done, job.changed), (5, 0))
+
+
+calls = []
+
+
+@tasks.task
+def record_call(value):
+    calls.append(value)
+
+
+@tasks.task(max_attempts=2)
+def always_fails():
+    raise RuntimeError('boom')
+
+
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_tasks_run_by_priority_and_are_marked_done(self):
+        tasks.enqueue(record_call.task_name, {'value': 'low'}, priority=-1)
+        record_call.enqueue_many([{'value': 'first'}, {'value': 'second'}])
+        tasks.enqueue(record_call.task_name, {'value': 'later'}, delay=60)
+
+        out = io.StringIO()
+        call_command('run_worker', '--burst', '--batch', '2', stdout=out)
+        self.assertEqual(calls, ['first', 'second', 'low'])
+        self.assertIn('ran 3 tasks (0 failed)', out.getvalue())
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 3)
+        self.assertEqual(Task.objects.get(status=Task.QUEUED).kwargs, {'value': 'later'})
+
+    def test_claimed_tasks_are_not_claimed_again(self):
+        record_call.enqueue_many([{'value': n} for n in range(3)])
+        first = tasks.claim('worker-a', batch=2)
+        second = tasks.claim('worker-b', batch=2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({task.pk for task in first} & {task.pk for task in second})
+        self.assertEqual(tasks.claim('worker-c'), [])
+
+    @override_settings(TASK_RETRY_DELAY=0)
+    def test_failures_are_retried_then_given_up(self):
+        always_fails.enqueue()
+        with self.assertLogs('api.tasks', 'ERROR'):
+            tasks.run_pending()
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+        self.assertIn('RuntimeError: boom', task.last_error)
+
+    def test_stale_tasks_are_requeued(self):
+        record_call.enqueue(value='lost')
+        tasks.claim('dead-worker')
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(tasks.requeue_stale(timeout=60), 1)
+        tasks.run_pending()
+        self.assertEqual(calls, ['lost'])
+
+
+class BookListCacheTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Book.objects.bulk_create(
+            Book(title=f'Cached Book {i}', author='Author', isbn=f'97800000004{i:02d}', page_count=100,
+                 availability=i % 2 == 0)
+            for i in range(12)
+        )
+
+    def test_repeated_pages_use_no_queries_until_a_write(self):
+        url = reverse('api:book-list')
+        first = self.client.get(url, {'search': 'Cached', 'page': 2})
+        with self.assertNumQueries(0):
+            again = self.client.get(url, {'page': 2, 'search': 'Cached'})
+        self.assertEqual(again.data, first.data)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[10].save()  # any committed write bumps the generation
+        with self.assertNumQueries(2):
+            self.client.get(url, {'page': 2, 'search': 'Cached'})
+
+    @override_settings(CACHE_WARM_LOG_SAMPLE_RATE=0.5)
+    def test_list_queries_are_logged_at_the_sample_rate(self):
+        with self.assertLogs('api.pagecache', 'INFO') as logs:
+            for _ in range(4):
+                self.client.get(reverse('api:book-list'), {'availability': 'true'})
+        self.assertEqual([record.query for record in logs.records], ['availability=true'] * 2)
+
+    def test_warm_up_learns_popular_queries_from_the_log(self):
+        records = [{'logger': 'api.pagecache', 'message': 'book list', 'query': 'availability=true'}] * 3
+        records += [{'logger': 'api.pagecache', 'message': 'book list', 'query': 'search=Cached+Book+1'}]
+        records += [{'logger': 'django', 'message': 'unrelated'}]
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as fh:
+            fh.write('\n'.join(json.dumps(record) for record in records) + '\nnot json\n')
+        self.addCleanup(os.unlink, fh.name)
+
+        self.assertEqual(pagecache.learned_queries(1, [fh.name]), ['availability=true'])
+        out = io.StringIO()
+        call_command('warm_cache', '--pages', '2', '--queries', '5', '--host', 'testserver', '--scheme', 'http',
+                     '--log', fh.name, stdout=out)
+        self.assertIn('Warmed 4 of 4 book list URLs', out.getvalue())
+
+        with self.assertNumQueries(0):
+            for params in ({}, {'page': 2}, {'availability': 'true'}, {'search': 'Cached Book 1'}):
+                self.assertEqual(self.client.get(reverse('api:book-list'), params).status_code, 200)
+
+    def test_concurrent_warm_up_runs_once(self):
+        cache.add(pagecache.LOCK_KEY, 'other-process')
+        self.assertIsNone(pagecache.warm(pages=1, queries=0))
+
+    @override_settings(CACHE_SHARED=False)
+    def test_pages_are_not_cached_in_a_per_process_cache(self):
+        url = reverse('api:book-list')
+        self.client.get(url)
+        # Another worker's write would not reach this process's cache
+        Book.objects.filter(pk=self.books[0].pk).update(availability=False)
+        self.assertFalse(self.client.get(url).data['results'][0]['availability'])
+        with self.assertRaises(CommandError):
+            call_command('warm_cache', stdout=io.StringIO())
+
+
+class ActiveLoanCacheTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='poller', password='testpassword')
+        cls.books = Book.objects.bulk_create(
+            Book(title=f'Polled Book {i}', author='Author', isbn=f'97800000005{i:02d}', page_count=100)
+            for i in range(2)
+        )
+
+    def setUp(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def my_loans(self):
+        return [loan['book'] for loan in self.client.get(reverse('api:loan-list')).data['results']]
+
+    def test_poll_is_served_from_cache_and_written_through(self):
+        self.assertEqual(self.my_loans(), [])
+        with self.assertNumQueries(1):  # only the JWT user lookup
+            self.assertEqual(self.my_loans(), [])
+
+        due = (date.today() + timedelta(days=14)).isoformat()
+        with self.captureOnCommitCallbacks(execute=True):
+            loan_id = self.client.post(reverse('api:loan-list'), {'book': self.books[0].id, 'due_date': due}).data['id']
+        with self.assertNumQueries(2):  # and the books' current titles
+            self.assertEqual(self.my_loans(), [self.books[0].id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api:loan-return-book', args=[loan_id]))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.my_loans(), [])
+
+    def test_cache_is_refreshed_only_after_commit(self):
+        self.my_loans()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Loan.objects.create(user=self.user, book=self.books[1], due_date=date.today())
+                raise RuntimeError('rolled back')
+        self.assertEqual(callbacks, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Loan.objects.create(user=self.user, book=self.books[1], due_date=date.today())
+        self.assertEqual(self.my_loans(), [self.books[1].id])
+
+    def test_renamed_book_shows_its_new_title(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Loan.objects.create(user=self.user, book=self.books[0], due_date=date.today())
+        self.my_loans()
+        Book.objects.filter(pk=self.books[0].pk).update(title='Renamed')
+        loans = self.client.get(reverse('api:loan-list')).data['results']
+        self.assertEqual(loans[0]['book_title'], 'Renamed')
+
+    @override_settings(CACHE_SHARED=False)
+    def test_not_cached_in_a_per_process_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Loan.objects.create(user=self.user, book=self.books[0], due_date=date.today())
+        self.my_loans()
+        self.assertIsNone(cache.get(f'active-loans:{self.user.pk}'))
+        # A return in another worker shows up straight away
+        Loan.objects.filter(user=self.user).update(is_returned=True)
+        self.assertEqual(self.my_loans(), [])
+
+
+class IsbnLookupTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        cls.book = Book.objects.create(title='Known', author='Author', isbn='9780306406157', page_count=100)
+
+    def test_normalize(self):
+        self.assertEqual(normalize('0-306-40615-2'), '9780306406157')
+        self.assertEqual(normalize('0 8044 2957 x'), '9780804429573')
+        self.assertEqual(normalize('978-0-306-40615-7'), '9780306406157')
+        for bad in ('12345', '978030640615A', '03064061X2'):
+            with self.assertRaises(ValueError):
+                normalize(bad)
+
+    def test_isbn10_is_stored_as_isbn13_and_clashes_with_it(self):
+        token = str(RefreshToken.for_user(self.admin).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+        data = {'title': 'Ten', 'author': 'Author', 'isbn': '0-8044-2957-X', 'page_count': 10}
+        response = self.client.post(reverse('api:book-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['isbn'], '9780804429573')
+
+        response = self.client.post(reverse('api:book-list'), dict(data, isbn='0306406152'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('isbn', response.data)
+
+    def test_lookup_by_either_form_is_one_query(self):
+        for form in ('9780306406157', '0-306-40615-2', '030640615-2'):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('api:book-by-isbn', args=[form]))
+            self.assertEqual(response.data['id'], self.book.id)
+
+        response = self.client.get(reverse('api:book-by-isbn', args=['9780000000002']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('api:book-by-isbn', args=['12-34']))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkBookCreateTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        cls.existing = Book.objects.create(title='Known', author='Author', isbn='9780306406157', page_count=100)
+
+    def setUp(self):
+        token = str(RefreshToken.for_user(self.admin).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def rows(self, count, start=0):
+        return [
+            {'title': f'Imported {i}', 'author': 'Author', 'isbn': make_isbn13(f'979000{i:06d}'), 'page_count': 10}
+            for i in range(start, start + count)
+        ]
+
+    def test_checksum_is_verified_only_for_changed_isbns(self):
+        legacy = Book.objects.create(title='Legacy', author='Author', isbn='1111111111111', page_count=10)
+        serializer = BookSerializer(legacy, data={'title': 'Renamed', 'isbn': '1111111111111'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer = BookSerializer(legacy, data={'isbn': '9780306406158'}, partial=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['isbn'], ['ISBN check digit is invalid.'])
+
+        legacy.full_clean()
+        legacy.isbn = '9780306406158'
+        with self.assertRaises(ValidationError):
+            legacy.full_clean()
+
+    def test_checksums(self):
+        self.assertTrue(has_valid_checksum('978-0-306-40615-7'))
+        self.assertTrue(has_valid_checksum('0-8044-2957-X'))
+        self.assertFalse(has_valid_checksum('9780306406158'))
+        self.assertFalse(has_valid_checksum('0306406153'))
+
+    def test_bulk_create_query_count_does_not_grow_with_rows(self):
+        url = reverse('api:book-list')
+        with self.assertNumQueries(5):  # user, isbn__in, savepoint, insert, release
+            response = self.client.post(url, self.rows(10), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        fields = [field for field in Book._meta.concrete_fields if not field.primary_key]
+        batch = min(1000, connection.ops.bulk_batch_size(fields, [Book()]))
+        with self.assertNumQueries(4 + -(-1500 // batch)):  # one insert per batch
+            response = self.client.post(url, self.rows(1500, start=10), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 1500)
+        self.assertTrue(all(book['id'] for book in response.data))
+        self.assertEqual(Book.objects.count(), 1511)
+
+    def test_errors_are_reported_per_row_and_nothing_is_saved(self):
+        rows = self.rows(4)
+        rows[1]['isbn'] = '9780306406158'  # bad check digit
+        rows[2]['isbn'] = '0-306-40615-2'  # the existing book as ISBN-10
+        rows[3]['isbn'] = rows[0]['isbn']
+        response = self.client.post(reverse('api:book-list'), rows[:2], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('isbn', response.data[1])
+
+        response = self.client.post(reverse('api:book-list'), [rows[0], rows[2], rows[3]], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('already exists', str(response.data[1]['isbn']))
+        self.assertIn('more than once', str(response.data[2]['isbn']))
+        self.assertEqual(Book.objects.count(), 1)
+
+    @override_settings(BOOK_BULK_MAX_ROWS=3)
+    def test_row_limit(self):
+        response = self.client.post(reverse('api:book-list'), self.rows(4), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Book.objects.count(), 1)
+
+
+class OptimisticLockingTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        cls.user = User.objects.create_user(username='reader', password='testpassword')
+        cls.book = Book.objects.create(title='Versioned', author='Author', isbn='9780306406157', page_count=100)
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+
+    def test_stale_save_raises_and_writes_only_changed_columns(self):
+        first = Book.objects.get(pk=self.book.pk)
+        second = Book.objects.get(pk=self.book.pk)
+        first.title = 'First'
+        with CaptureQueriesContext(connection) as queries:
+            first.save(update_fields=['title'])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('availability', queries[0]['sql'])
+        self.assertEqual(first.version, 2)
+
+        second.page_count = 200
+        with self.assertRaises(StaleVersionError), transaction.atomic():
+            second.save(update_fields=['page_count'])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.title, self.book.page_count, self.book.version), ('First', 100, 2))
+
+    def test_if_match(self):
+        self.authenticate(self.admin)
+        url = reverse('api:book-detail', args=[self.book.pk])
+        response = self.client.get(url)
+        self.assertEqual(response['ETag'], '"1"')
+
+        response = self.client.patch(url, {'title': 'Renamed'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+
+        response = self.client.patch(url, {'title': 'Lost update'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(url, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.title, self.book.version), ('Renamed', 2))
+
+        # An unchanged body writes nothing
+        response = self.client.patch(url, {'title': 'Renamed'}, HTTP_IF_MATCH='"2"')
+        self.assertEqual(response['ETag'], '"2"')
+
+    def test_concurrent_return_is_rejected(self):
+        loan = Loan.objects.create(user=self.user, book=self.book, due_date=date.today() + timedelta(days=7))
+        Book.objects.filter(pk=self.book.pk).update(availability=False)
+        self.authenticate(self.user)
+        url = reverse('api:loan-return-book', args=[loan.pk])
+        self.assertEqual(self.client.post(url, HTTP_IF_MATCH='"2"').status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        # The other request returns the loan between this one's read and write
+        stale = Loan.objects.get(pk=loan.pk)
+        with mock.patch.object(LoanViewSet, 'get_object', return_value=stale):
+            self.assertEqual(self.client.post(url).status_code, status.HTTP_200_OK)
+            stale.is_returned, stale.version = False, 1
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('already been returned', str(response.data))
+        self.assertEqual(sum(LibraryStat.objects.values_list('returned_loans', flat=True)), 1)
+
+    def test_set_based_writes_bump_versions(self):
+        bulk.apply('mark_unavailable', Book.objects.filter(pk=self.book.pk))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.version, 2)
+
+
+@override_settings(CHANGE_FEED_LAG=0)
+class ChangeFeedTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        cls.user = User.objects.create_user(username='reader', password='testpassword')
+        cls.books = Book.objects.bulk_create([
+            Book(title=f'Fed Book {i}', author='Author', isbn=make_isbn13(f'97800000006{i:01d}'), page_count=100)
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.admin).access_token))
+
+    def changes(self, since='', **params):
+        response = self.client.get(reverse('api:changes'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_feed_reports_only_what_changed_since_the_token(self):
+        page = self.changes()
+        self.assertEqual([book['id'] for book in page['books']['changed']], [book.id for book in self.books])
+        self.assertFalse(page['has_more'])
+
+        self.client.patch(reverse('api:book-detail', args=[self.books[1].id]), {'title': 'Renamed'})
+        response = self.client.delete(reverse('api:book-detail', args=[self.books[2].id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        loan = Loan.objects.create(user=self.user, book=self.books[0], due_date=date.today() + timedelta(days=7))
+
+        changed = self.changes(page['next'])
+        self.assertEqual([book['title'] for book in changed['books']['changed']], ['Renamed'])
+        self.assertEqual(changed['books']['deleted'], [self.books[2].id])
+        self.assertEqual([row['id'] for row in changed['loans']['changed']], [loan.id])
+
+        page = self.changes(changed['next'])
+        self.assertEqual((page['books'], page['loans']), ({'changed': [], 'deleted': []},) * 2)
+        cursors, previous = changes.parse_token(page['next']), changes.parse_token(changed['next'])
+        self.assertEqual([cursors[name][:2] for name in changes.FEEDS], [previous[name][:2] for name in changes.FEEDS])
+
+    def test_tokens_of_an_unchanged_catalog_do_not_expire(self):
+        token = self.changes()['next']
+        now = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(days=20)):
+            page = self.changes(token)
+            self.assertEqual(page['books'], {'changed': [], 'deleted': []})
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(days=40)):
+            self.changes(page['next'])
+            response = self.client.get(reverse('api:changes'), {'since': token})
+            self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_pages_split_rows_with_the_same_timestamp(self):
+        token = self.changes()['next']
+        bulk.apply('mark_unavailable', Book.objects.all())  # one UPDATE, one updated_at
+        seen = []
+        while True:
+            page = self.changes(token, limit=2, models='books')
+            seen += [book['id'] for book in page['books']['changed']]
+            token = page['next']
+            if not page['has_more']:
+                break
+        self.assertEqual(seen, [book.id for book in self.books])
+
+    def test_deleted_books_are_tombstones(self):
+        book = self.books[0]
+        Hold.objects.create(user=self.user, book=book)
+        self.client.delete(reverse('api:book-detail', args=[book.id]))
+        self.assertEqual(self.client.get(reverse('api:book-detail', args=[book.id])).status_code, 404)
+        self.assertTrue(Book.all_objects.get(pk=book.id).deleted_at)
+        self.assertEqual(Hold.objects.get().status, Hold.CANCELLED)
+
+        data = {'title': 'Again', 'author': 'Author', 'isbn': book.isbn, 'page_count': 10}
+        self.assertEqual(self.client.post(reverse('api:book-list'), data).status_code, status.HTTP_201_CREATED)
+
+        Book.all_objects.filter(pk=book.id).update(deleted_at=timezone.now() - timedelta(days=31))
+        changes.purge_tombstones()
+        self.assertFalse(Book.all_objects.filter(pk=book.id).exists())
+
+    def test_purge_keeps_deleted_books_that_loans_refer_to(self):
+        book = self.books[0]
+        loan = Loan.objects.create(user=self.user, book=book, due_date=date.today(), is_returned=True)
+        changes.delete_books(Book.objects.filter(pk=book.pk))
+        Book.all_objects.filter(pk=book.id).update(deleted_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(changes.purge_tombstones(), 0)
+        self.assertTrue(Loan.objects.filter(pk=loan.pk).exists())
+
+        # Once the loan's own tombstone is purged, the book goes too
+        Loan.all_objects.filter(pk=loan.pk).update(deleted_at=timezone.now() - timedelta(days=31))
+        changes.purge_tombstones()
+        self.assertFalse(Book.all_objects.filter(pk=book.id).exists())
+
+    def test_book_on_loan_cannot_be_deleted(self):
+        Loan.objects.create(user=self.user, book=self.books[0], due_date=date.today() + timedelta(days=7))
+        response = self.client.delete(reverse('api:book-detail', args=[self.books[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'This book is out on loan; delete it once it has been returned.')
+
+        with self.assertRaises(changes.OnLoanError):
+            BookAdmin(Book, admin.site).delete_queryset(None, Book.objects.all())
+        self.assertEqual(Book.objects.count(), 5)
+
+        request = RequestFactory().get('/')
+        request.user = self.admin
+        protected = BookAdmin(Book, admin.site).get_deleted_objects([self.books[0]], request)[3]
+        self.assertEqual(protected, ['Active loan: reader - Fed Book 0'])
+
+    def test_loans_of_books_deleted_by_a_sync_can_be_returned(self):
+        loan = Loan.objects.create(user=self.user, book=self.books[0], due_date=date.today() + timedelta(days=7))
+        Hold.objects.create(user=self.admin, book=self.books[0])
+        changes.delete_books(Book.objects.filter(pk=self.books[0].pk), allow_loaned=True)
+        self.assertEqual(Hold.objects.get().status, Hold.CANCELLED)
+
+        response = self.client.post(reverse('api:loan-return-book', args=[loan.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(Loan.objects.get(pk=loan.id).is_returned)
+
+    def test_stale_delete_is_refused(self):
+        url = reverse('api:book-detail', args=[self.books[0].id])
+        response = self.client.delete(url, HTTP_IF_MATCH='"7"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"1"').status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_bad_tokens(self):
+        url = reverse('api:changes')
+        self.assertEqual(self.client.get(url, {'since': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'models': 'users'}).status_code, status.HTTP_400_BAD_REQUEST)
+        old = changes.format_token({'books': (1, 1, 1), 'loans': (0, 0, 0)})
+        self.assertEqual(self.client.get(url, {'since': old}).status_code, status.HTTP_410_GONE)
+        self.assertEqual(self.client.get(url, {'since': old, 'models': 'loans'}).status_code, status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """Answers the sync client's requests with canned change feed pages."""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.params = []
+
+    def post(self, url, json, timeout):
+        return FakeResponse(200, {'access': 'token'})
+
+    def get(self, url, params, headers, timeout):
+        self.params.append(params)
+        return self.pages.pop(0)
+
+
+class SyncClientTest(TestCase):
+    SOURCE = 'https://source.example.org/api/'
+
+    def book(self, id, title):
+        return {'id': id, 'title': title, 'author': 'Author', 'isbn': make_isbn13(f'97811111{id:04d}'),
+                'page_count': 10, 'availability': True, 'version': 3}
+
+    def page(self, changed=(), deleted=(), next='1.1.1.0.0.0', has_more=False):
+        return FakeResponse(200, {'books': {'changed': list(changed), 'deleted': list(deleted)},
+                                  'next': next, 'has_more': has_more, 'lag': 5})
+
+    def test_incremental_sync(self):
+        session = FakeSession([
+            self.page([self.book(1, 'One'), self.book(2, 'Two')], next='1.2.1.0.0.0', has_more=True),
+            self.page([self.book(3, 'Three')], next='2.3.2.0.0.0'),
+            self.page(next='2.3.3.0.0.0'),
+        ])
+        totals = sync.run(self.SOURCE, 'u', 'p', session=session, sleep=lambda seconds: None)
+        self.assertEqual(totals, {'pages': 3, 'changed': 3, 'deleted': 0})
+        self.assertEqual(session.params[1]['since'], '1.2.1.0.0.0')
+
+        session = FakeSession([self.page([self.book(1, 'One, revised')], deleted=[2], next='3.1.4.0.0.0')])
+        sync.run(self.SOURCE, 'u', 'p', session=session)
+        self.assertEqual(session.params[0]['since'], '2.3.3.0.0.0')
+        self.assertEqual(dict(Book.objects.values_list('id', 'title')), {1: 'One, revised', 3: 'Three'})
+        self.assertEqual(SyncState.objects.get().token, '3.1.4.0.0.0')
+
+    def test_full_sync_removes_books_missing_at_the_source(self):
+        Book.objects.create(id=9, title='Gone', author='Author', isbn='9780306406157', page_count=10)
+        Book.objects.create(id=5, title='Held back', author='Author', isbn='9780000000001', page_count=10)
+        # Book 5 changed at the source during the lag and only arrives after it
+        session = FakeSession([self.page([self.book(1, 'One')]), self.page([self.book(5, 'Five')], next='2.5.2.0.0.0')])
+        waits = []
+        sync.run(self.SOURCE, 'u', 'p', full=True, session=session, sleep=waits.append)
+        self.assertEqual(waits, [5])
+        self.assertEqual(session.params[1]['since'], '1.1.1.0.0.0')
+        self.assertEqual(list(Book.objects.order_by('id').values_list('id', flat=True)), [1, 5])
+
+        with self.assertRaises(sync.SyncError):
+            sync.run(self.SOURCE, 'u', 'p', session=FakeSession([FakeResponse(410)]))
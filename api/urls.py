@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BookViewSet, LoanViewSet, UserViewSet
+from .views import (
+    BookViewSet, LoanViewSet, UserViewSet, HoldViewSet, DashboardView, StatsView, ChangesView, book_events,
+)
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -12,9 +14,14 @@ router = DefaultRouter()
 router.register(r'books', BookViewSet, basename='book')
 router.register(r'loans', LoanViewSet, basename='loan')
 router.register(r'users', UserViewSet, basename='user')
+router.register(r'holds', HoldViewSet, basename='hold')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('events/', book_events, name='events'),
+    path('stats/', StatsView.as_view(), name='stats'),
+    path('changes/', ChangesView.as_view(), name='changes'),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
@@ -0,0 +1,93 @@
+"""
+Optimistic concurrency control for books and loans.
+
+``VersionedModel`` adds a ``version`` column. Every ``save()`` of an existing
+row becomes ``UPDATE ... SET ..., version = n + 1 WHERE id = %s AND version
+= n``, where ``n`` is the version the instance was read at. If another
+writer got there first, no row matches and ``StaleVersionError`` is raised,
+so a read-modify-write can no longer silently overwrite a concurrent change.
+Callers save with ``update_fields`` so only the columns they changed are
+written, inside ``transaction.atomic()`` so that a conflict does not break
+an enclosing transaction. Set-based writes (``QuerySet.update()``) must bump
+the version themselves with ``version=F('version') + 1``, and set
+``updated_at`` on ``TrackedModel``s.
+
+Over HTTP, detail responses carry the version as an ``ETag`` and writes
+honour ``If-Match``: a stale tag gets ``412 Precondition Failed`` instead of
+overwriting the newer row. ``If-Match`` is optional; without it the write is
+still conditional on the version read by the request itself.
+"""
+
+from contextlib import contextmanager
+
+from django.db import DatabaseError, models, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class StaleVersionError(DatabaseError):
+    """The row changed after this instance was read."""
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'This resource has been modified since you read it. Fetch it again and retry.'
+    default_code = 'precondition_failed'
+
+
+class VersionedModel(models.Model):
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs):
+        if self._state.adding:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs)
+        field = self._meta.get_field('version')
+        expected = self.version
+        values = [value for value in values if value[0] is not field] + [(field, None, expected + 1)]
+        updated = super()._do_update(
+            base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update, *args, **kwargs,
+        )
+        if updated:
+            self.version = expected + 1
+        elif base_qs.filter(pk=pk_val).exists():
+            raise StaleVersionError(
+                f'{self._meta.object_name} {pk_val} has changed since it was read at version {expected}.'
+            )
+        return updated
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def check_if_match(request, instance):
+    """Raise ``PreconditionFailed`` unless ``If-Match`` is absent, ``*`` or lists the current ETag."""
+    header = request.headers.get('If-Match')
+    if header is None or header.strip() == '*':
+        return
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    if etag(instance.version) not in tags:
+        raise PreconditionFailed()
+
+
+@contextmanager
+def conditional_write():
+    """Run versioned writes in their own transaction, answering 412 if one is stale."""
+    try:
+        with transaction.atomic():
+            yield
+    except StaleVersionError:
+        raise PreconditionFailed() from None
+
+
+def changed_fields(instance, data):
+    """Set ``data`` on ``instance``; returns the names of the fields whose value changed."""
+    changed = []
+    for name, value in data.items():
+        if getattr(instance, name) != value:
+            setattr(instance, name, value)
+            changed.append(name)
+    return changed
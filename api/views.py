@@ -1,15 +1,118 @@
-from rest_framework import viewsets, permissions, status, filters
+from rest_framework import viewsets, generics, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAdminUser, AllowAny
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
+from django.db.models import Case, Count, OuterRef, Subquery, When
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.log import log_response
+from django.views.decorators.http import require_safe
 from datetime import date
-from .models import User, Book, Loan
-from .serializers import UserSerializer, BookSerializer, LoanSerializer
+from .models import User, Book, BookRecommendation, Loan, Hold
+from .serializers import UserSerializer, BookSerializer, LoanSerializer, HoldSerializer
+from . import changes, circulation, events, loancache, pagecache, stats, versioning
+from . import isbn as isbns
+from .counts import count_queryset
+from .idempotency import idempotent
+from .pagination import BookPagination
 from django_filters.rest_framework import DjangoFilterBackend
 
-class UserViewSet(viewsets.ModelViewSet):
+
+class SparseFieldsViewMixin:
+    """
+    ``?fields=id,title`` on reads: only those fields are serialized, only their
+    columns are selected, and related tables are joined only when a requested
+    field needs them (e.g. ``book_title`` on loans). Unknown names are a 400.
+    """
+
+    def readable_fields(self):
+        """Map of readable serializer field names to their sources."""
+        if not hasattr(self, '_readable_fields'):
+            fields = self.get_serializer_class()().fields
+            self._readable_fields = {
+                name: field.source for name, field in fields.items() if not field.write_only
+            }
+        return self._readable_fields
+
+    def get_requested_fields(self):
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = None
+            request = self.request
+            param = request.query_params.get('fields') if request is not None else None
+            if param and request.method in permissions.SAFE_METHODS:
+                requested = [name.strip() for name in param.split(',') if name.strip()]
+                unknown = [name for name in requested if name not in self.readable_fields()]
+                if unknown:
+                    raise ValidationError({'fields': (
+                        f"Unknown field(s): {', '.join(unknown)}. "
+                        f"Available: {', '.join(self.readable_fields())}."
+                    )})
+                self._requested_fields = requested
+        return self._requested_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        requested = self.get_requested_fields()
+        readable = self.readable_fields()
+        model = queryset.model
+        only, related = {model._meta.pk.name}, set()
+        for name in readable if requested is None else requested:
+            path = readable[name].split('.')
+            try:
+                model._meta.get_field(path[0])
+            except FieldDoesNotExist:
+                continue  # computed value, no column of its own
+            only.add('__'.join(path))
+            if len(path) > 1:
+                related.add(path[0])
+                only.add(path[0])
+        if related:
+            queryset = queryset.select_related(*related)
+        if requested is not None:
+            queryset = queryset.only(*only)
+        return queryset
+
+
+class VersionedViewMixin:
+    """
+    ``ETag`` (the row version) on detail reads and updates, and ``If-Match``
+    on updates and deletes, for models built on ``api.versioning``. Deletes
+    leave a tombstone for the change feed (``TrackedModel.soft_delete``).
+    """
+
+    def with_etag(self, response):
+        if 'version' in response.data:
+            response['ETag'] = versioning.etag(response.data['version'])
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.with_etag(super().retrieve(request, *args, **kwargs))
+
+    def update(self, request, *args, **kwargs):
+        return self.with_etag(super().update(request, *args, **kwargs))
+
+    def perform_update(self, serializer):
+        versioning.check_if_match(self.request, serializer.instance)
+        with versioning.conditional_write():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        versioning.check_if_match(self.request, instance)
+        with versioning.conditional_write():
+            instance.soft_delete()
+
+
+class UserViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('id')
     serializer_class = UserSerializer
 
@@ -22,9 +125,14 @@ class UserViewSet(viewsets.ModelViewSet):
             self.permission_classes = [permissions.IsAuthenticated]
         return super().get_permissions()
 
-class BookViewSet(viewsets.ModelViewSet):
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+class BookViewSet(SparseFieldsViewMixin, VersionedViewMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all().order_by('id')
     serializer_class = BookSerializer
+    pagination_class = BookPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['availability']
@@ -35,20 +143,86 @@ class BookViewSet(viewsets.ModelViewSet):
             self.permission_classes = [IsAdminUser]
         return super().get_permissions()
 
-class LoanViewSet(viewsets.ModelViewSet):
+    def create(self, request, *args, **kwargs):
+        """A JSON list creates up to ``BOOK_BULK_MAX_ROWS`` books at once; nothing is saved if any row is invalid."""
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data, many=True, max_length=settings.BOOK_BULK_MAX_ROWS)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        versioning.check_if_match(self.request, instance)
+        try:
+            # Matching the version read keeps the delete conditional, as saves are
+            deleted = changes.delete_books(Book.objects.filter(pk=instance.pk, version=instance.version))
+        except changes.OnLoanError as exc:
+            raise ValidationError({"detail": str(exc)})
+        if not deleted:
+            raise versioning.PreconditionFailed()
+
+    def list(self, request, *args, **kwargs):
+        # The list is the same for every user, so pages are cached per URL
+        pagecache.log_query(request)
+        data = pagecache.get_book_list(request)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            pagecache.set_book_list(request, data)
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path=r'isbn/(?P<isbn>[0-9Xx -]+)')
+    def by_isbn(self, request, isbn=None):
+        """Look a book up by ISBN-10 or ISBN-13, hyphens allowed."""
+        try:
+            normalized = isbns.normalize(isbn)
+        except ValueError as exc:
+            raise ValidationError({'isbn': str(exc)})
+        book = self.filter_queryset(self.get_queryset()).filter(isbn=normalized).first()
+        if book is None:
+            raise NotFound(f"Book with ISBN {normalized} does not exist.")
+        return Response(self.get_serializer(book).data)
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """Books often borrowed by this book's readers, precomputed by ``build_recommendations``."""
+        book = self.get_object()
+        recommendations = list(
+            BookRecommendation.objects.filter(book=book, recommended__deleted_at__isnull=True)
+            .select_related('recommended')
+            .order_by('rank')
+        )
+        books = self.get_serializer([r.recommended for r in recommendations], many=True).data
+        for book, recommendation in zip(books, recommendations):
+            book['score'] = recommendation.score
+        return Response(books)
+
+class LoanViewSet(SparseFieldsViewMixin, VersionedViewMixin, viewsets.ModelViewSet):
     queryset = Loan.objects.all().order_by('id')
     serializer_class = LoanSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Loan.objects.none()
         user = self.request.user
         if user.is_staff:
+            if self.action == 'list':
+                return Loan.objects.filter(archived=False)
             return Loan.objects.all()
         return Loan.objects.filter(user=user, is_returned=False)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        # A borrower's own loans come from the write-through cache
+        if request.user.is_staff or set(request.query_params) - {'page', 'page_size', 'count'}:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(loancache.active_loans(request.user.pk))
+        return self.get_paginated_response(page)
+
+    @idempotent
     def create(self, request, *args, **kwargs):
         book_id = request.data.get('book')
         if not book_id:
@@ -66,16 +240,24 @@ class LoanViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Use transaction to ensure atomicity
-        with transaction.atomic():
-            book.availability = False
-            book.save()
-            serializer.save(user=request.user)
+        # Use transaction to ensure atomicity. The save only succeeds if the
+        # book is unchanged since it was read, so two concurrent borrows
+        # cannot both take it.
+        try:
+            with transaction.atomic():
+                book.availability = False
+                book.save(update_fields=['availability'])
+                loan = serializer.save(user=request.user)
+                stats.record_borrow(loan)
+                events.publish_availability_on_commit(book)
+        except versioning.StaleVersionError:
+            raise ValidationError({"book": "This book was changed by another request; please try again."})
         
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def return_book(self, request, pk=None):
         loan = self.get_object()  # Raises NotFound if loan doesn't exist
         
@@ -86,14 +268,212 @@ class LoanViewSet(viewsets.ModelViewSet):
         # Check if already returned
         if loan.is_returned:
             raise ValidationError({"detail": "This loan has already been returned."})
+        versioning.check_if_match(request, loan)
         
-        # Use transaction to ensure atomicity
-        with transaction.atomic():
-            loan.book.availability = True
-            loan.book.save()
-            loan.return_date = date.today()
-            loan.is_returned = True
-            loan.save()
+        # Use transaction to ensure atomicity. The book row is locked so a
+        # hold placed concurrently is either handed the book or sees it available.
+        try:
+            with transaction.atomic():
+                book = Book.all_objects.select_for_update().get(pk=loan.book_id)
+                loan.return_date = date.today()
+                loan.is_returned = True
+                loan.save(update_fields=['return_date', 'is_returned'])
+                stats.record_return(loan)
+                # Hand the book straight to the oldest waiting hold, if any
+                circulation.release(book)
+        except versioning.StaleVersionError:
+            # Usually a concurrent return of the same loan
+            loan.refresh_from_db(fields=['is_returned', 'return_date', 'version'])
+            if loan.is_returned:
+                raise ValidationError({"detail": "This loan has already been returned."})
+            raise versioning.PreconditionFailed()
         
         return Response(status=status.HTTP_200_OK, data={"message": "Book returned successfully."})
 
+
+
+class HoldViewSet(viewsets.ModelViewSet):
+    """
+    Place, list and cancel holds on books that are out on loan.
+
+    Each waiting hold reports its ``position`` in the book's queue; the
+    oldest one becomes a loan automatically when the book is returned.
+    """
+    serializer_class = HoldSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Hold.objects.none()
+        ahead = (
+            Hold.objects.filter(book=OuterRef('book'), status=Hold.WAITING, id__lte=OuterRef('id'))
+            .order_by()
+            .values('book')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        queryset = Hold.objects.select_related('book').annotate(
+            position=Case(When(status=Hold.WAITING, then=Subquery(ahead)), default=None)
+        ).order_by('id')
+        user = self.request.user
+        if user.is_staff:
+            return queryset
+        return queryset.filter(user=user, status=Hold.WAITING)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            # Same lock as return_book, so the book cannot become available
+            # between this check and the hold being queued.
+            book = Book.objects.select_for_update().get(pk=serializer.validated_data['book'].pk)
+            if book.availability:
+                raise ValidationError({"book": "This book is available; borrow it instead."})
+            if Loan.objects.filter(user=request.user, book=book, is_returned=False).exists():
+                raise ValidationError({"book": "You already have this book on loan."})
+            if Hold.objects.filter(user=request.user, book=book, status=Hold.WAITING).exists():
+                raise ValidationError({"book": "You already have a hold on this book."})
+            hold = serializer.save(user=request.user)
+
+        hold.position = hold.queue_position()
+        headers = self.get_success_headers(serializer.data)
+        return Response(self.get_serializer(hold).data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def destroy(self, request, *args, **kwargs):
+        hold = self.get_object()
+        if hold.status != Hold.WAITING:
+            raise ValidationError({"detail": "Only waiting holds can be cancelled."})
+        hold.status = Hold.CANCELLED
+        hold.save(update_fields=['status'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DashboardView(generics.GenericAPIView):
+    """
+    Active loans, a page of books and catalog counters in one response.
+
+    Replaces the SPA's separate loans and books requests after login and
+    after every borrow/return. The book page accepts the same ``page``,
+    ``search`` and ``availability`` parameters as ``/api/books/``.
+    """
+    queryset = Book.objects.all().order_by('id')
+    serializer_class = BookSerializer
+    pagination_class = BookPagination
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = BookViewSet.filter_backends
+    filterset_fields = BookViewSet.filterset_fields
+    search_fields = BookViewSet.search_fields
+
+    def get(self, request, *args, **kwargs):
+        loans_data = loancache.active_loans(request.user.pk)
+
+        books = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(books)
+        books_data = self.get_paginated_response(self.get_serializer(page, many=True).data).data
+
+        # Counted like list pages (api.counts), reusing the page's count when
+        # it is of the whole catalog
+        catalog = self.get_queryset()
+        if self.paginator.include_count and books.query.where == catalog.query.where:
+            total_books = books_data['count']
+        else:
+            total_books, _ = count_queryset(catalog)
+        available_books, _ = count_queryset(catalog.filter(availability=True))
+        counters = {
+            'total_books': total_books,
+            'available_books': available_books,
+            'active_loans': len(loans_data),
+        }
+
+        return Response({'loans': loans_data, 'books': books_data, 'counters': counters})
+
+
+@require_safe
+def book_events(request):
+    """
+    Server-sent events stream of book availability changes.
+
+    Public, like the book list. Sends ``availability`` events
+    (``{"book": id, "availability": bool}``) and ``resync`` when the client
+    fell too far behind and should reload the list. Under WSGI it only
+    streams with ``EVENTS_STREAMING`` on; see ``api.events``.
+    """
+    is_asgi = isinstance(request, ASGIRequest)
+    if not is_asgi and not settings.EVENTS_STREAMING:
+        # A sync worker would be held for the whole stream; the page polls instead
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+    try:
+        subscription = events.broker.subscribe(settings.EVENTS_MAX_PENDING, settings.EVENTS_MAX_SUBSCRIBERS)
+    except events.BrokerFull:
+        response = HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '60'})
+        # Expected under load and handled by the page; not a server error
+        log_response('Too many event streams: %s', request.path, response=response, request=request, level='info')
+        return response
+    source = events.AsyncStream if is_asgi else events.Stream
+    response = StreamingHttpResponse(
+        source(subscription, settings.EVENTS_HEARTBEAT, settings.EVENTS_MAX_DURATION),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class StatsView(APIView):
+    """
+    Loan statistics for staff, read from the rollup tables in ``api.stats``.
+
+    ``?limit=`` (default 10, max 100) sizes each top list and ``?days=``
+    (default ``STATS_RECENT_DAYS``, max 365) the "most borrowed lately" window.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        limit = self.int_param('limit', 10, 100)
+        days = self.int_param('days', settings.STATS_RECENT_DAYS, 365)
+        return Response(stats.summary(limit=limit, days=days))
+
+    def int_param(self, name, default, maximum):
+        value = self.request.query_params.get(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: "A whole number is required."})
+        if not 1 <= value <= maximum:
+            raise ValidationError({name: f"Must be between 1 and {maximum}."})
+        return value
+
+
+class ChangesView(APIView):
+    """
+    Books and loans created, updated or deleted since ``?since=<token>``, for
+    mirrors that sync incrementally (see ``api.changes``).
+
+    Pass the previous response's ``next`` as ``since`` and keep going while
+    ``has_more`` is true. ``?limit=`` (default ``CHANGE_FEED_PAGE_SIZE``) caps
+    the rows of each kind per page, and ``?models=books`` skips the loans.
+    ``lag`` is how many seconds of recent changes are held back. A token
+    whose watermark is older than ``CHANGE_TOMBSTONE_DAYS`` gets 410: start
+    again without one.
+    """
+    permission_classes = [IsAdminUser]
+    int_param = StatsView.int_param
+
+    def get(self, request, *args, **kwargs):
+        try:
+            cursors = changes.parse_token(request.query_params.get('since', ''))
+        except changes.TokenError as exc:
+            raise ValidationError({'since': str(exc)})
+        names = request.query_params.get('models', ','.join(changes.FEEDS)).split(',')
+        unknown = [name for name in names if name not in changes.FEEDS]
+        if unknown:
+            raise ValidationError({'models': f"Unknown: {', '.join(unknown)}. Available: {', '.join(changes.FEEDS)}."})
+        if changes.is_expired(cursors, names):
+            return Response(
+                {'detail': 'This token is too old; sync again from the start, without since.'},
+                status=status.HTTP_410_GONE,
+            )
+        limit = self.int_param('limit', settings.CHANGE_FEED_PAGE_SIZE, settings.CHANGE_FEED_MAX_PAGE_SIZE)
+        return Response(changes.page(cursors, names, limit))
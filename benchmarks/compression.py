@@ -0,0 +1,126 @@
+"""
+Bandwidth/latency trade-off of response compression for the book list.
+
+    python -m benchmarks.compression
+    python -m benchmarks.compression --page-sizes 10 100 1000 --bandwidth 5 50 500
+
+For each page size the book list JSON is rendered exactly as the API does
+(from the configured database, so load data first with ``seed_synthetic``),
+then compressed with every encoding ``library.middleware`` can use here.
+The report gives the compressed size, the median compress and decompress
+times, and the estimated time to deliver the page at each bandwidth
+(compress + transfer + decompress), next to sending it uncompressed.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+import zlib
+
+import django
+
+from benchmarks.loadtest import git_commit
+
+
+def decompressors():
+    from library.middleware import brotli, zstandard
+
+    funcs = {'gzip': lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS)}
+    if brotli is not None:
+        funcs['br'] = brotli.decompress
+    if zstandard is not None:
+        funcs['zstd'] = lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return funcs
+
+
+def render_page(page_size):
+    from rest_framework.renderers import JSONRenderer
+
+    from api.models import Book
+    from api.serializers import BookSerializer
+
+    books = Book.objects.order_by('id')[:page_size]
+    data = {'count': Book.objects.count(), 'next': None, 'previous': None,
+            'results': BookSerializer(books, many=True).data}
+    return JSONRenderer().render(data)
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def measure(body, bandwidths, repeat):
+    from library.middleware import available_encoders
+
+    to_ms = lambda seconds: round(seconds * 1000, 3)
+    transfer = lambda size, mbit: size * 8 / (mbit * 1_000_000)
+    rows = {'identity': {
+        'bytes': len(body),
+        'ratio': 1.0,
+        'compress_ms': 0.0,
+        'decompress_ms': 0.0,
+        'delivery_ms': {str(mbit): to_ms(transfer(len(body), mbit)) for mbit in bandwidths},
+    }}
+    unpack = decompressors()
+    for coding, encoder in available_encoders().items():
+        def compress():
+            compressor = encoder()
+            return compressor.compress(body) + compressor.finish()
+
+        compressed, compress_s = timed(compress, repeat)
+        _, decompress_s = timed(lambda: unpack[coding](compressed), repeat)
+        rows[coding] = {
+            'bytes': len(compressed),
+            'ratio': round(len(body) / len(compressed), 2),
+            'compress_ms': to_ms(compress_s),
+            'decompress_ms': to_ms(decompress_s),
+            'delivery_ms': {
+                str(mbit): to_ms(compress_s + transfer(len(compressed), mbit) + decompress_s)
+                for mbit in bandwidths
+            },
+        }
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure compression of book list pages.')
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[10, 50, 100, 500, 1000])
+    parser.add_argument('--bandwidth', type=float, nargs='+', default=[5, 50, 500],
+                        help='Link speeds in Mbit/s for the delivery estimate.')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='Write the JSON report to this file.')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library.settings')
+    django.setup()
+
+    report = {'commit': git_commit(), 'bandwidth_mbit': args.bandwidth, 'page_sizes': {}}
+    for page_size in args.page_sizes:
+        body = render_page(page_size)
+        report['page_sizes'][str(page_size)] = measure(body, args.bandwidth, args.repeat)
+
+    header = f"{'page':>5} {'coding':<8} {'bytes':>9} {'ratio':>6} {'comp ms':>8} {'dec ms':>7}"
+    header += ''.join(f" {f'@{mbit:g}Mb ms':>10}" for mbit in args.bandwidth)
+    print(header)
+    for page_size, rows in report['page_sizes'].items():
+        for coding, row in rows.items():
+            line = (f"{page_size:>5} {coding:<8} {row['bytes']:>9} {row['ratio']:>6} "
+                    f"{row['compress_ms']:>8} {row['decompress_ms']:>7}")
+            line += ''.join(f" {row['delivery_ms'][str(mbit)]:>10}" for mbit in args.bandwidth)
+            print(line)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(report, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
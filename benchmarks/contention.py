@@ -0,0 +1,119 @@
+"""
+Lost updates and throughput of concurrent read-modify-write on one book.
+
+    python -m benchmarks.contention
+    python -m benchmarks.contention --writers 8 --increments 500 --think 2
+
+Runs against the configured database (migrate it first). ``--writers``
+processes each add 1 to the same book's ``page_count`` ``--increments``
+times, reading the row, waiting ``--think`` milliseconds (a request doing
+other work) and writing it back, in two modes:
+
+``blind``
+    The old behaviour: every column is written back unconditionally, as a
+    plain ``save()`` did, so concurrent increments overwrite each other.
+``versioned``
+    ``save(update_fields=['page_count'])`` through ``api.versioning``; a
+    write based on a stale read raises ``StaleVersionError`` and is retried
+    from a fresh read.
+
+The report gives lost updates (expected minus final count), conflicts
+(retries) and committed increments per second. The benchmark deletes the
+book it creates.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import django
+
+from benchmarks.loadtest import git_commit
+
+ISBN_PREFIX = '979999999999'
+
+
+def write(mode, book_id, increments, think):
+    from django.db import connection, transaction
+
+    from api.models import Book
+    from api.versioning import StaleVersionError
+
+    connection.close()  # never share the parent's connection after fork
+    fields = [field for field in Book._meta.concrete_fields if not field.primary_key]
+    conflicts = 0
+    for _ in range(increments):
+        while True:
+            book = Book.objects.get(pk=book_id)
+            book.page_count += 1
+            time.sleep(think)
+            if mode == 'blind':
+                Book.objects.filter(pk=book_id).update(**{field.attname: getattr(book, field.attname) for field in fields})
+                break
+            try:
+                with transaction.atomic():
+                    book.save(update_fields=['page_count'])
+                break
+            except StaleVersionError:
+                conflicts += 1
+    return conflicts
+
+
+def measure(mode, writers, increments, think):
+    from api.isbn import make_isbn13
+    from api.models import Book
+
+    book = Book.objects.create(
+        title='Contention benchmark', author='Benchmark', isbn=make_isbn13(ISBN_PREFIX), page_count=0,
+    )
+    try:
+        started = time.perf_counter()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(writers) as pool:
+            conflicts = sum(pool.starmap(write, [(mode, book.pk, increments, think)] * writers))
+        elapsed = time.perf_counter() - started
+        book.refresh_from_db()
+    finally:
+        Book.objects.filter(pk=book.pk).delete()
+    expected = writers * increments
+    return {
+        'expected': expected,
+        'final': book.page_count,
+        'lost_updates': expected - book.page_count,
+        'lost_rate': round((expected - book.page_count) / expected, 4),
+        'conflicts': conflicts,
+        'increments_per_s': round(book.page_count / elapsed),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure lost updates under concurrent writers.')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--increments', type=int, default=200, help='Increments per writer.')
+    parser.add_argument('--think', type=float, default=1.0, help='Milliseconds between read and write.')
+    parser.add_argument('--modes', nargs='+', choices=['blind', 'versioned'], default=['blind', 'versioned'])
+    parser.add_argument('--output', help='Write the JSON report to this file.')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library.settings')
+    django.setup()
+
+    report = {'commit': git_commit(), 'writers': args.writers, 'increments': args.increments,
+              'think_ms': args.think, 'modes': {}}
+    print(f"{'mode':>10} {'expected':>9} {'final':>7} {'lost':>6} {'lost %':>7} {'conflicts':>10} {'incr/s':>7}")
+    for mode in args.modes:
+        row = measure(mode, args.writers, args.increments, args.think / 1000)
+        report['modes'][mode] = row
+        print(f"{mode:>10} {row['expected']:>9} {row['final']:>7} {row['lost_updates']:>6} "
+              f"{row['lost_rate'] * 100:>6.1f}% {row['conflicts']:>10} {row['increments_per_s']:>7}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(report, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+HTTP load test for the library API.
+
+Run a scenario set against a server and write a JSON report:
+
+    python -m benchmarks.loadtest run --start-server --output benchmarks/results/HEAD.json
+    python -m benchmarks.loadtest run --base-url http://127.0.0.1:8000 --scenario browse search
+
+Compare two reports (for example from two commits):
+
+    python -m benchmarks.loadtest compare benchmarks/results/main.json benchmarks/results/HEAD.json
+
+Scenarios:
+    token         POST /api/token/ with benchmark user credentials
+    browse        GET /api/books/?page=<random page>
+    search        GET /api/books/?search=<term>
+    borrow_storm  POST /api/loans/ for random books from many users at once
+    return_storm  POST /api/loans/<id>/return_book/ for the loans created above
+
+Load data first with ``python manage.py seed_synthetic``; the defaults below
+log in as the users it creates.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta, datetime, timezone
+
+import requests
+
+SCENARIOS = ('token', 'browse', 'search', 'borrow_storm', 'return_storm')
+SEARCH_TERMS = ('River', 'Midnight Garden', 'Volume 3', 'Okafor', 'Grace Tanaka', 'zzz-no-match')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, statuses, errors, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    to_ms = lambda value: None if value is None else round(value * 1000, 2)
+    return {
+        'requests': total,
+        'errors': errors + sum(count for code, count in statuses.items() if int(code) >= 500),
+        'status_codes': dict(sorted(statuses.items())),
+        'duration_s': round(elapsed, 3),
+        'rps': round(total / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': to_ms(percentile(latencies, 50)),
+            'p95': to_ms(percentile(latencies, 95)),
+            'p99': to_ms(percentile(latencies, 99)),
+            'mean': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+class Context:
+    """Shared state for one benchmark run (base URL, tokens, pending loans)."""
+
+    def __init__(self, base_url, usernames, password):
+        self.base_url = base_url.rstrip('/')
+        self.usernames = usernames
+        self.password = password
+        self.tokens = []
+        self.book_pages = 1
+        self.book_ids = []
+        self.loans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def url(self, path):
+        return f'{self.base_url}{path}'
+
+
+def prepare(ctx):
+    """Fetch tokens and catalog shape once so scenarios measure only their own requests."""
+    session = requests.Session()
+    for username in ctx.usernames:
+        response = session.post(ctx.url('/api/token/'), json={'username': username, 'password': ctx.password})
+        if response.status_code == 200:
+            ctx.tokens.append(response.json()['access'])
+    if not ctx.tokens:
+        raise SystemExit('Could not obtain any token; load data with `python manage.py seed_synthetic` first.')
+    first_page = session.get(ctx.url('/api/books/')).json()
+    page_size = max(1, len(first_page.get('results', [])))
+    ctx.book_pages = max(1, -(-first_page.get('count', 0) // page_size))
+    available = session.get(ctx.url('/api/books/'), params={'availability': 'true'}).json()
+    ctx.book_ids = [book['id'] for book in available.get('results', [])]
+    # Sample more available books from random pages for the borrow storm.
+    for page in random.Random(0).sample(range(1, ctx.book_pages + 1), min(ctx.book_pages, 20)):
+        data = session.get(ctx.url('/api/books/'), params={'page': page}).json()
+        ctx.book_ids.extend(book['id'] for book in data.get('results', []) if book['availability'])
+
+
+def scenario_token(ctx, rng):
+    username = rng.choice(ctx.usernames)
+    return ctx.session.post(ctx.url('/api/token/'), json={'username': username, 'password': ctx.password})
+
+
+def scenario_browse(ctx, rng):
+    return ctx.session.get(ctx.url('/api/books/'), params={'page': rng.randint(1, ctx.book_pages)})
+
+
+def scenario_search(ctx, rng):
+    return ctx.session.get(ctx.url('/api/books/'), params={'search': rng.choice(SEARCH_TERMS)})
+
+
+def scenario_borrow_storm(ctx, rng):
+    token = rng.choice(ctx.tokens)
+    due_date = (date.today() + timedelta(days=14)).isoformat()
+    response = ctx.session.post(
+        ctx.url('/api/loans/'),
+        json={'book': rng.choice(ctx.book_ids), 'due_date': due_date},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    if response.status_code == 201:
+        with ctx.lock:
+            ctx.loans.append((token, response.json()['id']))
+    return response
+
+
+def scenario_return_storm(ctx, rng):
+    with ctx.lock:
+        if not ctx.loans:
+            return None
+        token, loan_id = ctx.loans.pop()
+    return ctx.session.post(
+        ctx.url(f'/api/loans/{loan_id}/return_book/'),
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+
+def run_scenario(ctx, func, requests_count, concurrency, seed):
+    latencies = []
+    statuses = {}
+    errors = 0
+    record_lock = threading.Lock()
+
+    def one(index):
+        nonlocal errors
+        rng = random.Random(seed * 1_000_003 + index)
+        started = time.perf_counter()
+        try:
+            response = func(ctx, rng)
+        except requests.RequestException:
+            with record_lock:
+                errors += 1
+            return
+        if response is None:
+            return
+        elapsed = time.perf_counter() - started
+        with record_lock:
+            latencies.append(elapsed)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_count)))
+    return summarize(latencies, statuses, errors, time.perf_counter() - started)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(port, workers):
+    # Production-like settings; a fixed SECRET_KEY so every worker accepts the
+    # same JWTs (the development default is generated per process).
+    env = dict(os.environ)
+    env.setdefault('DEBUG', 'False')
+    env.setdefault('ALLOWED_HOSTS', '127.0.0.1,localhost')
+    env.setdefault('SECRET_KEY', 'benchmark-only-secret-key')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'library.wsgi', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers)],
+        cwd=ROOT, env=env,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'{base_url}/api/books/', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn did not start within 30s')
+
+
+def run(args):
+    server = None
+    base_url = args.base_url
+    if args.start_server:
+        server, base_url = start_server(args.port, args.workers)
+    try:
+        usernames = [f'{args.user_prefix}{i}' for i in range(args.users)]
+        ctx = Context(base_url, usernames, args.password)
+        prepare(ctx)
+        scenarios = args.scenario or SCENARIOS
+        report = {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'base_url': base_url,
+            'concurrency': args.concurrency,
+            'requests_per_scenario': args.requests,
+            'workers': args.workers if args.start_server else None,
+            'scenarios': {},
+        }
+        for name in scenarios:
+            func = globals()[f'scenario_{name}']
+            report['scenarios'][name] = run_scenario(ctx, func, args.requests, args.concurrency, args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    print(output)
+
+
+def compare(args):
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.candidate) as fh:
+        candidate = json.load(fh)
+    print(f"{'scenario':<14} {'metric':<6} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for name, new in candidate['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        rows = [('rps', old['rps'], new['rps'])]
+        rows += [(key, old['latency_ms'][key], new['latency_ms'][key]) for key in ('p50', 'p95', 'p99')]
+        for metric, before, after in rows:
+            if before is None or after is None:
+                continue
+            change = f'{(after - before) / before * 100:+.1f}%' if before else 'n/a'
+            print(f'{name:<14} {metric:<6} {before:>10} {after:>10} {change:>8}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the library API.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help='Run scenarios and report latency/RPS as JSON.')
+    run_parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    run_parser.add_argument('--start-server', action='store_true', help='Start a local gunicorn for the run.')
+    run_parser.add_argument('--port', type=int, default=8765)
+    run_parser.add_argument('--workers', type=int, default=3)
+    run_parser.add_argument('--scenario', nargs='+', choices=SCENARIOS)
+    run_parser.add_argument('--requests', type=int, default=1000, help='Requests per scenario.')
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--users', type=int, default=50, help='Benchmark users to log in as.')
+    run_parser.add_argument('--user-prefix', default='reader')
+    run_parser.add_argument('--password', default='synthetic-password')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', help='Write the JSON report to this file.')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = sub.add_parser('compare', help='Compare two JSON reports.')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Measure Python import time for the WSGI application.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --top 25 --output benchmarks/results/startup.json
+
+Each run starts a fresh interpreter with ``python -X importtime``, imports
+``library.wsgi`` (which runs ``django.setup()``) and then loads the URLconf,
+as the first request would. The report gives the median wall time, the
+median total import time and the most expensive modules by cumulative time.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.loadtest import ROOT, git_commit
+
+SNIPPET = (
+    'import library.wsgi\n'
+    'from django.urls import get_resolver\n'
+    'get_resolver().url_patterns\n'
+)
+
+
+def parse_importtime(stderr):
+    """Return ``{module: (self_us, cumulative_us)}`` from ``-X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(env):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SNIPPET],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    wall = time.perf_counter() - started
+    return wall, parse_importtime(result.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure import time of library.wsgi.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='Modules to list by cumulative time.')
+    parser.add_argument('--output', help='Write the JSON report to this file.')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'library.settings')
+    measure(env)  # warm the filesystem and bytecode caches
+    walls, totals, runs = [], [], []
+    for _ in range(args.runs):
+        wall, modules = measure(env)
+        walls.append(wall)
+        totals.append(sum(self_us for self_us, _ in modules.values()))
+        runs.append(modules)
+
+    last = runs[-1]
+    slowest = sorted(last.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    report = {
+        'commit': git_commit(),
+        'runs': args.runs,
+        'wall_ms_median': round(statistics.median(walls) * 1000, 1),
+        'import_ms_median': round(statistics.median(totals) / 1000, 1),
+        'modules_imported': len(last),
+        'drf_yasg_imported': any(name.startswith('drf_yasg') for name in last),
+        'slowest_modules': [
+            {'module': name, 'self_ms': round(self_us / 1000, 2), 'cumulative_ms': round(cum_us / 1000, 2)}
+            for name, (self_us, cum_us) in slowest
+        ],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
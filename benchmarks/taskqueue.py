@@ -0,0 +1,129 @@
+"""
+Throughput of the database-backed task queue (api.tasks).
+
+    python -m benchmarks.taskqueue
+    python -m benchmarks.taskqueue --tasks 50000 --batch 1 50 500 --workers 4
+
+Runs against the configured database (migrate it first). For each batch
+size it queues ``--tasks`` no-op tasks, then drains them with ``--workers``
+worker processes, each claiming ``--batch`` tasks per round trip as
+``manage.py run_worker`` does. The report gives enqueue and drain rates in
+tasks per second, plus the rate of queuing tasks one per transaction, as a
+view would. The benchmark deletes only the tasks it created.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import django
+
+from benchmarks.loadtest import git_commit
+
+TASK_NAME = 'benchmarks.taskqueue.noop'
+
+
+def noop(**kwargs):
+    pass
+
+
+def register():
+    from api import tasks
+
+    tasks.REGISTRY[TASK_NAME] = noop
+
+
+def drain(worker, batch):
+    from django.db import connection
+
+    from api import tasks
+
+    connection.close()  # never share the parent's connection after fork
+    count = 0
+    while claimed := tasks.claim(worker, batch):
+        tasks.execute(claimed)
+        count += len(claimed)
+    return count
+
+
+def measure(total, batch, workers):
+    from django.db import transaction
+
+    from api import tasks
+    from api.models import Task
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        tasks.enqueue_many(TASK_NAME, ({'n': n} for n in range(total)))
+    enqueue_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if workers == 1:
+        drained = drain('bench-0', batch)
+    else:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers) as pool:
+            drained = sum(pool.starmap(drain, [(f'bench-{n}', batch) for n in range(workers)]))
+    drain_s = time.perf_counter() - started
+
+    failed = Task.objects.filter(name=TASK_NAME).exclude(status=Task.DONE).count()
+    Task.objects.filter(name=TASK_NAME).delete()
+    return {
+        'tasks': total,
+        'drained': drained,
+        'not_done': failed,
+        'enqueue_per_s': round(total / enqueue_s),
+        'drain_per_s': round(drained / drain_s) if drain_s else None,
+    }
+
+
+def measure_single_enqueue(total):
+    from django.db import transaction
+
+    from api import tasks
+    from api.models import Task
+
+    started = time.perf_counter()
+    for n in range(total):
+        with transaction.atomic():
+            tasks.enqueue(TASK_NAME, {'n': n})
+    elapsed = time.perf_counter() - started
+    Task.objects.filter(name=TASK_NAME).delete()
+    return round(total / elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure task queue throughput.')
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report to this file.')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library.settings')
+    django.setup()
+    register()
+
+    report = {
+        'commit': git_commit(),
+        'workers': args.workers,
+        'single_enqueue_per_s': measure_single_enqueue(min(args.tasks, 1000)),
+        'batches': {},
+    }
+    print(f"one task per transaction: {report['single_enqueue_per_s']} tasks/s")
+    print(f"{'batch':>6} {'tasks':>8} {'enqueue/s':>10} {'drain/s':>9} {'not done':>9}")
+    for batch in args.batch:
+        row = measure(args.tasks, batch, args.workers)
+        report['batches'][str(batch)] = row
+        print(f"{batch:>6} {row['tasks']:>8} {row['enqueue_per_s']:>10} {row['drain_per_s']:>9} {row['not_done']:>9}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(report, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Gunicorn settings, read automatically when gunicorn starts in this directory.
+
+With ``preload_app`` the Django application (settings, apps, models and the
+URLconf) is imported once in the master process before workers are forked,
+so workers start faster and share those pages copy-on-write. Set
+``GUNICORN_PRELOAD=False`` to import the app in each worker instead, e.g.
+to use ``--reload`` during development.
+
+With ``CACHE_WARM_ON_BOOT=True`` and a shared cache (``CACHE_SHARED``) each
+worker pre-renders the hottest book list pages (``api.pagecache.warm``),
+unless another is already doing so, before it accepts requests, so a deploy doesn't
+start with every worker running the same cold queries at once.
+"""
+
+# Not ``from decouple import config``: gunicorn reads every module-level
+# name here as a setting, and ``config`` is one of its own.
+import decouple
+
+# Several workers so one slow request doesn't stall the API. /api/events/
+# only streams from sync workers with EVENTS_STREAMING=True, which needs an
+# async worker class (e.g. gevent); see api/events.py.
+workers = decouple.config('WEB_CONCURRENCY', default=3, cast=int)
+worker_class = decouple.config('GUNICORN_WORKER_CLASS', default='sync')
+preload_app = decouple.config('GUNICORN_PRELOAD', default=True, cast=bool)
+cache_warm_on_boot = decouple.config('CACHE_WARM_ON_BOOT', default=False, cast=bool)
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before workers fork.
+    # Django loads the URLconf lazily on the first request; do it here so
+    # every worker inherits it instead of importing the views itself.
+    if preload_app:
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+
+
+def post_worker_init(worker):
+    if not cache_warm_on_boot:
+        return
+    from django.conf import settings
+
+    from api import pagecache
+    if not settings.CACHE_SHARED:
+        worker.log.info('Cache warm-up skipped: book list pages are only cached with a shared cache')
+        return
+    try:
+        report = pagecache.warm()
+    except Exception:
+        # A cold cache is slower, not broken; never keep the worker from serving
+        worker.log.exception('Cache warm-up failed')
+        return
+    if report is None:
+        worker.log.info('Cache warm-up skipped: another process holds the lock')
+    else:
+        worker.log.info('Warmed %(warmed)d of %(urls)d book list URLs in %(seconds).2fs', report)
@@ -0,0 +1,150 @@
+"""
+Non-blocking logging pipeline for production.
+
+Request threads only hand log records to an in-memory queue; a background
+``QueueListener`` thread does the formatting and the disk I/O. Records are
+written as one JSON object per line so they can be shipped and queried
+without regex parsing.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+
+# Attributes every LogRecord carries; anything else was passed via ``extra=``.
+_RESERVED_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as a single-line JSON object."""
+
+    def format(self, record):
+        payload = {
+            'timestamp': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(payload, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep roughly ``rate`` of the records at ``level`` and below.
+
+    Records above ``level`` (warnings and errors by default) always pass.
+    Sampling is deterministic (every Nth record) so it is cheap and the
+    surviving lines stay evenly spread over time.
+    """
+
+    def __init__(self, rate=1.0, level='INFO'):
+        super().__init__()
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+        rate = float(rate)
+        self.every = 0 if rate <= 0 else max(1, round(1 / min(rate, 1.0)))
+        self._counter = itertools.count(1)
+
+    def filter(self, record):
+        if record.levelno > self.level or self.every == 1:
+            return True
+        if self.every == 0:
+            return False
+        return next(self._counter) % self.every == 0
+
+
+class AsyncFileHandler(QueueHandler):
+    """
+    Queue records for a background thread that writes a rotating log file.
+
+    ``rotation`` is ``'size'`` (rotate at ``max_bytes``) or ``'time'``
+    (rotate on ``when``/``interval``). The formatter configured on this
+    handler is applied by the listener thread, not by the caller. When the
+    queue is full, records are dropped and counted rather than blocking
+    the request.
+    """
+
+    def __init__(self, filename, rotation='size', max_bytes=10 * 1024 * 1024,
+                 backup_count=5, when='midnight', interval=1, queue_size=10000,
+                 encoding='utf-8'):
+        if rotation == 'size':
+            target = RotatingFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count,
+                encoding=encoding, delay=True,
+            )
+        elif rotation == 'time':
+            target = TimedRotatingFileHandler(
+                filename, when=when, interval=interval, backupCount=backup_count,
+                encoding=encoding, delay=True, utc=True,
+            )
+        else:
+            raise ValueError(f"rotation must be 'size' or 'time', not {rotation!r}")
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.listener = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.close)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A forked child (e.g. a gunicorn worker with --preload) inherits the
+        # queue but not the listener thread; start over with fresh state.
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.listener = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Started on first use so processes that configure logging but never
+        # write to the file (DEBUG, tests) do not spawn a thread.
+        with self._start_lock:
+            if self.listener is None:
+                self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread.
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Merge args eagerly so later mutation of the arguments cannot change
+        # the message, but leave the expensive formatting to the listener.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.listener is None:
+            self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
@@ -0,0 +1,189 @@
+"""
+Negotiated response compression.
+
+Like Django's ``GZipMiddleware``, but picks the best encoding the client
+accepts among ``COMPRESSION_ENCODINGS``: brotli (``br``) and zstandard
+(``zstd``) when the ``brotli`` / ``zstandard`` packages are installed, and
+gzip always. Bodies under ``COMPRESSION_MIN_SIZE`` bytes are sent as-is,
+since compressing them costs more time than it saves on the wire.
+Streaming responses (including the event stream) are compressed chunk by
+chunk and flushed after each one, so nothing is held back.
+
+BREACH: like ``GZipMiddleware``, gzipped bodies get up to
+``MAX_RANDOM_BYTES`` random bytes in the gzip header
+(``compress_string(..., max_random_bytes=...)``), so their length no longer
+tracks guesses at a secret in the page. brotli and zstd have no such
+padding, so a response whose rendering used the CSRF token (the admin,
+login forms) is only ever gzipped.
+"""
+
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+MAX_RANDOM_BYTES = 100
+
+_token_re = re.compile(r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+class _Gzip:
+    def __init__(self):
+        self._obj = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self):
+        # Quality 4 is far cheaper than the default 11 and still beats gzip
+        self._obj = brotli.Compressor(quality=4)
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def available_encoders():
+    """Encoders that can run here, keyed by content coding."""
+    encoders = {'gzip': _Gzip}
+    if brotli is not None:
+        encoders['br'] = _Brotli
+    if zstandard is not None:
+        encoders['zstd'] = _Zstd
+    return encoders
+
+
+def parse_accept_encoding(header):
+    """Map each coding in an ``Accept-Encoding`` header to its q-value."""
+    accepted = {}
+    for token in header.split(','):
+        match = _token_re.match(token)
+        if not match:
+            continue
+        try:
+            quality = float(match[2]) if match[2] is not None else 1.0
+        except ValueError:
+            continue
+        accepted[match[1].lower()] = quality
+    return accepted
+
+
+def negotiate(header, preferred):
+    """
+    Pick the coding from ``preferred`` (best first) with the highest q-value
+    in ``header``; ties go to the earlier one. Returns None for identity.
+    """
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for coding in preferred:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_q:
+            best, best_q = coding, quality
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        encoders = available_encoders()
+        self.encoders = {
+            coding: encoders[coding]
+            for coding in settings.COMPRESSION_ENCODINGS
+            if coding in encoders
+        }
+        self.min_size = settings.COMPRESSION_MIN_SIZE
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoders = self.encoders
+        if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            # get_token() ran, so the body may hold the token: padded gzip only
+            encoders = {coding: encoder for coding, encoder in encoders.items() if coding == 'gzip'}
+        coding = negotiate(request.headers.get('Accept-Encoding', ''), encoders)
+        if coding is None:
+            return response
+        encoder = encoders[coding]
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._compress_async(encoder(), response.streaming_content)
+            else:
+                response.streaming_content = self._compress_stream(encoder(), response.streaming_content)
+            del response['Content-Length']
+        else:
+            if coding == 'gzip':
+                compressed = compress_string(response.content, max_random_bytes=MAX_RANDOM_BYTES)
+            else:
+                compressor = encoder()
+                compressed = compressor.compress(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The body's bytes changed, so a strong validator no longer applies
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = coding
+        return response
+
+    @staticmethod
+    def _compress_stream(compressor, chunks):
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush()
+        yield compressor.finish()
+
+    @staticmethod
+    async def _compress_async(compressor, chunks):
+        async for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush()
+        yield compressor.finish()
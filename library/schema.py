@@ -0,0 +1,123 @@
+"""
+Precomputed OpenAPI schema and Swagger UI for the API.
+
+Introspecting every viewset to build the schema takes hundreds of
+milliseconds, so it is done once: ``manage.py generate_schema`` writes it
+to ``OPENAPI_SCHEMA_PATH`` (the Docker build runs it). The file records a
+fingerprint of the modules that shape the API (``schema_sources()``); if it is missing or the
+fingerprint no longer matches, the schema is regenerated once per process
+and written back. Requests are then served from memory with an ETag and
+``Cache-Control`` so browsers and proxies can reuse it.
+
+drf_yasg is only imported when a schema actually has to be generated.
+"""
+
+import hashlib
+import json
+import threading
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+
+FINGERPRINT_KEY = 'x-source-fingerprint'
+
+_write_lock = threading.Lock()
+
+
+def openapi_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Library API",
+        default_version='v1',
+        description="Test description",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="contact@library.local"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+def schema_sources():
+    """
+    Files whose changes can change the generated schema, relative to
+    ``BASE_DIR``: the URLconf, this module and every module of the api
+    package, since views pull in pagination, versioning and the rest.
+    """
+    base = Path(settings.BASE_DIR)
+    api = sorted(path for path in (base / 'api').glob('*.py') if path.name != 'tests.py')
+    return ['library/urls.py', 'library/schema.py', *(path.relative_to(base).as_posix() for path in api)]
+
+
+def source_fingerprint():
+    """Hash of the API source files and the drf_yasg version."""
+    digest = hashlib.sha256(metadata.version('drf-yasg').encode())
+    for name in schema_sources():
+        digest.update(name.encode())
+        digest.update((Path(settings.BASE_DIR) / name).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def generate_schema(fmt='json'):
+    """Build the schema by introspecting the URLconf and return it encoded as bytes."""
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    schema = OpenAPISchemaGenerator(openapi_info()).get_schema(request=None, public=True)
+    schema[FINGERPRINT_KEY] = source_fingerprint()
+    codec = OpenAPICodecYaml if fmt == 'yaml' else OpenAPICodecJson
+    return codec(validators=[]).encode(schema)
+
+
+def read_fingerprint(body):
+    try:
+        return json.loads(body).get(FINGERPRINT_KEY)
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def load_schema(path):
+    """
+    Return ``(body, etag)`` for the JSON schema at ``path``.
+
+    Regenerates (and tries to write back) the file when it is missing or
+    stale. Cached for the life of the process.
+    """
+    path = Path(path)
+    body = path.read_bytes() if path.exists() else None
+    if body is None or read_fingerprint(body) != source_fingerprint():
+        body = generate_schema()
+        with _write_lock:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(body)
+            except OSError:
+                pass  # read-only deploys still serve the in-memory copy
+    return body, '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def _current_schema():
+    return load_schema(str(settings.OPENAPI_SCHEMA_PATH))
+
+
+@require_safe
+@cache_control(public=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+@condition(etag_func=lambda request: _current_schema()[1])
+def openapi_json(request):
+    body, _ = _current_schema()
+    return HttpResponse(body, content_type='application/json')
+
+
+@require_safe
+def swagger_ui(request):
+    # Old links used /swagger/?format=openapi for the raw schema.
+    if request.GET.get('format') == 'openapi':
+        return openapi_json(request)
+    return render(request, 'swagger.html', {'schema_url': reverse('schema-json')})
@@ -1,6 +1,7 @@
 from pathlib import Path
 from decouple import config
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,13 +38,23 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "api",
     "rest_framework",
-    "drf_yasg",
     "django_filters",
     "corsheaders",
 ]
 
+# Swagger UI at /swagger/ (drf_yasg). Off by default in production; drf_yasg
+# is imported lazily on the first request to the page either way.
+ENABLE_SWAGGER = config('ENABLE_SWAGGER', default=DEBUG, cast=bool)
+if ENABLE_SWAGGER:
+    INSTALLED_APPS.append("drf_yasg")
+
+# Precomputed OpenAPI schema served at /swagger.json (see `manage.py generate_schema`)
+OPENAPI_SCHEMA_PATH = config('OPENAPI_SCHEMA_PATH', default=str(BASE_DIR / 'openapi.json'))
+OPENAPI_SCHEMA_MAX_AGE = config('OPENAPI_SCHEMA_MAX_AGE', default=3600, cast=int)
+
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "library.middleware.CompressionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -134,10 +145,129 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardPagination',
     'PAGE_SIZE': 10
 }
 
+# Largest ?page_size= clients may request (api/pagination.py); the book
+# catalog has its own, higher limit.
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=100, cast=int)
+BOOK_MAX_PAGE_SIZE = config('BOOK_MAX_PAGE_SIZE', default=500, cast=int)
+
+# List counts (api/counts.py): tables estimated below COUNT_EXACT_THRESHOLD rows
+# are counted exactly; larger unfiltered PostgreSQL tables use the planner's
+# estimate, and exact counts of at least that many rows are cached.
+COUNT_EXACT_THRESHOLD = config('COUNT_EXACT_THRESHOLD', default=10000, cast=int)
+COUNT_CACHE_TTL = config('COUNT_CACHE_TTL', default=60, cast=int)
+
+# Response compression (library/middleware.py). Encodings in order of preference;
+# br and zstd are used only when the brotli / zstandard packages are installed.
+COMPRESSION_ENCODINGS = [
+    coding.strip() for coding in config('COMPRESSION_ENCODINGS', default='br,zstd,gzip').split(',') if coding.strip()
+]
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int)
+
+# Cache (cached pages, counts and other short-lived data). Defaults to a per-process
+# in-memory cache; point CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached
+# to share it between workers, e.g. django.core.cache.backends.redis.RedisCache
+# and redis://127.0.0.1:6379/1.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='library'),
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)},
+    }
+}
+
+# Whether every worker sees the same default cache. Caches that a write in
+# one worker must invalidate for all (a borrower's active loans, book list
+# pages) are only used when it does; a per-process cache would keep serving
+# them stale.
+CACHE_SHARED = config(
+    'CACHE_SHARED',
+    default=CACHES['default']['BACKEND'] not in (
+        'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache',
+    ),
+    cast=bool,
+)
+
+# How long a successful response is replayed for a repeated Idempotency-Key
+# (kept in the IdempotencyKey table, purged by run_worker)
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=24 * 60 * 60, cast=int)
+
+# Rows the library-wide loan counters are spread over (api/stats.py) so that
+# concurrent borrows and returns rarely contend for the same row
+LIBRARY_STAT_SHARDS = config('LIBRARY_STAT_SHARDS', default=8, cast=int)
+
+# Window of /api/stats/'s "most borrowed lately" that is kept as a rollup
+# (api.stats.roll_recent); other ?days= windows are summed from daily rows.
+STATS_RECENT_DAYS = config('STATS_RECENT_DAYS', default=30, cast=int)
+
+# How long a user's cached active loans (api/loancache.py) may live. Only used
+# with CACHE_SHARED; the list is rewritten after every borrow and return, so
+# this bounds staleness after a refresh loses a race with a concurrent one.
+ACTIVE_LOANS_CACHE_TTL = config('ACTIVE_LOANS_CACHE_TTL', default=15 * 60, cast=int)
+
+# Loan period, in days, for a loan created automatically from a hold on return
+HOLD_LOAN_DAYS = config('HOLD_LOAN_DAYS', default=14, cast=int)
+
+# Background task queue (api/tasks.py, processed by manage.py run_worker).
+# TASK_TIMEOUT: seconds after which a running task is assumed lost and re-queued.
+# TASK_RETENTION: seconds finished tasks are kept before the worker deletes them.
+TASK_BATCH_SIZE = config('TASK_BATCH_SIZE', default=100, cast=int)
+TASK_POLL_INTERVAL = config('TASK_POLL_INTERVAL', default=1.0, cast=float)
+TASK_RETRY_DELAY = config('TASK_RETRY_DELAY', default=10, cast=int)
+TASK_TIMEOUT = config('TASK_TIMEOUT', default=30 * 60, cast=int)
+TASK_RETENTION = config('TASK_RETENTION', default=24 * 60 * 60, cast=int)
+
+# Change feed at /api/changes/ (api/changes.py). Rows written in the last
+# CHANGE_FEED_LAG seconds are held back until their transaction has surely
+# committed. Deleted books and loans are kept as tombstones for
+# CHANGE_TOMBSTONE_DAYS, then purged by run_worker.
+CHANGE_FEED_LAG = config('CHANGE_FEED_LAG', default=5, cast=int)
+CHANGE_FEED_PAGE_SIZE = config('CHANGE_FEED_PAGE_SIZE', default=1000, cast=int)
+CHANGE_FEED_MAX_PAGE_SIZE = config('CHANGE_FEED_MAX_PAGE_SIZE', default=5000, cast=int)
+CHANGE_TOMBSTONE_DAYS = config('CHANGE_TOMBSTONE_DAYS', default=30, cast=int)
+
+# Mirroring another deployment's catalog (manage.py sync_catalog, api/sync.py).
+# SYNC_SOURCE_URL is the source's API root, e.g. https://library.example.org/api/,
+# and SYNC_USERNAME/SYNC_PASSWORD a staff account there.
+SYNC_SOURCE_URL = config('SYNC_SOURCE_URL', default='')
+SYNC_USERNAME = config('SYNC_USERNAME', default='')
+SYNC_PASSWORD = config('SYNC_PASSWORD', default='')
+
+# Cached /api/books/ pages (api/pagecache.py; only with CACHE_SHARED) and the warm-up that pre-renders
+# the first CACHE_WARM_PAGES pages and the CACHE_WARM_QUERIES most frequent
+# logged searches/filters. CACHE_WARM_HOST (default: first ALLOWED_HOSTS entry)
+# and CACHE_WARM_SECURE must match how clients reach the site, since pages
+# contain absolute next/previous links. CACHE_WARM_LOG_SAMPLE_RATE is the
+# fraction of list requests logged for the warm-up to learn from (0 disables).
+BOOK_LIST_CACHE_TTL = config('BOOK_LIST_CACHE_TTL', default=60, cast=int)
+CACHE_WARM_PAGES = config('CACHE_WARM_PAGES', default=5, cast=int)
+CACHE_WARM_QUERIES = config('CACHE_WARM_QUERIES', default=20, cast=int)
+CACHE_WARM_HOST = config('CACHE_WARM_HOST', default='')
+CACHE_WARM_SECURE = config('CACHE_WARM_SECURE', default=not DEBUG, cast=bool)
+CACHE_WARM_LOG_SAMPLE_RATE = config('CACHE_WARM_LOG_SAMPLE_RATE', default=0.01, cast=float)
+
+# POST /api/books/ with a JSON list creates up to this many books in one request
+BOOK_BULK_MAX_ROWS = config('BOOK_BULK_MAX_ROWS', default=5000, cast=int)
+
+# Admin bulk actions (api/bulk.py): larger selections run as a background task,
+# in transactions of BULK_ACTION_CHUNK_SIZE rows
+BULK_ACTION_THRESHOLD = config('BULK_ACTION_THRESHOLD', default=1000, cast=int)
+BULK_ACTION_CHUNK_SIZE = config('BULK_ACTION_CHUNK_SIZE', default=1000, cast=int)
+
+# Server-sent events at /api/events/ (see api/events.py)
+# Under ASGI the endpoint always streams. Under WSGI it streams only with
+# EVENTS_STREAMING=True, which needs async gunicorn workers (GUNICORN_WORKER_CLASS=gevent);
+# otherwise it answers 204 and the web UI goes without live updates. EVENTS_MAX_DURATION bounds how long one
+# stream stays open (clients reconnect); EVENTS_MAX_SUBSCRIBERS caps open streams per process.
+EVENTS_STREAMING = config('EVENTS_STREAMING', default=False, cast=bool)
+EVENTS_HEARTBEAT = config('EVENTS_HEARTBEAT', default=15, cast=int)
+EVENTS_MAX_DURATION = config('EVENTS_MAX_DURATION', default=300, cast=int)
+EVENTS_MAX_PENDING = config('EVENTS_MAX_PENDING', default=256, cast=int)
+EVENTS_MAX_SUBSCRIBERS = config('EVENTS_MAX_SUBSCRIBERS', default=100, cast=int)
+
 # CORS Configuration
 # In production, set CORS_ALLOWED_ORIGINS environment variable (comma-separated URLs)
 # Example: CORS_ALLOWED_ORIGINS=http://localhost:3000,https://yourdomain.com
@@ -150,6 +280,8 @@ else:
     CORS_ALLOW_ALL_ORIGINS = DEBUG
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 # Security Settings
 # SSL/HTTPS Configuration (only in production)
@@ -172,6 +304,17 @@ if not DEBUG:
     SECURE_CONTENT_SECURITY_POLICY = "default-src 'self'; script-src 'self' 'unsafe-inline'; style-src 'self' 'unsafe-inline';"
 
 # Logging Configuration
+# In production, records go through a queue to a background thread that writes
+# JSON lines to a rotating file, so request threads never block on disk I/O.
+# LOG_ROTATION: 'size' (LOG_MAX_BYTES) or 'time' (LOG_ROTATION_WHEN, e.g. 'midnight')
+# LOG_INFO_SAMPLE_RATE: fraction of INFO-and-below lines kept (warnings/errors always kept)
+LOG_ROTATION = config('LOG_ROTATION', default='size')
+LOG_MAX_BYTES = config('LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+LOG_BACKUP_COUNT = config('LOG_BACKUP_COUNT', default=5, cast=int)
+LOG_ROTATION_WHEN = config('LOG_ROTATION_WHEN', default='midnight')
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+LOG_INFO_SAMPLE_RATE = config('LOG_INFO_SAMPLE_RATE', default=1.0, cast=float)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -184,11 +327,19 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'library.log.JsonFormatter',
+        },
     },
     'filters': {
         'require_debug_true': {
             '()': 'django.utils.log.RequireDebugTrue',
         },
+        'sample_info': {
+            '()': 'library.log.SamplingFilter',
+            'rate': LOG_INFO_SAMPLE_RATE,
+            'level': 'INFO',
+        },
     },
     'handlers': {
         'console': {
@@ -196,9 +347,15 @@ LOGGING = {
             'formatter': 'simple',
         },
         'file': {
-            'class': 'logging.FileHandler',
+            'class': 'library.log.AsyncFileHandler',
             'filename': BASE_DIR / 'logs' / 'django.log',
-            'formatter': 'verbose',
+            'rotation': LOG_ROTATION,
+            'max_bytes': LOG_MAX_BYTES,
+            'backup_count': LOG_BACKUP_COUNT,
+            'when': LOG_ROTATION_WHEN,
+            'queue_size': LOG_QUEUE_SIZE,
+            'formatter': 'json',
+            'filters': ['sample_info'],
         },
     },
     'root': {
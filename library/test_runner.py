@@ -0,0 +1,41 @@
+"""
+Test runner that gives every test an empty cache.
+
+The test database is rolled back after each test, but the local-memory
+cache is not, so a page or count cached by one test would be served to the
+next. Clearing every cache when a test starts keeps the tests independent
+without each test class having to do it. This works with ``--parallel``
+too, where the tests run in worker processes.
+"""
+
+import unittest
+
+from django.core.cache import caches
+from django.test.runner import DiscoverRunner, ParallelTestSuite, RemoteTestResult, RemoteTestRunner
+
+
+class ClearCachesMixin:
+    def startTest(self, test):
+        for cache in caches.all():
+            cache.clear()
+        super().startTest(test)
+
+
+class ClearCachesRemoteResult(ClearCachesMixin, RemoteTestResult):
+    pass
+
+
+class ClearCachesRemoteRunner(RemoteTestRunner):
+    resultclass = ClearCachesRemoteResult
+
+
+class ClearCachesParallelSuite(ParallelTestSuite):
+    runner_class = ClearCachesRemoteRunner
+
+
+class TestRunner(DiscoverRunner):
+    parallel_test_suite = ClearCachesParallelSuite
+
+    def get_resultclass(self):
+        base = super().get_resultclass() or unittest.TextTestResult
+        return type(f'ClearCaches{base.__name__}', (ClearCachesMixin, base), {})
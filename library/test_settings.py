@@ -0,0 +1,50 @@
+"""
+Settings for running the test suite.
+
+Used automatically by ``manage.py test``. Passwords are hashed with MD5
+instead of PBKDF2 and the database lives in memory, which together cut
+the suite's wall-clock time several-fold. Both choices are unsafe outside
+of tests. The cache is a local-memory cache of its own, emptied before each
+test by ``library.test_runner``, so runs never share cached pages or counts
+with each other or with a configured shared cache. With no other process
+using it, it counts as shared.
+"""
+
+import uuid
+
+from .settings import *  # noqa: F401,F403
+
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+CACHES = {
+    'default': {
+        **CACHES['default'],  # noqa: F405
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'tests-{uuid.uuid4().hex}',
+    }
+}
+
+# The test process is the only one using it
+CACHE_SHARED = True
+
+# assertNumQueries turns on query logging, which with DEBUG would print every
+# statement, and the event stream tests start asyncio's debug chatter
+LOGGING = {
+    **LOGGING,  # noqa: F405
+    'loggers': {
+        **LOGGING['loggers'],  # noqa: F405
+        'django.db.backends': {'level': 'WARNING'},
+        'asyncio': {'level': 'WARNING'},
+    },
+}
+
+TEST_RUNNER = 'library.test_runner.TestRunner'
@@ -21,7 +21,7 @@ setup() {
     source venv/bin/activate
     pip install -r requirements.txt
     python manage.py migrate
-    python manage.py test
+    python manage.py test --parallel auto
     echo "Setup complete."
 }
 